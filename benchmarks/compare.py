@@ -0,0 +1,65 @@
+"""
+Compares two benchmark result files, exits with 1 when a case got slower.
+
+    python -m benchmarks.compare baseline.json current.json --tolerance 0.2 --metric p95_ms
+"""
+__all__ = ['Regression', 'compare', 'report']
+
+import argparse
+import json
+import sys
+from collections import namedtuple
+from typing import List
+
+Regression = namedtuple('Regression', ['case', 'baseline', 'current', 'change'])
+
+# latency metrics grow when things get worse, throughput shrinks
+_HIGHER_IS_BETTER = {'ops_per_sec'}
+
+
+def compare(baseline: dict, current: dict, tolerance: float = 0.2, metric: str = 'p95_ms',
+            min_delta: float = 0.05) -> List[Regression]:
+    """
+    Cases present in both results whose ``metric`` is more than ``tolerance`` (a fraction) worse. Latency
+    changes under ``min_delta`` milliseconds are noise and never count.
+    """
+    regressions = []
+    for case, stats in current['results'].items():
+        before = baseline['results'].get(case, {}).get(metric)
+        after = stats.get(metric)
+        if before is None or after is None or before == 0:
+            continue
+        if metric in _HIGHER_IS_BETTER:
+            change = (before - after) / before
+            worse = change > tolerance
+        else:
+            change = (after - before) / before
+            worse = change > tolerance and after - before >= min_delta
+        if worse:
+            regressions.append(Regression(case, before, after, change))
+    return regressions
+
+
+def report(regressions: List[Regression], metric: str = 'p95_ms') -> str:
+    if not regressions:
+        return f'no regressions in {metric}'
+    lines = [f'{len(regressions)} regression(s) in {metric}:']
+    lines.extend(f'  {r.case:<30} {r.baseline:.3f} -> {r.current:.3f} ({r.change:+.0%})' for r in regressions)
+    return '\n'.join(lines)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown, 0.2 is 20%%')
+    parser.add_argument('--metric', default='p95_ms')
+    args = parser.parse_args(argv)
+    with open(args.baseline) as baseline, open(args.current) as current:
+        regressions = compare(json.load(baseline), json.load(current), args.tolerance, args.metric)
+    print(report(regressions, args.metric))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,30 @@
+__all__ = ['percentile', 'summarize', 'timed']
+
+import time
+from typing import List, Sequence
+
+
+def percentile(sorted_values: Sequence[float], fraction: float) -> float:
+    """Nearest-rank percentile of already sorted values."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies: List[float], elapsed: float = None) -> dict:
+    """Latencies in seconds in, milliseconds and operations per second out."""
+    values = sorted(latencies)
+    elapsed = elapsed if elapsed is not None else sum(values)
+    return {'count': len(values),
+            'p50_ms': percentile(values, 0.50) * 1000,
+            'p95_ms': percentile(values, 0.95) * 1000,
+            'p99_ms': percentile(values, 0.99) * 1000,
+            'max_ms': (values[-1] if values else 0.0) * 1000,
+            'ops_per_sec': len(values) / elapsed if elapsed else 0.0}
+
+
+def timed(func, *args, **kwargs) -> float:
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
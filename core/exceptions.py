@@ -24,3 +24,21 @@ class SecurityException(InnerException):
 
 class TimeoutException(InnerException):
     pass
+
+
+class OverloadException(InnerException):
+    pass
+
+
+class RateLimitException(InnerException):
+    def __init__(self, message: str = 'Too many attempts!', retry_after: float = None):
+        super().__init__(message)
+        # seconds until an attempt can be admitted again
+        self.retry_after = retry_after
+
+
+class OutOfStockException(InnerException):
+    def __init__(self, message: str = 'Not enough stock!', product_ids=()):
+        super().__init__(message)
+        # products of the order that could not be reserved
+        self.product_ids = list(product_ids)
@@ -1,3 +1,214 @@
+"""
+Structured logging: JSON lines written by a background listener, so logging threads only put records on a queue.
 
+    listener = configure_logging()          # once, at start up
+    with correlation_scope():               # per request
+        log_event(logger, logging.WARNING, 'token.failed', user_id=3, sample='token.failed')
+"""
+__all__ = ['JsonFormatter', 'CorrelationFilter', 'SamplingFilter', 'NonBlockingQueueHandler', 'configure_logging',
+           'shutdown_logging', 'correlation_scope', 'get_correlation_id', 'set_correlation_id', 'log_event']
 
+import contextvars
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Callable, Iterator, Optional
 
+from core.exceptions import ValueException
+
+_correlation_id = contextvars.ContextVar('numen_correlation_id', default=None)
+
+# attributes every LogRecord has; anything else came in through ``extra``
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+# argument types that can be formatted later on the listener thread without seeing a later change
+_IMMUTABLE = (str, int, float, bool, type(None), bytes)
+
+# until configure_logging runs, numen records go nowhere instead of to logging's last resort stderr handler
+logging.getLogger('numen').addHandler(logging.NullHandler())
+
+
+def get_correlation_id() -> Optional[str]:
+    return _correlation_id.get()
+
+
+def set_correlation_id(correlation_id: Optional[str]):
+    _correlation_id.set(correlation_id)
+
+
+@contextmanager
+def correlation_scope(correlation_id: str = None) -> Iterator[str]:
+    """Tags every record logged inside the block (in this thread or task) with one id, a new one by default."""
+    token = _correlation_id.set(correlation_id or uuid.uuid4().hex)
+    try:
+        yield _correlation_id.get()
+    finally:
+        _correlation_id.reset(token)
+
+
+class CorrelationFilter(logging.Filter):
+    """Copies the correlation id onto the record; must run in the logging thread, before the queue."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, 'correlation_id'):
+            record.correlation_id = _correlation_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Thins out records logged with ``extra={'sample': key}``: per key and ``window`` seconds the first ``burst``
+    pass, then one in ``every``. Passing records carry ``sampled``, the number of records they stand for.
+    Records without a sample key always pass.
+    """
+
+    def __init__(self, burst: int = 10, every: int = 100, window: float = 60.0,
+                 clock: Callable[[], float] = time.monotonic):
+        super().__init__()
+        self.burst = burst
+        self.every = every
+        self.window = window
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, 'sample', None)
+        if key is None:
+            return True
+        now = self._clock()
+        with self._lock:
+            start, count = self._counts.get(key, (now, 0))
+            if now - start >= self.window:
+                start, count = now, 0
+            count += 1
+            self._counts[key] = (start, count)
+        if count <= self.burst:
+            record.sampled = 1
+            return True
+        if (count - self.burst) % self.every == 0:
+            record.sampled = self.every
+            return True
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, correlation id and every ``extra`` field."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        document = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        correlation_id = getattr(record, 'correlation_id', None)
+        if correlation_id:
+            document['correlation_id'] = correlation_id
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES and name != 'correlation_id':
+                document[name] = value
+        if record.exc_info:
+            document['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            document['exception'] = record.exc_text
+        if record.stack_info:
+            document['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(document, default=str)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Puts records on a bounded queue and never waits: when the listener falls behind, records are dropped and
+    counted in ``dropped``. Messages with plain arguments are formatted on the listener thread.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(vars(record))
+        args = record.args
+        values = args.values() if isinstance(args, dict) else (args or ())
+        if not isinstance(record.msg, str) or not all(isinstance(value, _IMMUTABLE) for value in values):
+            # a mutable argument could change before the listener gets to it, format it now
+            record.msg, record.args = record.getMessage(), None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        # the traceback would keep every frame alive until the listener is done
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional[NonBlockingQueueHandler] = None
+
+
+def configure_logging(level: str = None, json_output: bool = None, stream=None, queue_size: int = None,
+                      sampler: SamplingFilter = None) -> QueueListener:
+    """
+    Routes the root logger through a queue to a listener thread writing to ``stream`` (stderr). Defaults come
+    from ``NUMEN_LOG_LEVEL`` (INFO), ``NUMEN_LOG_JSON`` (1) and ``NUMEN_LOG_QUEUE_SIZE`` (10000).
+    """
+    global _listener, _queue_handler
+    shutdown_logging()
+    level = level or os.environ.get('NUMEN_LOG_LEVEL', 'INFO')
+    if json_output is None:
+        json_output = os.environ.get('NUMEN_LOG_JSON', '1').lower() in ('1', 'true', 'yes', 'on')
+    queue_size = queue_size if queue_size is not None else int(os.environ.get('NUMEN_LOG_QUEUE_SIZE', 10000))
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if json_output else logging.Formatter(
+        '%(asctime)s %(levelname)s %(name)s [%(correlation_id)s] %(message)s'))
+    _queue_handler = NonBlockingQueueHandler(queue.Queue(queue_size))
+    # filters run in the logging thread: the correlation id lives there, and sampled out records never queue
+    _queue_handler.addFilter(CorrelationFilter())
+    _queue_handler.addFilter(sampler or SamplingFilter())
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(_queue_handler)
+    _listener = QueueListener(_queue_handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging():
+    """Writes out what is queued and detaches the queue handler."""
+    global _listener, _queue_handler
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if _queue_handler is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _queue_handler = None
+
+
+def log_event(logger: logging.Logger, level: int, event: str, sample: str = None, **fields):
+    """
+    Logs ``event`` with ``fields`` as structured data. Returns at once when the level is off, before any
+    argument is put together; ``sample`` names the stream for the SamplingFilter. Field names of LogRecord's
+    own attributes (``message``, ``name``, ``msg``...) are refused with a ValueException.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    reserved = _RECORD_ATTRIBUTES.intersection(fields)
+    if reserved:
+        raise ValueException(f'Reserved log field names: {", ".join(sorted(reserved))}')
+    if sample is not None:
+        fields['sample'] = sample
+    fields['event'] = event
+    logger.log(level, event, extra=fields)
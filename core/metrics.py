@@ -0,0 +1,267 @@
+__all__ = ['Counter', 'Gauge', 'Histogram', 'Registry', 'REGISTRY', 'DEFAULT_BUCKETS', 'prometheus_text',
+           'start_metrics_server', 'instrument_handler', 'set_log_sink', 'emit_event', 'slow_threshold']
+
+import asyncio
+import bisect
+import functools
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from core.logging import log_event
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} takes the labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(labels[name] for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError()
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{_labels(self.labelnames, key)} {_number(value)}' for key, value in values]
+
+
+class Gauge(_Metric):
+    """A value read when the metrics are rendered, from ``function`` (returns ``{label values: value}``)."""
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, function: Callable[[], Dict[tuple, float]],
+                 labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def samples(self) -> List[str]:
+        return [f'{self.name}{_labels(self.labelnames, key)} {_number(value)}'
+                for key, value in sorted(self.function().items())]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label values: [count per bucket (+Inf last), sum]
+        self._series: Dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return sum(series[0]) if series else 0
+
+    def sum(self, **labels) -> float:
+        series = self._series.get(self._key(labels))
+        return series[1] if series else 0.0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, (list(counts), total)) for key, (counts, total) in self._series.items())
+        lines = []
+        for key, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, key)} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        """Registers ``metric``; a metric of the same name that is already there is returned instead."""
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def unregister(self, name: str):
+        with self._lock:
+            self._metrics.pop(name, None)
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        return ''.join(metric.render() + '\n' for metric in metrics)
+
+
+REGISTRY = Registry()
+
+
+def prometheus_text(registry: Registry = None) -> str:
+    """The metrics in the Prometheus text exposition format (version 0.0.4)."""
+    return (registry or REGISTRY).render()
+
+
+def start_metrics_server(port: int, address: str = '', registry: Registry = None) -> ThreadingHTTPServer:
+    """Serves ``/metrics`` on a daemon thread; ``server.shutdown()`` stops it."""
+    registry = registry or REGISTRY
+
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = prometheus_text(registry).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((address, port), MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
+
+
+# structured log sink: every event is a flat dict, by default logged on 'numen.metrics' through
+# core.logging.log_event with the dict as ``record.metrics``, so a formatter can write it out as fields
+_logger = logging.getLogger('numen.metrics')
+
+
+def _log_to_logger(event: dict):
+    log_event(_logger, logging.WARNING if event.get('slow') else logging.DEBUG, event['event'], metrics=event)
+
+
+_log_sink: Callable[[dict], None] = _log_to_logger
+
+
+def set_log_sink(sink: Callable[[dict], None] = None):
+    """Replaces where events go; None goes back to the 'numen.metrics' logger."""
+    global _log_sink
+    _log_sink = sink or _log_to_logger
+
+
+def emit_event(event: dict):
+    """Hands a metrics event to the sink, see set_log_sink."""
+    _log_sink(event)
+
+
+def slow_threshold() -> float:
+    """Seconds after which a call or statement is logged as slow, from ``NUMEN_SLOW_MS`` (default 500)."""
+    return float(os.environ.get('NUMEN_SLOW_MS', 500)) / 1000
+
+
+HANDLER_SECONDS = REGISTRY.register(Histogram('numen_handler_seconds', 'Handler call latency in seconds.',
+                                              ('handler', 'method', 'outcome')))
+
+
+def _record(handler: str, method: str, start: float, outcome: str):
+    elapsed = time.perf_counter() - start
+    HANDLER_SECONDS.observe(elapsed, handler=handler, method=method, outcome=outcome)
+    slow = elapsed >= slow_threshold()
+    if slow or _log_sink is not _log_to_logger or _logger.isEnabledFor(logging.DEBUG):
+        emit_event({'event': 'handler.call', 'name': f'{handler}.{method}', 'outcome': outcome,
+                   'duration_ms': elapsed * 1000, 'slow': slow})
+
+
+def _timed(handler: str, method: str, function):
+    if asyncio.iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def async_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            outcome = 'error'
+            try:
+                result = await function(*args, **kwargs)
+                outcome = 'ok'
+                return result
+            finally:
+                _record(handler, method, start, outcome)
+        return async_wrapper
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        outcome = 'error'
+        try:
+            result = function(*args, **kwargs)
+            outcome = 'ok'
+            return result
+        finally:
+            # InnerException derives from BaseException, so the outcome is set rather than caught
+            _record(handler, method, start, outcome)
+    return wrapper
+
+
+def instrument_handler(cls):
+    """Class decorator: every public classmethod/staticmethod reports to ``numen_handler_seconds``."""
+    for name, attribute in list(vars(cls).items()):
+        if name.startswith('_') or not isinstance(attribute, (classmethod, staticmethod)):
+            continue
+        setattr(cls, name, type(attribute)(_timed(cls.__name__, name, attribute.__func__)))
+    return cls
@@ -0,0 +1,104 @@
+import io
+import json
+import logging
+import queue
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from core.exceptions import ValueException
+from core.logging import JsonFormatter, CorrelationFilter, SamplingFilter, NonBlockingQueueHandler, \
+    configure_logging, shutdown_logging, correlation_scope, get_correlation_id, log_event
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def record(msg='message', args=(), **extra):
+    r = logging.LogRecord('numen.test', logging.WARNING, __file__, 1, msg, args, None)
+    r.__dict__.update(extra)
+    return r
+
+
+class LoggingTest(TestCase):
+
+    def tearDown(self) -> None:
+        shutdown_logging()
+
+    def test_json_formatter(self):
+        document = json.loads(JsonFormatter().format(record('user %s', ('3',), correlation_id='abc', user_id=3)))
+        self.assertEqual('user 3', document['message'])
+        self.assertEqual('WARNING', document['level'])
+        self.assertEqual('numen.test', document['logger'])
+        self.assertEqual('abc', document['correlation_id'])
+        self.assertEqual(3, document['user_id'])
+        self.assertNotIn('args', document)
+
+    def test_correlation_scope(self):
+        self.assertIsNone(get_correlation_id())
+        with correlation_scope('outer') as outer:
+            with correlation_scope() as inner:
+                r = record()
+                CorrelationFilter().filter(r)
+                self.assertEqual(inner, r.correlation_id)
+            self.assertEqual('outer', get_correlation_id())
+        self.assertEqual('outer', outer)
+        self.assertIsNone(get_correlation_id())
+
+    def test_sampling(self):
+        clock = Clock()
+        sampler = SamplingFilter(burst=2, every=3, window=10, clock=clock)
+        passed = [sampler.filter(record(sample='token.failed')) for _ in range(8)]
+        self.assertEqual([True, True, False, False, True, False, False, True], passed)
+        self.assertTrue(sampler.filter(record()))
+        sampled = record(sample='token.failed')
+        clock.now = 10
+        self.assertTrue(sampler.filter(sampled))
+        self.assertEqual(1, sampled.sampled)
+
+    def test_queue_handler_never_blocks(self):
+        handler = NonBlockingQueueHandler(queue.Queue(1))
+        handler.handle(record())
+        handler.handle(record())
+        self.assertEqual(1, handler.dropped)
+
+    def test_formatting_is_left_to_the_listener_for_plain_arguments(self):
+        handler = NonBlockingQueueHandler(queue.Queue())
+        handler.handle(record('%s of %d', ('one', 2)))
+        mutable = ['before']
+        handler.handle(record('%s', (mutable,)))
+        mutable[0] = 'after'
+        plain, formatted = handler.queue.get(), handler.queue.get()
+        self.assertEqual(('one', 2), plain.args)
+        self.assertEqual('one of 2', plain.getMessage())
+        self.assertEqual("['before']", formatted.getMessage())
+
+    def test_configure_logging_writes_json_lines(self):
+        stream = io.StringIO()
+        configure_logging('INFO', stream=stream, sampler=SamplingFilter(burst=1, every=1000))
+        logger = logging.getLogger('numen.test')
+        with correlation_scope('request-1'):
+            for _ in range(3):
+                log_event(logger, logging.WARNING, 'token.failed', sample='token.failed', user_id=1)
+            log_event(logger, logging.DEBUG, 'not.logged')
+        shutdown_logging()
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual(1, len(lines))
+        self.assertEqual('token.failed', lines[0]['event'])
+        self.assertEqual('request-1', lines[0]['correlation_id'])
+        self.assertEqual(1, lines[0]['user_id'])
+
+    def test_reserved_field_names_are_refused(self):
+        logger = logging.getLogger('numen.test')
+        with self.assertRaises(ValueException) as _ex:
+            log_event(logger, logging.WARNING, 'token.failed', message='text', name='x')
+        self.assertEqual('Reserved log field names: message, name', str(_ex.exception))
+
+    def test_unconfigured_numen_records_skip_the_last_resort_handler(self):
+        with patch.object(logging, 'lastResort', Mock(level=logging.WARNING)) as last_resort:
+            log_event(logging.getLogger('numen.test'), logging.WARNING, 'token.failed', user_id=1)
+        last_resort.handle.assert_not_called()
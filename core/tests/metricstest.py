@@ -0,0 +1,104 @@
+import asyncio
+import urllib.request
+from unittest import TestCase
+
+from core.exceptions import ValueException
+from core.metrics import Counter, Gauge, Histogram, Registry, prometheus_text, start_metrics_server, \
+    instrument_handler, set_log_sink, emit_event, HANDLER_SECONDS
+
+
+@instrument_handler
+class SampleHandler:
+    _helper = None
+
+    @classmethod
+    def ok(cls, value):
+        return value
+
+    @classmethod
+    def fail(cls):
+        raise ValueException('bad value')
+
+    @classmethod
+    async def ok_async(cls, value):
+        return value
+
+    @classmethod
+    def _private(cls):
+        return 'private'
+
+
+class MetricsTest(TestCase):
+
+    def test_histogram_buckets_and_text(self):
+        registry = Registry()
+        histogram = registry.register(Histogram('latency_seconds', 'Latency.', ('method',), buckets=(0.1, 1)))
+        histogram.observe(0.05, method='get')
+        histogram.observe(0.5, method='get')
+        histogram.observe(5, method='get')
+        self.assertEqual(3, histogram.count(method='get'))
+        self.assertEqual(['# HELP latency_seconds Latency.',
+                          '# TYPE latency_seconds histogram',
+                          'latency_seconds_bucket{method="get",le="0.1"} 1',
+                          'latency_seconds_bucket{method="get",le="1"} 2',
+                          'latency_seconds_bucket{method="get",le="+Inf"} 3',
+                          'latency_seconds_sum{method="get"} 5.55',
+                          'latency_seconds_count{method="get"} 3'], prometheus_text(registry).splitlines())
+
+    def test_counter_gauge_and_label_check(self):
+        registry = Registry()
+        counter = registry.register(Counter('rows_total', 'Rows.', ('operation',)))
+        counter.inc(3, operation='SELECT')
+        self.assertIs(counter, registry.register(Counter('rows_total', 'Rows.', ('operation',))))
+        registry.register(Gauge('open', 'Open "things".', lambda: {(): 2}))
+        text = prometheus_text(registry)
+        self.assertIn('rows_total{operation="SELECT"} 3', text)
+        self.assertIn('open 2', text)
+        with self.assertRaises(ValueError):
+            counter.inc(operation='SELECT', table='users')
+
+    def test_handler_calls_are_measured(self):
+        before_ok = HANDLER_SECONDS.count(handler='SampleHandler', method='ok', outcome='ok')
+        before_error = HANDLER_SECONDS.count(handler='SampleHandler', method='fail', outcome='error')
+        self.assertEqual(1, SampleHandler.ok(1))
+        with self.assertRaises(ValueException):
+            SampleHandler.fail()
+        self.assertEqual(2, asyncio.run(SampleHandler.ok_async(2)))
+        self.assertEqual(before_ok + 1, HANDLER_SECONDS.count(handler='SampleHandler', method='ok', outcome='ok'))
+        self.assertEqual(before_error + 1,
+                         HANDLER_SECONDS.count(handler='SampleHandler', method='fail', outcome='error'))
+        self.assertEqual(1, HANDLER_SECONDS.count(handler='SampleHandler', method='ok_async', outcome='ok'))
+        self.assertEqual('private', SampleHandler._private())
+        self.assertEqual(0, HANDLER_SECONDS.count(handler='SampleHandler', method='_private', outcome='ok'))
+
+    def test_log_sink_gets_events(self):
+        events = []
+        set_log_sink(events.append)
+        try:
+            SampleHandler.ok(1)
+        finally:
+            set_log_sink(None)
+        self.assertEqual('handler.call', events[0]['event'])
+        self.assertEqual('SampleHandler.ok', events[0]['name'])
+        self.assertEqual('ok', events[0]['outcome'])
+        self.assertFalse(events[0]['slow'])
+
+    def test_slow_events_are_logged_as_structured_events(self):
+        event = {'event': 'handler.call', 'name': 'SampleHandler.ok', 'duration_ms': 900.0, 'slow': True}
+        with self.assertLogs('numen.metrics', 'WARNING') as logs:
+            emit_event(event)
+        self.assertEqual('handler.call', logs.records[0].event)
+        self.assertEqual(event, logs.records[0].metrics)
+
+    def test_metrics_server(self):
+        registry = Registry()
+        registry.register(Counter('hits_total', 'Hits.')).inc()
+        server = start_metrics_server(0, '127.0.0.1', registry)
+        try:
+            url = f'http://127.0.0.1:{server.server_address[1]}/metrics'
+            with urllib.request.urlopen(url) as response:
+                self.assertIn('text/plain', response.headers['Content-Type'])
+                self.assertIn('hits_total 1', response.read().decode())
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,3 @@
+__all__ = ['upgrade', 'downgrade', 'current_revision', 'applied_revisions', 'MIGRATIONS']
+
+from domain.migrations.runner import upgrade, downgrade, current_revision, applied_revisions, MIGRATIONS
@@ -0,0 +1,16 @@
+import argparse
+
+from domain.migrations import upgrade, downgrade, current_revision
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m domain.migrations', description='Database schema migrations')
+    parser.add_argument('command', choices=['upgrade', 'downgrade', 'current'])
+    parser.add_argument('target', nargs='?', help="revision to stop at, 'base' reverts everything")
+    args = parser.parse_args()
+
+    if args.command == 'current':
+        print(current_revision() or 'base')
+    elif args.command == 'upgrade':
+        print('applied:', ', '.join(upgrade(target=args.target)) or 'nothing')
+    else:
+        print('reverted:', ', '.join(downgrade(target=args.target)) or 'nothing')
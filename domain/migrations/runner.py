@@ -0,0 +1,89 @@
+from datetime import datetime
+from typing import List
+
+from sqlalchemy import MetaData, Table, Column, String, DateTime, select
+
+from core.exceptions import ValueException
+from domain.migrations.versions import MIGRATIONS
+from domain.models import DBInitializer
+
+# kept out of the models metadata so create_all/drop_all never touch the migration history
+_metadata = MetaData()
+schema_migrations = Table('schema_migrations', _metadata,
+                          Column('revision', String, primary_key=True),
+                          Column('applied_at', DateTime, nullable=False))
+
+
+def _revisions() -> List[str]:
+    return [migration.revision for migration in MIGRATIONS]
+
+
+def _check_target(target: str):
+    if target is not None and target != 'base' and target not in _revisions():
+        raise ValueException(f'Unknown migration revision: {target}')
+
+
+def applied_revisions(engine=None) -> List[str]:
+    engine = engine or DBInitializer.get_engine()
+    _metadata.create_all(bind=engine)
+    with engine.connect() as connection:
+        applied = {row.revision for row in connection.execute(select(schema_migrations.c.revision))}
+    return [revision for revision in _revisions() if revision in applied]
+
+
+def current_revision(engine=None) -> str:
+    applied = applied_revisions(engine)
+    return applied[-1] if applied else None
+
+
+def _run(engine, migration, step: str):
+    def record(connection):
+        if step == 'upgrade':
+            connection.execute(schema_migrations.insert().values(revision=migration.revision,
+                                                                 applied_at=datetime.utcnow()))
+        else:
+            connection.execute(schema_migrations.delete().where(schema_migrations.c.revision == migration.revision))
+
+    if getattr(migration, 'transactional', True):
+        with engine.begin() as connection:
+            getattr(migration, step)(connection)
+            record(connection)
+        return
+    with engine.connect() as connection:
+        connection = connection.execution_options(isolation_level='AUTOCOMMIT')
+        getattr(migration, step)(connection)
+        record(connection)
+
+
+def upgrade(engine=None, target: str = None) -> List[str]:
+    """Applies pending migrations up to and including ``target`` (all of them by default)."""
+    _check_target(target)
+    engine = engine or DBInitializer.get_engine()
+    applied = set(applied_revisions(engine))
+    done = []
+    for migration in MIGRATIONS:
+        if migration.revision not in applied:
+            _run(engine, migration, 'upgrade')
+            done.append(migration.revision)
+        if migration.revision == target:
+            break
+    return done
+
+
+def downgrade(engine=None, target: str = None) -> List[str]:
+    """Reverts migrations newer than ``target``; ``'base'`` reverts all, no target reverts the last one."""
+    _check_target(target)
+    engine = engine or DBInitializer.get_engine()
+    applied = applied_revisions(engine)
+    if target is None:
+        to_revert = applied[-1:]
+    elif target == 'base':
+        to_revert = applied
+    else:
+        to_revert = applied[applied.index(target) + 1:] if target in applied else []
+    done = []
+    for migration in reversed(MIGRATIONS):
+        if migration.revision in to_revert:
+            _run(engine, migration, 'downgrade')
+            done.append(migration.revision)
+    return done
@@ -0,0 +1,10 @@
+# Schema migrations, applied in this order. Each module defines ``revision``, ``description``,
+# ``upgrade(connection)`` and ``downgrade(connection)``; ``transactional = False`` runs it outside a
+# transaction (needed for CREATE INDEX CONCURRENTLY).
+from domain.migrations.versions import m0001_token_indexes, m0002_token_time_limit_index, \
+    m0003_product_listing_indexes, m0004_product_search_index, m0005_orders, m0006_effective_price, \
+    m0007_image_manifests, m0008_outbox, m0009_order_prices
+
+MIGRATIONS = [m0001_token_indexes, m0002_token_time_limit_index, m0003_product_listing_indexes,
+              m0004_product_search_index, m0005_orders, m0006_effective_price,
+              m0007_image_manifests, m0008_outbox, m0009_order_prices]
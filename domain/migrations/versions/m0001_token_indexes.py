@@ -0,0 +1,24 @@
+from sqlalchemy import text
+
+revision = '0001'
+description = 'token lookup indexes'
+# postgres builds the indexes concurrently so the tokens table stays writable, which can't run in a transaction
+transactional = False
+
+
+def _concurrently(connection) -> str:
+    return 'CONCURRENTLY ' if connection.dialect.name == 'postgresql' else ''
+
+
+def upgrade(connection):
+    concurrently = _concurrently(connection)
+    connection.execute(text(f'CREATE INDEX {concurrently}IF NOT EXISTS ix_tokens_user_exchange_requested '
+                            f'ON tokens (user_id, exchange_method, requested_time DESC)'))
+    connection.execute(text(f'CREATE UNIQUE INDEX {concurrently}IF NOT EXISTS ix_tokens_url_token '
+                            f'ON tokens (url_token)'))
+
+
+def downgrade(connection):
+    concurrently = _concurrently(connection)
+    connection.execute(text(f'DROP INDEX {concurrently}IF EXISTS ix_tokens_url_token'))
+    connection.execute(text(f'DROP INDEX {concurrently}IF EXISTS ix_tokens_user_exchange_requested'))
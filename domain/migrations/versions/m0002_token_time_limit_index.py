@@ -0,0 +1,18 @@
+from sqlalchemy import text
+
+revision = '0002'
+description = 'token expiry index for the sweeper'
+transactional = False
+
+
+def _concurrently(connection) -> str:
+    return 'CONCURRENTLY ' if connection.dialect.name == 'postgresql' else ''
+
+
+def upgrade(connection):
+    connection.execute(text(f'CREATE INDEX {_concurrently(connection)}IF NOT EXISTS ix_tokens_time_limit '
+                            f'ON tokens (time_limit)'))
+
+
+def downgrade(connection):
+    connection.execute(text(f'DROP INDEX {_concurrently(connection)}IF EXISTS ix_tokens_time_limit'))
@@ -0,0 +1,28 @@
+from sqlalchemy import text
+
+revision = '0003'
+description = 'product listing indexes for keyset pagination'
+transactional = False
+
+INDEXES = {
+    'ix_products_price': 'price, uid',
+    'ix_products_category_price': 'category_id, price, uid',
+    'ix_products_category_uid': 'category_id, uid',
+    'ix_products_collection_price': 'collection_id, price, uid',
+    'ix_products_collection_uid': 'collection_id, uid',
+}
+
+
+def _concurrently(connection) -> str:
+    return 'CONCURRENTLY ' if connection.dialect.name == 'postgresql' else ''
+
+
+def upgrade(connection):
+    for name, columns in INDEXES.items():
+        connection.execute(text(f'CREATE INDEX {_concurrently(connection)}IF NOT EXISTS {name} '
+                                f'ON products ({columns})'))
+
+
+def downgrade(connection):
+    for name in reversed(list(INDEXES)):
+        connection.execute(text(f'DROP INDEX {_concurrently(connection)}IF EXISTS {name}'))
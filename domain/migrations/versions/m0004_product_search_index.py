@@ -0,0 +1,20 @@
+from sqlalchemy import text
+
+revision = '0004'
+description = 'full text search index on products (postgres only)'
+transactional = False
+
+
+def upgrade(connection):
+    if connection.dialect.name != 'postgresql':
+        # other databases search with the in process index
+        return
+    connection.execute(text("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_products_search ON products USING GIN "
+                            "((setweight(to_tsvector('simple'::regconfig, title), 'A') || "
+                            "setweight(to_tsvector('simple'::regconfig, description), 'B')))"))
+
+
+def downgrade(connection):
+    if connection.dialect.name != 'postgresql':
+        return
+    connection.execute(text('DROP INDEX CONCURRENTLY IF EXISTS ix_products_search'))
@@ -0,0 +1,51 @@
+from sqlalchemy import MetaData, Table, Column, Integer, Float, DateTime, ForeignKey, Index, inspect, text
+
+revision = '0005'
+description = 'product stock, carts and orders'
+
+# the tables as this revision made them; later model changes come with revisions of their own
+_metadata = MetaData()
+# referenced by the foreign keys only, never created here
+Table('users', _metadata, Column('uid', Integer, primary_key=True))
+Table('products', _metadata, Column('uid', Integer, primary_key=True))
+
+carts = Table('carts', _metadata,
+              Column('uid', Integer, primary_key=True, unique=True, autoincrement=True),
+              Column('user_id', Integer, ForeignKey('users.uid'), nullable=False, unique=True),
+              Column('updated_time', DateTime, nullable=False))
+cart_items = Table('cart_items', _metadata,
+                   Column('uid', Integer, primary_key=True, unique=True, autoincrement=True),
+                   Column('cart_id', Integer, ForeignKey('carts.uid'), nullable=False),
+                   Column('product_id', Integer, ForeignKey('products.uid'), nullable=False),
+                   Column('quantity', Integer, nullable=False),
+                   Index('ix_cart_items_cart_product', 'cart_id', 'product_id', unique=True))
+orders = Table('orders', _metadata,
+               Column('uid', Integer, primary_key=True, unique=True, autoincrement=True),
+               Column('user_id', Integer, ForeignKey('users.uid'), nullable=False),
+               Column('state', Integer, nullable=False),
+               Column('total', Float, nullable=False),
+               Column('placed_time', DateTime, nullable=False))
+Index('ix_orders_user_placed', orders.c.user_id, orders.c.placed_time.desc())
+order_lines = Table('order_lines', _metadata,
+                    Column('uid', Integer, primary_key=True, unique=True, autoincrement=True),
+                    Column('order_id', Integer, ForeignKey('orders.uid'), nullable=False, index=True),
+                    Column('product_id', Integer, ForeignKey('products.uid'), nullable=False),
+                    Column('quantity', Integer, nullable=False),
+                    Column('unit_price', Float, nullable=False))
+
+# parents first; dropped in reverse
+TABLES = [carts, cart_items, orders, order_lines]
+
+
+def upgrade(connection):
+    if 'stock' not in {column['name'] for column in inspect(connection).get_columns('products')}:
+        # a constant default: postgres 11+ adds the column without rewriting the table
+        connection.execute(text('ALTER TABLE products ADD COLUMN stock INTEGER NOT NULL DEFAULT 0'))
+    for table in TABLES:
+        table.create(connection, checkfirst=True)
+
+
+def downgrade(connection):
+    for table in reversed(TABLES):
+        table.drop(connection, checkfirst=True)
+    connection.execute(text('ALTER TABLE products DROP COLUMN stock'))
@@ -0,0 +1,67 @@
+from sqlalchemy import MetaData, Table, Column, Integer, Float, Numeric, inspect, text, select, func, update, case, \
+    cast
+
+revision = '0006'
+description = 'stored effective price of products and its listing indexes'
+transactional = False
+
+# the columns as this revision knows them; later model changes come with revisions of their own
+_PRICE = Numeric(12, 2)
+products = Table('products', MetaData(),
+                 Column('uid', Integer, primary_key=True),
+                 Column('price', Float, nullable=False),
+                 Column('discount', Float, nullable=False),
+                 Column('effective_price', _PRICE, nullable=False))
+
+# the listings sort and filter by the effective price instead of the list price
+INDEXES = {
+    'ix_products_effective_price': 'effective_price, uid',
+    'ix_products_category_effective_price': 'category_id, effective_price, uid',
+    'ix_products_collection_effective_price': 'collection_id, effective_price, uid',
+}
+REPLACED = {
+    'ix_products_price': 'price, uid',
+    'ix_products_category_price': 'category_id, price, uid',
+    'ix_products_collection_price': 'collection_id, price, uid',
+}
+# uids per backfill statement, a single UPDATE would hold every row lock of the table until it ends
+BATCH = 10000
+
+
+def _concurrently(connection) -> str:
+    return 'CONCURRENTLY ' if connection.dialect.name == 'postgresql' else ''
+
+
+def _effective_price_sql():
+    # price - discount in exact cents, never below zero; the rule of domain.models.pricing when this revision was made
+    difference = func.round(cast(products.c.price, _PRICE), 2) - func.round(cast(products.c.discount, _PRICE), 2)
+    return cast(case((difference > 0, difference), else_=0), _PRICE)
+
+
+def _backfill(connection):
+    last = connection.execute(select(func.max(products.c.uid))).scalar() or 0
+    for start in range(0, last, BATCH):
+        # the connection autocommits, every batch is a transaction of its own
+        connection.execute(update(products)
+                           .where(products.c.uid > start, products.c.uid <= start + BATCH)
+                           .values(effective_price=_effective_price_sql()))
+
+
+def upgrade(connection):
+    if 'effective_price' not in {column['name'] for column in inspect(connection).get_columns('products')}:
+        connection.execute(text('ALTER TABLE products ADD COLUMN effective_price NUMERIC(12, 2) NOT NULL DEFAULT 0'))
+    _backfill(connection)
+    for name, columns in INDEXES.items():
+        connection.execute(text(f'CREATE INDEX {_concurrently(connection)}IF NOT EXISTS {name} '
+                                f'ON products ({columns})'))
+    for name in REPLACED:
+        connection.execute(text(f'DROP INDEX {_concurrently(connection)}IF EXISTS {name}'))
+
+
+def downgrade(connection):
+    for name, columns in REPLACED.items():
+        connection.execute(text(f'CREATE INDEX {_concurrently(connection)}IF NOT EXISTS {name} '
+                                f'ON products ({columns})'))
+    for name in INDEXES:
+        connection.execute(text(f'DROP INDEX {_concurrently(connection)}IF EXISTS {name}'))
+    connection.execute(text('ALTER TABLE products DROP COLUMN effective_price'))
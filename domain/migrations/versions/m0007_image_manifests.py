@@ -0,0 +1,35 @@
+from sqlalchemy import inspect, text, JSON
+
+revision = '0007'
+description = 'image manifests instead of free text images'
+
+COLUMNS = [('products', 'Images'), ('categories', 'images'), ('collections', 'images')]
+
+
+def _is_json(connection, table: str, column: str) -> bool:
+    return any(c['name'] == column and isinstance(c['type'], JSON) for c in inspect(connection).get_columns(table))
+
+
+def upgrade(connection):
+    quote = connection.dialect.identifier_preparer.quote
+    for table, column in COLUMNS:
+        name = quote(column)
+        # the free text is kept as the url of a single image, see handlers.imagestore.thumbnail_url
+        if connection.dialect.name == 'postgresql':
+            if not _is_json(connection, table, column):
+                connection.execute(text(f"ALTER TABLE {table} ALTER COLUMN {name} TYPE JSON USING CASE "
+                                        f"WHEN {name} IS NULL OR {name} = '' THEN NULL "
+                                        f"ELSE json_build_array(json_build_object('url', {name})) END"))
+        else:
+            # sqlite keeps JSON as text, only the values change
+            connection.execute(text(f"UPDATE {table} SET {name} = CASE WHEN {name} = '' THEN NULL "
+                                    f"ELSE json_array(json_object('url', {name})) END "
+                                    f"WHERE {name} IS NOT NULL AND json_valid({name}) = 0"))
+
+
+def downgrade(connection):
+    quote = connection.dialect.identifier_preparer.quote
+    for table, column in COLUMNS:
+        name = quote(column)
+        if connection.dialect.name == 'postgresql':
+            connection.execute(text(f'ALTER TABLE {table} ALTER COLUMN {name} TYPE VARCHAR USING {name}::text'))
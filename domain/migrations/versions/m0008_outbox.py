@@ -0,0 +1,30 @@
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, Index
+
+revision = '0008'
+description = 'outbox of token notifications'
+
+# the table as this revision made it, see domain.models.outbox
+_metadata = MetaData()
+outbox = Table('outbox', _metadata,
+               Column('uid', Integer, primary_key=True, unique=True, autoincrement=True),
+               Column('channel', String, nullable=False),
+               Column('recipient', String, nullable=False),
+               Column('subject', String, nullable=True),
+               Column('body', String, nullable=False),
+               Column('state', Integer, nullable=False),
+               Column('attempts', Integer, nullable=False),
+               Column('created_time', DateTime, nullable=False),
+               Column('next_attempt_time', DateTime, nullable=False),
+               Column('claim', String, nullable=True),
+               Column('sent_time', DateTime, nullable=True),
+               Column('last_error', String, nullable=True),
+               Index('ix_outbox_state_channel_next', 'state', 'channel', 'next_attempt_time'),
+               Index('ix_outbox_claim', 'claim'))
+
+
+def upgrade(connection):
+    outbox.create(connection, checkfirst=True)
+
+
+def downgrade(connection):
+    outbox.drop(connection, checkfirst=True)
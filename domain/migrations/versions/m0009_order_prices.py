@@ -0,0 +1,29 @@
+from sqlalchemy import inspect, text, Float
+
+revision = '0009'
+description = 'exact order totals and unit prices'
+
+# FLOAT columns of migration 0005 that hold money
+COLUMNS = [('orders', 'total'), ('order_lines', 'unit_price')]
+
+
+def _is_float(connection, table: str, column: str) -> bool:
+    return any(c['name'] == column and isinstance(c['type'], Float) for c in inspect(connection).get_columns(table))
+
+
+def upgrade(connection):
+    # sqlite can't change a column's type and keeps both as its REAL numbers anyway, the ORM reads them as Decimal
+    if connection.dialect.name != 'postgresql':
+        return
+    for table, column in COLUMNS:
+        if _is_float(connection, table, column):
+            connection.execute(text(f'ALTER TABLE {table} ALTER COLUMN {column} TYPE NUMERIC(12, 2) '
+                                    f'USING round({column}::numeric, 2)'))
+
+
+def downgrade(connection):
+    if connection.dialect.name != 'postgresql':
+        return
+    for table, column in COLUMNS:
+        if not _is_float(connection, table, column):
+            connection.execute(text(f'ALTER TABLE {table} ALTER COLUMN {column} TYPE FLOAT'))
@@ -1,8 +1,15 @@
-__all__ = ["User", "Category", "Product", "Collection", "DBInitializer", 'db_Base', "Token"]
+__all__ = ["User", "Category", "Product", "Collection", "DBInitializer", "DBConfig", "session_scope",
+           "async_session_scope", "unit_of_work", "async_unit_of_work", 'db_Base', "Token",
+           "Cart", "CartItem", "Order", "OrderLine", "ReplicaRouter", "read_your_writes_scope",
+           "OutboxMessage"]
 
-from ._db import DBInitializer, Base as db_Base
+from ._db import DBInitializer, DBConfig, session_scope, async_session_scope, unit_of_work, async_unit_of_work, \
+    Base as db_Base
 from .category import Category
 from .collection import Collection
+from .order import Cart, CartItem, Order, OrderLine
+from .outbox import OutboxMessage
 from .product import Product
+from .routing import ReplicaRouter, read_your_writes_scope
 from .token import Token
 from .user import User
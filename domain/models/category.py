@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String
+from sqlalchemy import Column, String, JSON
 from sqlalchemy.orm import relationship
 
 from ._db import Base
@@ -9,6 +9,7 @@ class Category(Entity, Base):
     __tablename__ = 'categories'
     title = Column(String, nullable=False)
     description = Column(String)
-    images = Column(String)
+    # image manifest, see Product.Images
+    images = Column(JSON)
 
     products = relationship('Product', backref='categories')
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String
+from sqlalchemy import Column, String, JSON
 from sqlalchemy.orm import relationship
 
 from ._db import Base
@@ -8,7 +8,8 @@ from .entity import Entity
 class Collection(Entity, Base):
     __tablename__ = 'collections'
     title = Column(String, nullable=False)
-    images = Column(String)
+    # image manifest, see Product.Images
+    images = Column(JSON)
     description = Column(String)
 
     products = relationship("Product", backref="collections")
@@ -0,0 +1,90 @@
+__all__ = ['instrument_engine', 'STATEMENT_SECONDS', 'STATEMENT_ROWS', 'POOL_CHECKOUT_SECONDS']
+
+import functools
+import time
+import weakref
+
+from sqlalchemy import event
+
+from core.metrics import REGISTRY, Counter, Gauge, Histogram, emit_event, slow_threshold
+
+STATEMENT_SECONDS = REGISTRY.register(Histogram('numen_db_statement_seconds', 'Statement execution time in seconds.',
+                                                ('operation',)))
+STATEMENT_ROWS = REGISTRY.register(Counter('numen_db_rows_total', 'Rows written, or read where the driver counts them.',
+                                           ('operation',)))
+POOL_CHECKOUT_SECONDS = REGISTRY.register(Histogram('numen_db_pool_checkout_seconds',
+                                                    'Time spent waiting for a pooled connection in seconds.'))
+
+_OPERATIONS = {'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'}
+# pool -> database url (password hidden); pools of dropped engines go away with them
+_pools = weakref.WeakKeyDictionary()
+
+
+def _checked_out():
+    checked_out = {}
+    for pool, url in list(_pools.items()):
+        if hasattr(pool, 'checkedout'):
+            checked_out[(url,)] = checked_out.get((url,), 0) + pool.checkedout()
+    return checked_out
+
+
+REGISTRY.register(Gauge('numen_db_pool_checked_out', 'Connections currently checked out, per engine.',
+                        _checked_out, ('url',)))
+
+
+def _operation(statement: str) -> str:
+    word = statement.lstrip(' (\n').split(None, 1)[0].upper() if statement.strip() else ''
+    # a fixed label set, one series per statement would never stop growing
+    return word if word in _OPERATIONS else 'OTHER'
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('numen_statement_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['numen_statement_start'].pop()
+    operation = _operation(statement)
+    STATEMENT_SECONDS.observe(elapsed, operation=operation)
+    if cursor.rowcount and cursor.rowcount > 0:
+        STATEMENT_ROWS.inc(cursor.rowcount, operation=operation)
+    if elapsed >= slow_threshold():
+        emit_event({'event': 'db.statement', 'name': operation, 'statement': ' '.join(statement.split())[:500],
+                    'rows': cursor.rowcount, 'duration_ms': elapsed * 1000, 'slow': True})
+
+
+def _handle_error(context):
+    # the statement failed, drop its start time so the stack stays balanced
+    starts = context.connection.info.get('numen_statement_start') if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def _time_checkouts(engine):
+    pool = engine.pool
+    connect = pool.connect
+
+    @functools.wraps(connect)
+    def timed_connect():
+        start = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - start)
+
+    # the engine takes connections through pool.connect, there is no event before the wait
+    pool.connect = timed_connect
+    _pools[pool] = engine.url.render_as_string(hide_password=True)
+
+
+def instrument_engine(engine):
+    """Times every statement and pool checkout of ``engine`` (a sync engine, or ``async_engine.sync_engine``)."""
+    if event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        return engine
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+    # dispose() replaces the pool
+    event.listen(engine, 'engine_disposed', _time_checkouts)
+    _time_checkouts(engine)
+    return engine
@@ -0,0 +1,59 @@
+from datetime import datetime
+from enum import Enum
+
+from sqlalchemy import Column, Integer, ForeignKey, DateTime, Index
+from sqlalchemy.orm import relationship
+
+from ._db import Base
+from .entity import Entity
+from .pricing import PRICE
+
+
+class OrderState(Enum):
+    PLACED = 1
+    PAID = 2
+    CANCELLED = 3
+
+
+class Cart(Entity, Base):
+    """A user's open cart; nothing is reserved until checkout."""
+    __tablename__ = 'carts'
+    user_id = Column(Integer, ForeignKey('users.uid'), nullable=False, unique=True)
+    updated_time = Column(DateTime, nullable=False, default=datetime.utcnow)
+    items = relationship('CartItem', back_populates='cart', cascade='all, delete-orphan')
+
+
+class CartItem(Entity, Base):
+    __tablename__ = 'cart_items'
+    cart_id = Column(Integer, ForeignKey('carts.uid'), nullable=False)
+    product_id = Column(Integer, ForeignKey('products.uid'), nullable=False)
+    quantity = Column(Integer, nullable=False)
+    cart = relationship('Cart', back_populates='items')
+
+    __table_args__ = (
+        Index('ix_cart_items_cart_product', cart_id, product_id, unique=True),
+    )
+
+
+class Order(Entity, Base):
+    __tablename__ = 'orders'
+    user_id = Column(Integer, ForeignKey('users.uid'), nullable=False)
+    state = Column(Integer, nullable=False, default=OrderState.PLACED.value)
+    total = Column(PRICE, nullable=False)
+    placed_time = Column(DateTime, nullable=False, default=datetime.utcnow)
+    lines = relationship('OrderLine', back_populates='order', cascade='all, delete-orphan')
+
+    __table_args__ = (
+        # order history of a user, newest first
+        Index('ix_orders_user_placed', user_id, placed_time.desc()),
+    )
+
+
+class OrderLine(Entity, Base):
+    """A product as it was sold: the unit price is copied, later price changes don't touch placed orders."""
+    __tablename__ = 'order_lines'
+    order_id = Column(Integer, ForeignKey('orders.uid'), nullable=False, index=True)
+    product_id = Column(Integer, ForeignKey('products.uid'), nullable=False)
+    quantity = Column(Integer, nullable=False)
+    unit_price = Column(PRICE, nullable=False)
+    order = relationship('Order', back_populates='lines')
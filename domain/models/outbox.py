@@ -0,0 +1,46 @@
+from datetime import datetime
+from enum import Enum
+
+from sqlalchemy import Column, Integer, String, DateTime, Index
+
+from ._db import Base
+from .entity import Entity
+
+EMAIL = 'email'
+SMS = 'sms'
+
+
+class OutboxState(Enum):
+    PENDING = 1
+    SENT = 2
+    # gave up after the last attempt
+    FAILED = 3
+
+
+class OutboxMessage(Entity, Base):
+    """
+    A notification waiting for its provider, written in the transaction that made it necessary and sent later by
+    handlers.outbox.OutboxDispatcher. A claimed message carries the claim until it is recorded; a dispatcher that
+    died leaves it to be claimed again once ``next_attempt_time`` (the lease) has passed.
+    """
+    __tablename__ = 'outbox'
+    channel = Column(String, nullable=False)
+    recipient = Column(String, nullable=False)
+    subject = Column(String, nullable=True)
+    body = Column(String, nullable=False)
+    state = Column(Integer, nullable=False, default=OutboxState.PENDING.value)
+    attempts = Column(Integer, nullable=False, default=0)
+    created_time = Column(DateTime, nullable=False, default=datetime.utcnow)
+    next_attempt_time = Column(DateTime, nullable=False, default=datetime.utcnow)
+    claim = Column(String, nullable=True)
+    sent_time = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+
+    __table_args__ = (
+        # due messages of a channel, oldest first, see OutboxDispatcher.claim
+        Index('ix_outbox_state_channel_next', state, channel, next_attempt_time),
+        Index('ix_outbox_claim', claim),
+    )
+
+    def __repr__(self):
+        return "OutboxMessage(%r, %r, %r, %r)" % (self.channel, self.recipient, self.state, self.attempts)
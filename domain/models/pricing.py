@@ -0,0 +1,30 @@
+"""
+The price a product sells for: ``price - discount``, never below zero, in exact cents. ``effective_price`` is the
+rule for Python, ``effective_price_sql`` the same rule for set based UPDATEs; Product.effective_price stores it.
+"""
+__all__ = ['CENT', 'PRICE', 'to_decimal', 'effective_price', 'effective_price_sql']
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from sqlalchemy import Numeric, case, cast, func
+
+CENT = Decimal('0.01')
+# the column type of stored prices
+PRICE = Numeric(12, 2)
+
+
+def to_decimal(value) -> Decimal:
+    """Floats go through their shortest repr, so 0.1 is 0.10 and not 0.1000000000000000055..."""
+    if isinstance(value, float):
+        value = repr(value)
+    return Decimal(value).quantize(CENT, ROUND_HALF_UP)
+
+
+def effective_price(price, discount) -> Decimal:
+    return max(to_decimal(price) - to_decimal(discount or 0), Decimal('0.00'))
+
+
+def effective_price_sql(price, discount):
+    """``effective_price`` of two column expressions, computed by the database in decimal arithmetic."""
+    difference = func.round(cast(price, PRICE), 2) - func.round(cast(discount, PRICE), 2)
+    return cast(case((difference > 0, difference), else_=0), PRICE)
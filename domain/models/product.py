@@ -1,16 +1,51 @@
-from sqlalchemy import Column, String, Integer, Float, ForeignKey
+from sqlalchemy import Column, String, Integer, Float, ForeignKey, Index, DDL, event, JSON
 
 from ._db import Base
 from .entity import Entity
+from .pricing import PRICE, effective_price
+
+
+def _effective_price_default(context):
+    # inserts, also the executemany ones of bulk loads
+    parameters = context.get_current_parameters()
+    return effective_price(parameters['price'], parameters['discount'])
 
 
 class Product(Entity, Base):
     __tablename__ = 'products'
     title = Column(String, nullable=False)
     description = Column(String, nullable=False)
-    Images = Column(String)
+    # image manifest, a list of handlers.imagestore.manifest_entry
+    Images = Column(JSON)
     price = Column(Float, nullable=False)
     discount = Column(Float, nullable=False)
+    # price - discount in exact cents, for sorting and filtering in SQL; see domain.models.pricing
+    effective_price = Column(PRICE, nullable=False, default=_effective_price_default)
+    # units for sale; only handlers.orderhandler takes from it, with a conditional UPDATE that never goes below 0
+    stock = Column(Integer, nullable=False, default=0, server_default='0')
 
     collection_id = Column(Integer, ForeignKey('collections.uid'))
     category_id = Column(Integer, ForeignKey('categories.uid'))
+
+    __table_args__ = (
+        # keyset pagination of ProductHandler.list_products, uid breaks ties so every key is unique
+        Index('ix_products_effective_price', effective_price, 'uid'),
+        Index('ix_products_category_effective_price', category_id, effective_price, 'uid'),
+        Index('ix_products_category_uid', category_id, 'uid'),
+        Index('ix_products_collection_effective_price', collection_id, effective_price, 'uid'),
+        Index('ix_products_collection_uid', collection_id, 'uid'),
+    )
+
+
+@event.listens_for(Product, 'before_update')
+def _update_effective_price(mapper, connection, target):
+    # ORM updates; set based UPDATEs set the column themselves with effective_price_sql
+    target.effective_price = effective_price(target.price, target.discount)
+
+
+# full text search (handlers.productsearch.PostgresSearchIndex); an expression index postgres maintains itself
+SEARCH_DOCUMENT = ("setweight(to_tsvector('simple'::regconfig, title), 'A') || "
+                   "setweight(to_tsvector('simple'::regconfig, description), 'B')")
+event.listen(Product.__table__, 'after_create',
+             DDL(f'CREATE INDEX IF NOT EXISTS ix_products_search ON products USING GIN (({SEARCH_DOCUMENT}))')
+             .execute_if(dialect='postgresql'))
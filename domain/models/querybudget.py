@@ -0,0 +1,60 @@
+__all__ = ['QueryCounter', 'QueryBudgetExceeded', 'count_queries', 'query_budget']
+
+from contextlib import contextmanager
+from typing import Iterator, List
+
+from sqlalchemy import event
+
+from ._db import DBInitializer
+
+
+class QueryBudgetExceeded(AssertionError):
+    """An assertion, so a test over its budget fails instead of erroring."""
+
+
+class QueryCounter:
+    def __init__(self):
+        self.statements: List[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(engine=None) -> Iterator[QueryCounter]:
+    """
+    Records every statement ``engine`` executes inside the block; by default the application's primary and every
+    replica, reads routed to a replica count too.
+    """
+    if engine is None:
+        router = DBInitializer.get_router()
+        engines = [router.primary, *router.replicas]
+    else:
+        engines = [engine]
+    counter = QueryCounter()
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', counter)
+    try:
+        yield counter
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', counter)
+
+
+@contextmanager
+def query_budget(budget: int, engine=None) -> Iterator[QueryCounter]:
+    """
+    N+1 detector for tests: fails when the block issues more than ``budget`` statements, and lists them.
+
+        with query_budget(2):
+            CatalogHandler.list_categories()
+    """
+    with count_queries(engine) as counter:
+        yield counter
+    if counter.count > budget:
+        statements = '\n'.join(f'  {i}. {" ".join(s.split())}' for i, s in enumerate(counter.statements, 1))
+        raise QueryBudgetExceeded(f'{counter.count} queries, budget is {budget}:\n{statements}')
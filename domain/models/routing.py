@@ -0,0 +1,94 @@
+"""
+Read replicas: sessions for reads are bound to a replica picked by a ReplicaRouter, writes stay on the primary.
+
+A commit that wrote something pins the reads of the same context (thread or task) to the primary, for the rest
+of a ``read_your_writes_scope`` or, outside of one, for ``sticky_seconds`` of replication lag.
+"""
+__all__ = ['ReplicaRouter', 'read_your_writes_scope', 'ROUND_ROBIN', 'LEAST_CONNECTIONS']
+
+import contextvars
+import itertools
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Sequence
+
+from sqlalchemy import event
+
+from core.exceptions import ValueException
+
+ROUND_ROBIN = 'round_robin'
+LEAST_CONNECTIONS = 'least_connections'
+
+# monotonic time until which this context reads from the primary
+_primary_until = contextvars.ContextVar('numen_primary_until', default=0.0)
+_in_request = contextvars.ContextVar('numen_read_your_writes', default=False)
+
+
+@contextmanager
+def read_your_writes_scope() -> Iterator[None]:
+    """One request: once it committed a write, every later read of it goes to the primary."""
+    request, until = _in_request.set(True), _primary_until.set(0.0)
+    try:
+        yield
+    finally:
+        _primary_until.reset(until)
+        _in_request.reset(request)
+
+
+class ReplicaRouter:
+    """Picks the engine for a read: ``round_robin`` over the replicas or the one with the fewest checkouts."""
+
+    def __init__(self, primary, replicas: Sequence = (), policy: str = ROUND_ROBIN, sticky_seconds: float = 5.0,
+                 clock: Callable[[], float] = time.monotonic):
+        if policy not in (ROUND_ROBIN, LEAST_CONNECTIONS):
+            raise ValueException(f'Unknown replica policy: {policy}')
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.policy = policy
+        self.sticky_seconds = sticky_seconds
+        self._clock = clock
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+        self._checked_out = {id(engine): 0 for engine in self.replicas}
+        if policy == LEAST_CONNECTIONS:
+            for engine in self.replicas:
+                # pool events on the engine carry over to the pool dispose() puts in place
+                event.listen(engine, 'checkout', self._counter(engine, 1))
+                event.listen(engine, 'checkin', self._counter(engine, -1))
+
+    def _counter(self, engine, step: int):
+        key = id(engine)
+
+        def count(*_):
+            with self._lock:
+                self._checked_out[key] += step
+        return count
+
+    def checked_out(self, engine) -> int:
+        return self._checked_out.get(id(engine), 0)
+
+    def is_replica(self, engine) -> bool:
+        """Whether ``engine`` is one of the replicas; what they return may lag behind the primary."""
+        return any(engine is replica for replica in self.replicas)
+
+    def pinned(self) -> bool:
+        return self._clock() < _primary_until.get()
+
+    def note_write(self):
+        """Called after a commit that wrote; the context's next reads must see it."""
+        if not self.replicas:
+            return
+        _primary_until.set(math.inf if _in_request.get() else self._clock() + self.sticky_seconds)
+
+    def reader(self):
+        if not self.replicas or self.pinned():
+            return self.primary
+        turn = next(self._turn)
+        if self.policy == ROUND_ROBIN:
+            return self.replicas[turn % len(self.replicas)]
+        # start at a rotating replica, ties don't all land on the first one
+        count = len(self.replicas)
+        candidates = [self.replicas[(turn + i) % count] for i in range(count)]
+        return min(candidates, key=self.checked_out)
@@ -1,7 +1,7 @@
 from datetime import timedelta, datetime
 from enum import Enum
 
-from sqlalchemy import Column, String, DateTime, Integer, ForeignKey, Boolean
+from sqlalchemy import Column, String, DateTime, Integer, ForeignKey, Boolean, Index
 from sqlalchemy.orm import relationship
 
 from domain.models._db import Base
@@ -28,6 +28,14 @@ class Token(Entity, Base):
     deactivate = Column(Boolean, nullable=False, default=False)
     exchange_method = Column(Integer, nullable=True)
 
+    __table_args__ = (
+        # latest token of a user (optionally per exchange method), see TokenHandler
+        Index('ix_tokens_user_exchange_requested', user_id, exchange_method, requested_time.desc()),
+        Index('ix_tokens_url_token', url_token, unique=True),
+        # expired tokens, see TokenSweeper
+        Index('ix_tokens_time_limit', time_limit),
+    )
+
     def __repr__(self):
         return ("Token(%r, %r, %r, %r, %r)"
                 % (self.user_id, self.requested_time, self.failed_attempts, self.last_used_time, self.deactivate))
@@ -1,5 +1,7 @@
-__all__ = ['user_validation', 'phone_validation', 'email_validation', 'address_validation', 'passwordservice']
+__all__ = ['user_validation', 'validate_users', 'phone_validation', 'email_validation', 'address_validation',
+           'passwordservice', 'validators']
 
+from domain.services import validators
 from domain.services.addressservice import address_validation
 from domain.services.contactservice import phone_validation, email_validation
-from domain.services.userservices import user_validation
+from domain.services.userservices import user_validation, validate_users
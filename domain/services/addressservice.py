@@ -2,12 +2,20 @@ from core.exceptions import ValueException
 from domain.models.user import Address
 
 
-def address_validation(address: Address):
+def address_error(address: Address) -> ValueException:
+    """Returns the exception address_validation would raise, or None, without raising it."""
     if not address.province:
-        raise ValueException('province is required!')
+        return ValueException('province is required!')
     if not address.city:
-        raise ValueException('city is required!')
+        return ValueException('city is required!')
     if not address.zip_code or len(address.zip_code) != 10:
-        raise ValueException('zip code is required!')
+        return ValueException('zip code is required!')
     if not address.postal_address or len(address.postal_address) >= 512:
-        raise ValueException('postal address is required!')
+        return ValueException('postal address is required!')
+    return None
+
+
+def address_validation(address: Address):
+    error = address_error(address)
+    if error:
+        raise error
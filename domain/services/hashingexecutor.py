@@ -0,0 +1,112 @@
+__all__ = ['HashingExecutor', 'InlineExecutor']
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from core.exceptions import OverloadException, ValueException
+
+
+class InlineExecutor(Executor):
+    """Runs the submitted call in the caller's thread, used where a pool isn't wanted (tests, scripts)."""
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as ex:
+            future.set_exception(ex)
+        return future
+
+
+class HashingExecutor:
+    """
+    Bounded worker pool for CPU bound password work.
+
+    At most ``max_pending`` calls can be running or waiting at once; a caller that can't get a slot within
+    ``submit_timeout`` seconds gets an ``OverloadException`` instead of queueing forever.
+    """
+
+    def __init__(self, executor: Executor = None, max_workers: int = None, max_pending: int = None,
+                 submit_timeout: float = 0.5):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.max_workers * 4
+        self.submit_timeout = submit_timeout
+        self._executor = executor
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._pending = 0
+
+    @classmethod
+    def from_env(cls) -> 'HashingExecutor':
+        kind = os.environ.get('NUMEN_HASH_EXECUTOR', 'process')
+        workers = int(os.environ.get('NUMEN_HASH_WORKERS', 0)) or None
+        pending = int(os.environ.get('NUMEN_HASH_MAX_PENDING', 0)) or None
+        timeout = float(os.environ.get('NUMEN_HASH_SUBMIT_TIMEOUT', 0.5))
+        executor = None
+        if kind == 'inline':
+            executor = InlineExecutor()
+        elif kind == 'thread':
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hashing')
+        elif kind != 'process':
+            raise ValueException(f'Unknown hashing executor: {kind}')
+        return cls(executor, max_workers=workers, max_pending=pending, submit_timeout=timeout)
+
+    @property
+    def executor(self) -> Executor:
+        # the process pool is started on first use so importing the service stays cheap
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _release(self, _=None):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def _submit(self, fn, *args) -> Future:
+        with self._lock:
+            self._pending += 1
+        try:
+            future = self.executor.submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def submit(self, fn, *args) -> Future:
+        if not self._slots.acquire(timeout=self.submit_timeout):
+            raise OverloadException('Hashing executor is saturated!')
+        return self._submit(fn, *args)
+
+    def try_submit(self, fn, *args):
+        """Submits only if a slot is free right now, returns None otherwise. Used for optional background work."""
+        if not self._slots.acquire(blocking=False):
+            return None
+        return self._submit(fn, *args)
+
+    def run(self, fn, *args):
+        return self.submit(fn, *args).result()
+
+    async def run_async(self, fn, *args):
+        # never block the event loop on the semaphore, poll it until the deadline instead
+        deadline = time.monotonic() + self.submit_timeout
+        while not self._slots.acquire(blocking=False):
+            if time.monotonic() >= deadline:
+                raise OverloadException('Hashing executor is saturated!')
+            await asyncio.sleep(0.005)
+        return await asyncio.wrap_future(self._submit(fn, *args))
+
+    def shutdown(self, wait: bool = True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
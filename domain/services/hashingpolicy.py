@@ -0,0 +1,66 @@
+__all__ = ['HashingPolicy', 'crypt_context']
+
+import os
+from functools import lru_cache
+
+from passlib.context import CryptContext
+
+from core.exceptions import ValueException
+
+SUPPORTED_SCHEMES = ('pbkdf2_sha256', 'bcrypt', 'argon2')
+
+
+class HashingPolicy:
+    """
+    Which password hash scheme to use and at what cost.
+
+    The first scheme hashes new passwords, the others are only accepted for verification and flagged for rehash.
+    When ``rounds`` is set, hashes of the default scheme made with any other cost are flagged as well.
+    """
+
+    def __init__(self, schemes=('pbkdf2_sha256',), rounds: int = None):
+        schemes = tuple(schemes)
+        if not schemes:
+            raise ValueException('At least one hash scheme is required!')
+        for scheme in schemes:
+            if scheme not in SUPPORTED_SCHEMES:
+                raise ValueException(f'Hash scheme is not supported! scheme: {scheme}')
+        self.schemes = schemes
+        self.rounds = rounds
+
+    @classmethod
+    def from_env(cls) -> 'HashingPolicy':
+        schemes = [s.strip() for s in os.environ.get('NUMEN_HASH_SCHEMES', 'pbkdf2_sha256').split(',') if s.strip()]
+        rounds = os.environ.get('NUMEN_HASH_ROUNDS')
+        return cls(schemes, int(rounds) if rounds else None)
+
+    @property
+    def default_scheme(self) -> str:
+        return self.schemes[0]
+
+    def key(self) -> tuple:
+        return self.schemes, self.rounds
+
+    def __eq__(self, other):
+        return isinstance(other, HashingPolicy) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __repr__(self):
+        return "HashingPolicy(%r, %r)" % (self.schemes, self.rounds)
+
+
+@lru_cache(maxsize=8)
+def crypt_context(policy: HashingPolicy) -> CryptContext:
+    settings = {'schemes': list(policy.schemes), 'deprecated': 'auto'}
+    if policy.rounds:
+        scheme = policy.default_scheme
+        settings[f'{scheme}__default_rounds'] = policy.rounds
+        settings[f'{scheme}__min_rounds'] = policy.rounds
+        settings[f'{scheme}__max_rounds'] = policy.rounds
+    context = CryptContext(**settings)
+    handler = context.handler()
+    if hasattr(handler, 'has_backend') and not handler.has_backend():
+        raise ValueException(f'Hash scheme backend is not installed! scheme: {policy.default_scheme}')
+    return context
@@ -1,23 +1,97 @@
-__all__ = ['hashing_password', 'password_verification', 'password_validation', 'is_it_hashed']
+__all__ = ['hashing_password', 'password_verification', 'password_validation', 'is_it_hashed',
+           'hashing_password_async', 'password_verification_async', 'get_hashing_executor',
+           'set_hashing_executor', 'get_hashing_policy', 'set_hashing_policy', 'needs_rehash',
+           'rehash_in_background', 'hashing_passwords']
 
-import re
-
-from passlib.hash import pbkdf2_sha256 as sha256
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List
 
 from core.exceptions import ValueException, AuthenticationException
+from domain.services.hashingexecutor import HashingExecutor
+from domain.services.hashingpolicy import HashingPolicy, crypt_context
+from domain.services.validators import PASSWORD
+
+_logger = logging.getLogger('numen.passwordservice')
+
+_executor = None
+_policy = None
+_rehash_writer = None
+
+
+def get_hashing_executor() -> HashingExecutor:
+    global _executor
+    if _executor is None:
+        _executor = HashingExecutor.from_env()
+    return _executor
+
+
+def set_hashing_executor(executor: HashingExecutor = None):
+    # passing None goes back to the executor configured by the environment
+    global _executor
+    if _executor is not None and _executor is not executor:
+        _executor.shutdown(wait=False)
+    _executor = executor
+
+
+def get_hashing_policy() -> HashingPolicy:
+    global _policy
+    if _policy is None:
+        _policy = HashingPolicy.from_env()
+    return _policy
+
+
+def set_hashing_policy(policy: HashingPolicy = None):
+    # passing None goes back to the policy configured by the environment
+    global _policy
+    if policy is not None:
+        # fail fast on a missing backend instead of on the first login
+        crypt_context(policy)
+    _policy = policy
+
+
+# the two workers below run inside the pool, so they must stay importable module level functions.
+# the policy travels with every call, pool processes can't see a policy set after they were started.
+def _hash(policy: HashingPolicy, password: str) -> str:
+    return crypt_context(policy).hash(password)
+
+
+def _verify(policy: HashingPolicy, entered_password: str, origin_password: str) -> bool:
+    return crypt_context(policy).verify(entered_password, origin_password)
 
 
 def hashing_password(password: str) -> str:
-    return sha256.hash(password)
+    return get_hashing_executor().run(_hash, get_hashing_policy(), password)
+
+
+def hashing_passwords(passwords: Iterable[str]) -> List[str]:
+    """
+    Hashes many passwords in parallel, results in input order.
+
+    Only ``max_workers`` calls are in flight at a time, so a bulk job keeps the pool busy without taking the
+    pending slots interactive logins rely on.
+    """
+    executor = get_hashing_executor()
+    policy = get_hashing_policy()
+    hashes, window = [], deque()
+    for password in passwords:
+        if len(window) >= executor.max_workers:
+            hashes.append(window.popleft().result())
+        window.append(executor.submit(_hash, policy, password))
+    hashes.extend(future.result() for future in window)
+    return hashes
+
+
+async def hashing_password_async(password: str) -> str:
+    return await get_hashing_executor().run_async(_hash, get_hashing_policy(), password)
 
 
 def password_validation(password: str):
-    # check if it is hashed with sha256 algorithm
+    # check if it is already hashed by one of the accepted schemes
     if is_it_hashed(password):
         raise ValueException('Password already is Hashed!')
-    regex = r"^(?=.*[A-Z])(?=.*[a-z])(?=.*[\d\-_\.!@#$%^&*()+=~`:;<>\?,{}[\] ])[a-zA-Z\d\-_\.!@#$%^&*()+=~`:;<>\?," \
-            r"{}[\] ]{6,31}$"
-    if re.match(regex, password):
+    if PASSWORD.match(password):
         return True
     return False
 
@@ -25,10 +99,63 @@ def password_validation(password: str):
 def password_verification(origin_password, entered_password: str):
     if is_it_hashed(entered_password):
         raise AuthenticationException("Entered Password is hashed!")
-    if sha256.verify(entered_password, origin_password):
+    if get_hashing_executor().run(_verify, get_hashing_policy(), entered_password, origin_password):
         return True
     raise AuthenticationException('Entered password is wrong!')
 
 
+async def password_verification_async(origin_password, entered_password: str):
+    if is_it_hashed(entered_password):
+        raise AuthenticationException("Entered Password is hashed!")
+    if await get_hashing_executor().run_async(_verify, get_hashing_policy(), entered_password, origin_password):
+        return True
+    raise AuthenticationException('Entered password is wrong!')
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    """True when the hash uses a deprecated scheme or a cost other than the policy's."""
+    return crypt_context(get_hashing_policy()).needs_update(hashed_password)
+
+
+def _get_rehash_writer() -> ThreadPoolExecutor:
+    global _rehash_writer
+    if _rehash_writer is None:
+        _rehash_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rehash')
+    return _rehash_writer
+
+
+def _store_rehash(store: Callable[[str], None], hashed_password: str):
+    # runs on the writer thread, nobody waits for its future
+    try:
+        store(hashed_password)
+    except Exception:
+        _logger.exception('storing a rehashed password failed')
+
+
+def rehash_in_background(origin_password: str, entered_password: str, store: Callable[[str], None]) -> bool:
+    """
+    Hashes an already verified password again under the current policy, off the caller's path.
+
+    ``store`` gets the new hash on a writer thread. Nothing is scheduled when the hash is up to date or the
+    hashing pool has no free slot; the next successful login tries again.
+    """
+    if not needs_rehash(origin_password):
+        return False
+    future = get_hashing_executor().try_submit(_hash, get_hashing_policy(), entered_password)
+    if future is None:
+        return False
+
+    def hand_over(done):
+        if done.cancelled():
+            return
+        if done.exception() is not None:
+            _logger.error('rehashing a password failed', exc_info=done.exception())
+            return
+        _get_rehash_writer().submit(_store_rehash, store, done.result())
+
+    future.add_done_callback(hand_over)
+    return True
+
+
 def is_it_hashed(password: str):
-    return sha256.identify(password)
+    return crypt_context(get_hashing_policy()).identify(password, required=False) is not None
@@ -1,30 +1,58 @@
-from core.exceptions import ValueException
+from typing import Iterable, List
+
+from core.exceptions import ValueException, TypeException, InnerException
 from domain.models import User
 from domain.models.user import UserState
-from domain.services.addressservice import address_validation
-from domain.services.contactservice import email_validation, phone_validation
+from domain.services.addressservice import address_error
+from domain.services.contactservice import email_error, phone_error
 from domain.services.passwordservice import password_validation
 
 
-def user_validation(user: User):
+def user_errors(user: User) -> List[InnerException]:
+    """Every problem of the user, in the order user_validation checks them; nothing is raised."""
+    errors = []
     if not user.first_name:
-        raise ValueException("First Name is Required!")
+        errors.append(ValueException("First Name is Required!"))
     if not user.last_name:
-        raise ValueException("Last Name is Required!")
+        errors.append(ValueException("Last Name is Required!"))
     if not user.password:
-        raise ValueException("Password is Required!")
-    if not password_validation(user.password):
-        raise ValueException("Entered password is not valid!")
+        errors.append(ValueException("Password is Required!"))
+    elif not isinstance(user.password, str):
+        errors.append(TypeException(f'Password Type must be string! Type is: {type(user.password)}'))
+    else:
+        try:
+            if not password_validation(user.password):
+                errors.append(ValueException("Entered password is not valid!"))
+        except ValueException as ex:
+            errors.append(ex)
     if user.email:
-        email_validation(user.email)
+        error = email_error(user.email)
+        if error:
+            errors.append(error)
     if user.phone:
-        phone_validation(user.phone)
+        error = phone_error(user.phone)
+        if error:
+            errors.append(error)
     if user.addresses:
         for address in user.addresses:
-            address_validation(user.address)
+            error = address_error(address)
+            if error:
+                errors.append(error)
+    return errors
+
+
+def user_validation(user: User):
+    errors = user_errors(user)
+    if errors:
+        raise errors[0]
     return True
 
 
+def validate_users(users: Iterable[User]) -> List[List[str]]:
+    """Batch validation, one error message list per user (empty when valid) instead of raising on the first."""
+    return [[str(error) for error in user_errors(user)] for user in users]
+
+
 def get_user_state(user: User):
     if user.first_name and user.last_name and user.phone:
         if user.is_phone_verified:
@@ -0,0 +1,27 @@
+__all__ = ['register_pattern', 'get_pattern', 'matches', 'EMAIL', 'PHONE', 'PASSWORD']
+
+import re
+from typing import Pattern
+
+_patterns = {}
+
+
+def register_pattern(name: str, pattern: str, flags: int = 0) -> Pattern:
+    """Compiles the pattern once and keeps it under ``name``; validators look it up instead of recompiling."""
+    compiled = re.compile(pattern, flags)
+    _patterns[name] = compiled
+    return compiled
+
+
+def get_pattern(name: str) -> Pattern:
+    return _patterns[name]
+
+
+def matches(name: str, value: str) -> bool:
+    return _patterns[name].match(value) is not None
+
+
+EMAIL = register_pattern('email', r"^[a-zA-Z0-9][\w\d_.]{1,63}@[\w\d\-.]{2,256}\.[\w0-9]{2,64}$", re.I)
+PHONE = register_pattern('phone', r'^9[0-9]{9}$')
+PASSWORD = register_pattern('password', r"^(?=.*[A-Z])(?=.*[a-z])(?=.*[\d\-_\.!@#$%^&*()+=~`:;<>\?,{}[\] ])"
+                                        r"[a-zA-Z\d\-_\.!@#$%^&*()+=~`:;<>\?,{}[\] ]{6,31}$")
@@ -0,0 +1,71 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from passlib.hash import pbkdf2_sha256
+
+from core.exceptions import OverloadException, AuthenticationException
+from domain.services import passwordservice
+from domain.services.hashingexecutor import HashingExecutor, InlineExecutor
+
+
+class HashingExecutorTest(TestCase):
+
+    def setUp(self) -> None:
+        self.release = threading.Event()
+        self.executor = HashingExecutor(ThreadPoolExecutor(max_workers=1), max_workers=1, max_pending=2,
+                                        submit_timeout=0.05)
+
+    def tearDown(self) -> None:
+        self.release.set()
+        self.executor.shutdown()
+
+    def test_run_returns_result(self):
+        self.assertEqual(4, self.executor.run(pow, 2, 2))
+        self.assertEqual(0, self.executor.pending)
+
+    def test_reject_when_saturated(self):
+        self.executor.submit(self.release.wait)
+        self.executor.submit(self.release.wait)
+        self.assertEqual(2, self.executor.pending)
+        with self.assertRaises(OverloadException) as _ex:
+            self.executor.submit(self.release.wait)
+        self.assertEqual('Hashing executor is saturated!', str(_ex.exception))
+        # slots are given back as soon as the work is done
+        self.release.set()
+        self.assertEqual(4, self.executor.run(pow, 2, 2))
+
+    def test_run_async_reject_when_saturated(self):
+        self.executor.submit(self.release.wait)
+        self.executor.submit(self.release.wait)
+        with self.assertRaises(OverloadException):
+            asyncio.run(self.executor.run_async(pow, 2, 2))
+        self.release.set()
+        self.assertEqual(4, asyncio.run(self.executor.run_async(pow, 2, 2)))
+
+    def test_exception_is_propagated_and_slot_released(self):
+        with self.assertRaises(ZeroDivisionError):
+            self.executor.run(divmod, 1, 0)
+        self.assertEqual(0, self.executor.pending)
+
+
+class PasswordServiceExecutorTest(TestCase):
+
+    def setUp(self) -> None:
+        passwordservice.set_hashing_executor(HashingExecutor(InlineExecutor()))
+
+    def tearDown(self) -> None:
+        passwordservice.set_hashing_executor(None)
+
+    def test_async_hash_and_verify(self):
+        hashed = asyncio.run(passwordservice.hashing_password_async('Pa$$w0rd'))
+        self.assertTrue(pbkdf2_sha256.identify(hashed))
+        self.assertTrue(asyncio.run(passwordservice.password_verification_async(hashed, 'Pa$$w0rd')))
+        with self.assertRaises(AuthenticationException):
+            asyncio.run(passwordservice.password_verification_async(hashed, 'wrong'))
+
+    def test_process_pool_hash(self):
+        passwordservice.set_hashing_executor(HashingExecutor(max_workers=1))
+        hashed = passwordservice.hashing_password('Pa$$w0rd')
+        self.assertTrue(passwordservice.password_verification(hashed, 'Pa$$w0rd'))
@@ -0,0 +1,70 @@
+from unittest import TestCase
+
+from passlib.hash import pbkdf2_sha256
+
+from core.exceptions import ValueException
+from domain.services import passwordservice
+from domain.services.hashingexecutor import HashingExecutor, InlineExecutor
+from domain.services.hashingpolicy import HashingPolicy
+
+
+class HashingPolicyTest(TestCase):
+
+    def setUp(self) -> None:
+        passwordservice.set_hashing_executor(HashingExecutor(InlineExecutor()))
+
+    def tearDown(self) -> None:
+        passwordservice.set_hashing_policy(None)
+        passwordservice.set_hashing_executor(None)
+
+    def test_unsupported_scheme_raise_exception(self):
+        with self.assertRaises(ValueException) as _ex:
+            HashingPolicy(['md5_crypt'])
+        self.assertEqual('Hash scheme is not supported! scheme: md5_crypt', str(_ex.exception))
+
+    def test_policy_rounds_are_used(self):
+        passwordservice.set_hashing_policy(HashingPolicy(rounds=1000))
+        hashed = passwordservice.hashing_password('Pa$$w0rd')
+        self.assertEqual(1000, pbkdf2_sha256.from_string(hashed).rounds)
+        self.assertTrue(passwordservice.password_verification(hashed, 'Pa$$w0rd'))
+        self.assertFalse(passwordservice.needs_rehash(hashed))
+
+    def test_other_cost_needs_rehash(self):
+        passwordservice.set_hashing_policy(HashingPolicy(rounds=1000))
+        old_hash = pbkdf2_sha256.using(rounds=1200).hash('Pa$$w0rd')
+        # an old cost still verifies, it is only flagged
+        self.assertTrue(passwordservice.password_verification(old_hash, 'Pa$$w0rd'))
+        self.assertTrue(passwordservice.needs_rehash(old_hash))
+
+    def test_rehash_in_background(self):
+        passwordservice.set_hashing_policy(HashingPolicy(rounds=1000))
+        old_hash = pbkdf2_sha256.using(rounds=1200).hash('Pa$$w0rd')
+        stored = []
+        self.assertTrue(passwordservice.rehash_in_background(old_hash, 'Pa$$w0rd', stored.append))
+        passwordservice._get_rehash_writer().submit(lambda: None).result()
+        self.assertEqual(1, len(stored))
+        self.assertEqual(1000, pbkdf2_sha256.from_string(stored[0]).rounds)
+        # an up to date hash isn't touched
+        self.assertFalse(passwordservice.rehash_in_background(stored[0], 'Pa$$w0rd', stored.append))
+
+    def test_failed_rehash_store_is_logged(self):
+        passwordservice.set_hashing_policy(HashingPolicy(rounds=1000))
+        old_hash = pbkdf2_sha256.using(rounds=1200).hash('Pa$$w0rd')
+
+        def store(_):
+            raise ConnectionError('database down')
+
+        with self.assertLogs('numen.passwordservice', 'ERROR') as logs:
+            self.assertTrue(passwordservice.rehash_in_background(old_hash, 'Pa$$w0rd', store))
+            passwordservice._get_rehash_writer().submit(lambda: None).result()
+        self.assertIn('database down', logs.output[0])
+
+    def test_failed_rehash_is_logged(self):
+        passwordservice.set_hashing_policy(HashingPolicy(rounds=1000))
+        old_hash = pbkdf2_sha256.using(rounds=1200).hash('Pa$$w0rd')
+        stored = []
+        with self.assertLogs('numen.passwordservice', 'ERROR') as logs:
+            # passlib refuses to hash a number
+            self.assertTrue(passwordservice.rehash_in_background(old_hash, 1234, stored.append))
+        self.assertIn('rehashing a password failed', logs.output[0])
+        self.assertEqual([], stored)
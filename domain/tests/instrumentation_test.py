@@ -0,0 +1,67 @@
+import os
+from unittest import TestCase
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool
+
+from core.metrics import set_log_sink, prometheus_text
+from domain.models.instrumentation import instrument_engine, STATEMENT_SECONDS, STATEMENT_ROWS, \
+    POOL_CHECKOUT_SECONDS
+
+
+class InstrumentationTest(TestCase):
+
+    def setUp(self) -> None:
+        self.engine = instrument_engine(create_engine('sqlite://'))
+
+    def test_statements_rows_and_checkouts_are_measured(self):
+        selects = STATEMENT_SECONDS.count(operation='SELECT')
+        inserted = STATEMENT_ROWS.value(operation='INSERT')
+        checkouts = POOL_CHECKOUT_SECONDS.count()
+        with self.engine.begin() as connection:
+            connection.execute(text('CREATE TABLE t (x INTEGER)'))
+            connection.execute(text('INSERT INTO t VALUES (1), (2)'))
+            connection.execute(text('SELECT x FROM t')).all()
+        self.assertEqual(selects + 1, STATEMENT_SECONDS.count(operation='SELECT'))
+        self.assertEqual(inserted + 2, STATEMENT_ROWS.value(operation='INSERT'))
+        self.assertEqual(checkouts + 1, POOL_CHECKOUT_SECONDS.count())
+        self.assertIn('numen_db_statement_seconds_bucket{operation="SELECT"', prometheus_text())
+
+    def test_checked_out_connections(self):
+        # sqlite's default pools don't count, a sized pool (as used for postgres) does
+        engine = instrument_engine(create_engine('sqlite:///:memory:?pool=queue', poolclass=QueuePool))
+        with engine.connect():
+            self.assertIn('numen_db_pool_checked_out{url="sqlite:///:memory:?pool=queue"} 1', prometheus_text())
+        self.assertIn('numen_db_pool_checked_out{url="sqlite:///:memory:?pool=queue"} 0', prometheus_text())
+
+    def test_instrumenting_twice_counts_once(self):
+        instrument_engine(self.engine)
+        selects = STATEMENT_SECONDS.count(operation='SELECT')
+        with self.engine.connect() as connection:
+            connection.execute(text('SELECT 1'))
+        self.assertEqual(selects + 1, STATEMENT_SECONDS.count(operation='SELECT'))
+
+    def test_failed_statement_and_dispose(self):
+        with self.engine.connect() as connection:
+            with self.assertRaises(Exception):
+                connection.execute(text('SELECT * FROM missing'))
+            self.assertEqual([], connection.info['numen_statement_start'])
+        self.engine.dispose()
+        checkouts = POOL_CHECKOUT_SECONDS.count()
+        with self.engine.connect():
+            pass
+        self.assertEqual(checkouts + 1, POOL_CHECKOUT_SECONDS.count())
+
+    def test_slow_statements_are_logged(self):
+        events = []
+        set_log_sink(events.append)
+        try:
+            os.environ['NUMEN_SLOW_MS'] = '0'
+            with self.engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+        finally:
+            os.environ.pop('NUMEN_SLOW_MS')
+            set_log_sink(None)
+        self.assertEqual('db.statement', events[-1]['event'])
+        self.assertEqual('SELECT 1', events[-1]['statement'])
+        self.assertTrue(events[-1]['slow'])
@@ -0,0 +1,26 @@
+from decimal import Decimal
+from unittest import TestCase
+
+from sqlalchemy import create_engine, select, literal
+
+from domain.models.pricing import effective_price, effective_price_sql, to_decimal
+
+
+class PricingTest(TestCase):
+
+    def test_exact_cents(self):
+        # 0.3 - 0.1 is 0.19999999999999998 in floats
+        self.assertEqual(Decimal('0.20'), effective_price(0.3, 0.1))
+        self.assertEqual(Decimal('9.90'), effective_price(10.1, 0.2))
+        self.assertEqual(Decimal('0.01'), to_decimal(0.005))
+        self.assertEqual(Decimal('12.00'), effective_price(12, None))
+
+    def test_never_below_zero(self):
+        self.assertEqual(Decimal('0.00'), effective_price(1, 5))
+
+    def test_sql_agrees(self):
+        engine = create_engine('sqlite://')
+        with engine.connect() as connection:
+            for price, discount in ((0.3, 0.1), (10.1, 0.2), (1, 5), (99.99, 0)):
+                stored = connection.execute(select(effective_price_sql(literal(price), literal(discount)))).scalar()
+                self.assertEqual(effective_price(price, discount), to_decimal(stored), (price, discount))
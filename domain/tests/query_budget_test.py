@@ -0,0 +1,37 @@
+from unittest import TestCase
+
+from sqlalchemy import create_engine, text
+
+from domain.models.querybudget import query_budget, count_queries, QueryBudgetExceeded
+
+
+class QueryBudgetTest(TestCase):
+
+    def setUp(self) -> None:
+        self.engine = create_engine('sqlite://')
+
+    def run_queries(self, n):
+        with self.engine.connect() as connection:
+            for i in range(n):
+                connection.execute(text(f'SELECT {i}'))
+
+    def test_count_queries(self):
+        with count_queries(self.engine) as counter:
+            self.run_queries(3)
+        self.assertEqual(3, counter.count)
+        # the listener is gone after the block
+        self.run_queries(1)
+        self.assertEqual(3, counter.count)
+
+    def test_within_budget(self):
+        with query_budget(2, self.engine) as counter:
+            self.run_queries(2)
+        self.assertEqual(2, counter.count)
+
+    def test_over_budget_fails_with_the_statements(self):
+        with self.assertRaises(QueryBudgetExceeded) as _ex:
+            with query_budget(2, self.engine):
+                self.run_queries(3)
+        self.assertTrue(str(_ex.exception).startswith('3 queries, budget is 2:'))
+        self.assertIn('3. SELECT 2', str(_ex.exception))
+        self.assertIsInstance(_ex.exception, AssertionError)
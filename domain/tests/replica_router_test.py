@@ -0,0 +1,72 @@
+import threading
+from unittest import TestCase
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool
+
+from core.exceptions import ValueException
+from domain.models.routing import ReplicaRouter, read_your_writes_scope, LEAST_CONNECTIONS
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ReplicaRouterTest(TestCase):
+
+    def setUp(self) -> None:
+        self.clock = Clock()
+
+    def test_without_replicas_reads_go_to_the_primary(self):
+        router = ReplicaRouter('primary')
+        self.assertEqual('primary', router.reader())
+
+    def test_round_robin(self):
+        router = ReplicaRouter('primary', ['a', 'b', 'c'])
+        self.assertEqual(['a', 'b', 'c', 'a'], [router.reader() for _ in range(4)])
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueException):
+            ReplicaRouter('primary', [], 'random')
+
+    def test_a_write_pins_reads_for_sticky_seconds(self):
+        router = ReplicaRouter('primary', ['a'], sticky_seconds=5, clock=self.clock)
+        router.note_write()
+        self.assertEqual('primary', router.reader())
+        self.clock.now = 5
+        self.assertEqual('a', router.reader())
+
+    def test_a_write_pins_only_its_own_thread(self):
+        router = ReplicaRouter('primary', ['a'], clock=self.clock)
+        readers = []
+        thread = threading.Thread(target=lambda: (router.note_write(), readers.append(router.reader())))
+        thread.start()
+        thread.join()
+        self.assertEqual(['primary'], readers)
+        self.assertEqual('a', router.reader())
+
+    def test_a_write_pins_the_rest_of_the_request(self):
+        router = ReplicaRouter('primary', ['a'], sticky_seconds=5, clock=self.clock)
+        with read_your_writes_scope():
+            self.assertEqual('a', router.reader())
+            router.note_write()
+            self.clock.now = 3600
+            self.assertEqual('primary', router.reader())
+        # the next request starts on the replicas again
+        with read_your_writes_scope():
+            self.assertEqual('a', router.reader())
+
+    def test_least_connections(self):
+        replicas = [create_engine('sqlite://', poolclass=QueuePool) for _ in range(2)]
+        router = ReplicaRouter('primary', replicas, LEAST_CONNECTIONS)
+        first = router.reader()
+        with first.connect() as connection:
+            connection.execute(text('SELECT 1'))
+            self.assertEqual(1, router.checked_out(first))
+            # the busy replica is skipped, whatever the turn
+            self.assertEqual({replicas[1 - replicas.index(first)]}, {router.reader() for _ in range(4)})
+        self.assertEqual(0, router.checked_out(first))
@@ -2,9 +2,9 @@ from dataclasses import dataclass
 from datetime import datetime
 from unittest import TestCase
 
-from core.exceptions import ValueException
+from core.exceptions import ValueException, TypeException
 from domain.models.user import UserState
-from domain.services import user_validation
+from domain.services import user_validation, validate_users
 from domain.services.userservices import get_user_state
 
 
@@ -45,9 +45,29 @@ class UserValidationTest(TestCase):
             user_validation(MockUser(password="password"))
         self.assertEqual("Entered password is not valid!", str(_ex.exception))
 
+    def test_user_password_must_be_string(self):
+        with self.assertRaises(TypeException) as _ex:
+            user_validation(MockUser(password=123456))
+        self.assertEqual("Password Type must be string! Type is: <class 'int'>", str(_ex.exception))
+
     def test_user_valid_password_validation(self):
         self.assertTrue(user_validation(MockUser(password="Pa$$w0rd")))
 
+    def test_validate_users_collects_every_error(self):
+        users = [MockUser(),
+                 MockUser(first_name='', last_name='', password='password'),
+                 MockUser(email='wrong', phone='1')]
+        errors = validate_users(users)
+        self.assertEqual(3, len(errors))
+        self.assertEqual([], errors[0])
+        self.assertEqual(['First Name is Required!', 'Last Name is Required!', 'Entered password is not valid!'],
+                         errors[1])
+        self.assertEqual(['Email input is not valid! Email:wrong', 'Input Phone is not valid! phone is:1'], errors[2])
+
+    def test_validate_users_accepts_generator(self):
+        errors = validate_users(MockUser(password='') for _ in range(2))
+        self.assertEqual([['Password is Required!'], ['Password is Required!']], errors)
+
     # region User State Tests
 
     def test_get_user_state_incomplete(self):
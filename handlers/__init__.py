@@ -1,3 +1,11 @@
-__all__ = ['UserHandler']
+__all__ = ['UserHandler', 'AsyncUserHandler', 'AsyncTokenHandler', 'AsyncAddressHandler', 'ProductHandler',
+           'CatalogHandler', 'OrderHandler', 'ImageHandler']
 
 from handlers.userhandler import UserHandler
+from handlers.asyncuserhandler import AsyncUserHandler
+from handlers.asynctokenhandler import AsyncTokenHandler
+from handlers.asyncaddresshandler import AsyncAddressHandler
+from handlers.producthandler import ProductHandler
+from handlers.cataloghandler import CatalogHandler
+from handlers.orderhandler import OrderHandler
+from handlers.imagehandler import ImageHandler
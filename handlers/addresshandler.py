@@ -1,25 +1,29 @@
 from core.exceptions import ValueException
-from domain.models import DBInitializer
+from core.metrics import instrument_handler
+from domain.models import DBInitializer, session_scope
 from domain.models.user import Address, User
 from domain.services import address_validation
 
 
+@instrument_handler
 class AddressHandler:
     _Session = DBInitializer.get_session
+    # reads that may be served by a replica, see domain.models.routing
+    _ReadSession = DBInitializer.get_read_session
     _address_validation = address_validation
 
     @classmethod
     def add_address(cls, uid, address: Address):
-        session = cls._Session()
-        user = session.query(User).get(uid)
-        if not user:
-            raise ValueException(f"there is no user with this id: {uid}")
-        cls._address_validation(address)
-        user.addresses.append(address)
-        session.commit()
+        with session_scope(cls._Session) as session:
+            user = session.query(User).get(uid)
+            if not user:
+                raise ValueException(f"there is no user with this id: {uid}")
+            cls._address_validation(address)
+            user.addresses.append(address)
+            session.commit()
         return True
 
     @classmethod
     def get_address_by_id(cls, uid):
-        session = cls._Session()
-        return session.query(Address).get(uid)
+        with session_scope(cls._ReadSession) as session:
+            return session.query(Address).get(uid)
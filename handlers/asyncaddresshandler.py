@@ -0,0 +1,29 @@
+from core.exceptions import ValueException
+from core.metrics import instrument_handler
+from domain.models import DBInitializer, async_session_scope
+from domain.models.user import Address, User
+from domain.services import address_validation
+
+
+@instrument_handler
+class AsyncAddressHandler:
+    _Session = DBInitializer.get_async_session
+    _address_validation = address_validation
+
+    @classmethod
+    async def add_address(cls, uid, address: Address):
+        async with async_session_scope(cls._Session) as session:
+            user = await session.get(User, uid)
+            if not user:
+                raise ValueException(f"there is no user with this id: {uid}")
+            cls._address_validation(address)
+            # assigning the key instead of appending to user.addresses avoids a lazy load, which asyncio forbids
+            address.user_id = user.uid
+            session.add(address)
+            await session.commit()
+        return True
+
+    @classmethod
+    async def get_address_by_id(cls, uid):
+        async with async_session_scope(cls._Session) as session:
+            return await session.get(Address, uid)
@@ -0,0 +1,157 @@
+import asyncio
+import functools
+import logging
+import secrets
+from datetime import datetime
+
+from sqlalchemy import desc, select, update
+
+from core.exceptions import SecurityException, TimeoutException, AuthenticationException, InnerException
+from core.logging import log_event
+from core.metrics import instrument_handler
+from domain.models import DBInitializer, async_session_scope
+from domain.models import Token, OutboxMessage
+from domain.models.token import ExchangeMethods
+from handlers.tokenhandler import token_values, token_message, signed_url_token_validation, revoke_signed_url_token, \
+    store_hex_token_validation, store_url_token_validation
+from handlers.tokenstore import MAX_FAILED_ATTEMPTS, token_store
+from handlers.urltokens import url_token_signer, revocation_set
+
+# the security events of TokenHandler, on the same logger
+_logger = logging.getLogger('numen.security')
+
+
+async def _off_loop(function, *args):
+    # the memory and redis stores are synchronous, a redis round trip must not hold up the event loop
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(function, *args))
+
+
+async def get_user_builder(user_id):
+    from handlers.asyncuserhandler import AsyncUserHandler
+    return await AsyncUserHandler.get_user_by_id(user_id)
+
+
+@instrument_handler
+class AsyncTokenHandler:
+    _Session = DBInitializer.get_async_session
+    _get_user = get_user_builder
+    # the store TokenHandler uses; None keeps the tokens in the database through _Session
+    _store = token_store
+    _signer = url_token_signer
+    _revocations = revocation_set
+
+    @classmethod
+    async def _with_revocations(cls, function, *args):
+        # the memory set is a dict lookup, a redis one is a round trip
+        if cls._revocations.blocking:
+            return await _off_loop(function, cls._signer, cls._revocations, *args)
+        return function(cls._signer, cls._revocations, *args)
+
+    @classmethod
+    async def generate_token(cls, user_id: int, via: ExchangeMethods, session=None) -> bool:
+        """Same as TokenHandler's: with the caller's ``session`` the token and its message commit with the caller."""
+        u = await cls._get_user(user_id)
+        if not u:
+            raise SecurityException(f"User doesn't exist! user_id: {user_id}")
+        if via == ExchangeMethods.PHONE and not u.phone:
+            raise InnerException('User phone is not registered')
+        if via == ExchangeMethods.EMAIL and not u.email:
+            raise InnerException('User email is not registered')
+        store = cls._store
+        borrowed = session is not None
+        async with async_session_scope(cls._Session, session) as session:
+            if store is None:
+                result = await session.execute(
+                    select(Token).filter_by(user_id=user_id).order_by(desc(Token.requested_time)).limit(1))
+                last_token = result.scalars().first()
+            else:
+                last_token = await _off_loop(store.latest, user_id)
+
+            if last_token and not last_token.deactivate and last_token.exchange_method == via.value \
+                    and datetime.utcnow() < last_token.time_limit:
+                raise InnerException('A valid token already issued!')
+            values = token_values(u.uid, via, signer=cls._signer)
+            if store is None:
+                session.add(Token(**values))
+            else:
+                await _off_loop(store.add, values)
+            session.add(OutboxMessage(**token_message(values, u.email if via == ExchangeMethods.EMAIL else u.phone)))
+            if not borrowed:
+                await session.commit()
+        return True
+
+    @classmethod
+    async def hexadecimal_token_validation(cls, user_id, auth_token: str, exchange_method: ExchangeMethods = None,
+                                           session=None) -> bool:
+        """Same as TokenHandler's: ``session`` is the caller's unit of work, failures commit on their own."""
+        if cls._store is not None:
+            return await _off_loop(store_hex_token_validation, cls._store, cls._signer, cls._revocations, user_id,
+                                   auth_token, exchange_method)
+        borrowed = session is not None
+        async with async_session_scope(cls._Session, session) as session:
+            query = select(Token).filter_by(user_id=user_id)
+            if exchange_method:
+                query = query.filter_by(exchange_method=exchange_method.value)
+            result = await session.execute(query.order_by(desc(Token.requested_time)).limit(1))
+            token = result.scalars().first()
+            if not token:
+                raise SecurityException('User has no token!')
+            if token.deactivate:
+                log_event(_logger, logging.WARNING, 'token.deactivated_used', sample='token.deactivated_used',
+                          user_id=user_id)
+                raise SecurityException('Token is Deactivated!')
+            if datetime.utcnow() > token.time_limit:
+                raise TimeoutException('Token is Expired!')
+            if secrets.compare_digest(token.hex_token, auth_token):
+                token.last_used_time = datetime.utcnow()
+                if not borrowed:
+                    await session.commit()
+                return token.exchange_method
+        failed_attempts, deactivate = await cls._register_failure(token.uid)
+        if deactivate:
+            if cls._signer is not None:
+                await cls._with_revocations(revoke_signed_url_token, token.url_token)
+            log_event(_logger, logging.WARNING, 'token.deactivated', user_id=user_id, failed_attempts=failed_attempts)
+            raise SecurityException('Token is Deactivated!')
+        log_event(_logger, logging.WARNING, 'token.failed', sample='token.failed', user_id=user_id,
+                  failed_attempts=failed_attempts)
+        raise AuthenticationException('Token is not valid!')
+
+    @classmethod
+    async def _register_failure(cls, uid: int) -> tuple:
+        # a transaction of its own, the caller rolls back on the failure but the count must stay
+        async with async_session_scope(cls._Session) as session:
+            await session.execute(update(Token).where(Token.uid == uid).values(
+                failed_attempts=Token.failed_attempts + 1,
+                deactivate=Token.deactivate | (Token.failed_attempts + 1 > MAX_FAILED_ATTEMPTS)))
+            row = (await session.execute(select(Token.failed_attempts, Token.deactivate)
+                                         .where(Token.uid == uid))).one()
+            await session.commit()
+        return row.failed_attempts, row.deactivate
+
+    @classmethod
+    async def url_token_validation(cls, url_token: str, session=None) -> ():
+        if cls._signer is not None:
+            # in memory, plus the revocation set
+            try:
+                return await cls._with_revocations(signed_url_token_validation, url_token)
+            except AuthenticationException:
+                log_event(_logger, logging.WARNING, 'token.url_invalid', sample='token.url_invalid')
+                raise
+        if cls._store is not None:
+            return await _off_loop(store_url_token_validation, cls._store, url_token)
+        borrowed = session is not None
+        async with async_session_scope(cls._Session, session) as session:
+            result = await session.execute(select(Token).filter_by(url_token=url_token).limit(1))
+            tk = result.scalars().first()
+            if not tk:
+                log_event(_logger, logging.WARNING, 'token.url_invalid', sample='token.url_invalid')
+                raise AuthenticationException('Url Token is not valid!')
+            if tk.deactivate:
+                raise SecurityException('Token is Deactivated!')
+            if datetime.utcnow() > tk.time_limit:
+                raise TimeoutException('Token is Expired!')
+            tk.last_used_time = datetime.utcnow()
+            if not borrowed:
+                await session.commit()
+            return tk.user_id, tk.exchange_method
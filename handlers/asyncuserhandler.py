@@ -0,0 +1,234 @@
+import asyncio
+
+from sqlalchemy import event, select, update
+
+from core.exceptions import TypeException, AuthenticationException, ValueException, SecurityException, \
+    OverloadException
+from core.metrics import instrument_handler
+from domain.models import DBInitializer, async_session_scope
+from domain.models import User
+from domain.models.token import ExchangeMethods
+from domain.services import user_validation, email_validation, phone_validation, passwordservice
+from domain.services.userservices import get_user_state
+from handlers.asynctokenhandler import AsyncTokenHandler
+from handlers.contactfilter import contact_filter
+from handlers.ratelimit import login_limiter
+from handlers.usercache import user_cache
+
+
+@instrument_handler
+class AsyncUserHandler:
+    _Session = DBInitializer.get_async_session
+    _user_validation = user_validation
+    _email_validation = email_validation
+    _phone_validation = phone_validation
+    _password_service = passwordservice
+    _hashing = _password_service.hashing_password_async
+    _get_user_state = get_user_state
+    # reads aren't cached here, but writes invalidate what UserHandler cached
+    _cache = user_cache
+    # counts the same attempts as UserHandler; a redis limiter is called off the event loop
+    _login_limiter = login_limiter
+    # build it at start up (contact_filter.build()), a first lookup would read the users table on the event loop
+    _contact_filter = contact_filter
+
+    _hex_token_verification = AsyncTokenHandler.hexadecimal_token_validation
+    _url_token_verification = AsyncTokenHandler.url_token_validation
+    _generate_token = AsyncTokenHandler.generate_token
+
+    # keeps background rehash tasks referenced until they finish
+    _background_tasks = set()
+
+    @classmethod
+    async def get_user_by_id(cls, uid: int) -> User:
+        if not isinstance(uid, int):
+            raise TypeException("uid parameter type must be int!")
+        async with async_session_scope(cls._Session) as session:
+            u = await session.get(User, uid)
+            if not u:
+                raise ValueException(f"user with this id <{uid}> doesn't exist!")
+            u.password = None
+            return u
+
+    @classmethod
+    async def get_user_by_email(cls, email: str) -> User:
+        if not isinstance(email, str):
+            raise TypeException("email parameter type must be string!")
+        cls._email_validation(email)
+        async with async_session_scope(cls._Session) as session:
+            result = await session.execute(select(User).filter_by(email=email).limit(1))
+            user = result.scalars().first()
+            if not user:
+                raise ValueException(f"user with this email <{email}> doesn't exist!")
+            user.password = None
+            return user
+
+    @classmethod
+    async def create_user(cls, user: User) -> int:
+        if cls._user_validation(user):
+            user.password = await cls._hashing(user.password)
+            user.state = cls._get_user_state(user).value
+            async with async_session_scope(cls._Session) as session:
+                session.add(user)
+                await session.commit()
+            cls._cache.invalidate(user.uid, user.email, user.phone)
+            cls._contact_filter.add(user.email, user.phone)
+            if user.email:
+                await cls._generate_token(user.uid, ExchangeMethods.EMAIL)
+            if user.phone:
+                await cls._generate_token(user.uid, ExchangeMethods.PHONE)
+        return user.uid
+
+    @classmethod
+    async def verify_user_email_by_hex_token(cls, user_id: int, hex_token: str, session=None):
+        return await cls._verify_by_hex_token(user_id, hex_token, ExchangeMethods.EMAIL, session)
+
+    @classmethod
+    async def verify_user_phone_by_hex_token(cls, user_id: int, hex_token: str, session=None):
+        return await cls._verify_by_hex_token(user_id, hex_token, ExchangeMethods.PHONE, session)
+
+    @classmethod
+    async def _verify_by_hex_token(cls, user_id: int, hex_token: str, via: ExchangeMethods, session=None):
+        borrowed = session is not None
+        flag = 'is_email_verified' if via == ExchangeMethods.EMAIL else 'is_phone_verified'
+        async with async_session_scope(cls._Session, session) as session:
+            user = await session.get(User, user_id)
+            if getattr(user, flag):
+                return True
+            if not await cls._hex_token_verification(user_id, hex_token, via, session=session):
+                return False
+            setattr(user, flag, True)
+            user.state = cls._get_user_state(user).value
+            if not borrowed:
+                await session.commit()
+        cls._invalidate(user_id, session if borrowed else None)
+
+    @classmethod
+    async def verify_user_exchange_method_by_url_token(cls, url_token: str, session=None):
+        borrowed = session is not None
+        async with async_session_scope(cls._Session, session) as session:
+            user_id, ex_method = await cls._url_token_verification(url_token, session=session)
+            user = await session.get(User, user_id)
+            if ex_method == ExchangeMethods.PHONE.value:
+                user.is_phone_verified = True
+            elif ex_method == ExchangeMethods.EMAIL.value:
+                user.is_email_verified = True
+            user.state = cls._get_user_state(user).value
+            if not borrowed:
+                await session.commit()
+        cls._invalidate(user_id, session if borrowed else None)
+
+    @classmethod
+    def _invalidate(cls, uid: int, session=None):
+        cls._cache.invalidate(uid)
+        if session is not None:
+            # a read between now and the caller's commit could cache the old row again
+            event.listen(session.sync_session, 'after_commit', lambda _: cls._cache.invalidate(uid), once=True)
+
+    @classmethod
+    async def log_in_by_email(cls, email: str, password: str, client: str = None) -> User:
+        if cls._email_validation(email):
+            await cls._login_limiter.acquire_async(f'email:{email.lower()}', client)
+            async with async_session_scope(cls._Session) as session:
+                result = await session.execute(select(User).filter_by(email=email).limit(1))
+                user = result.scalars().first()
+            if not user:
+                raise AuthenticationException("Wrong Email Address!")
+            if await cls._password_service.password_verification_async(user.password, password):
+                await cls._login_limiter.succeeded_async(f'email:{email.lower()}')
+                cls._rehash_password(user.uid, user.password, password)
+                user.password = None
+                return user
+            raise AuthenticationException("Wrong Password!")
+        raise ValueException("Invalid email address value!")
+
+    @classmethod
+    async def log_in_by_phone(cls, phone: str, password: str, client: str = None) -> User:
+        if cls._phone_validation(phone):
+            await cls._login_limiter.acquire_async(f'phone:{phone}', client)
+            async with async_session_scope(cls._Session) as session:
+                result = await session.execute(select(User).filter_by(phone=phone).limit(1))
+                user = result.scalars().first()
+            if not user:
+                raise AuthenticationException("Wrong Phone Number!")
+            if await cls._password_service.password_verification_async(user.password, password):
+                await cls._login_limiter.succeeded_async(f'phone:{phone}')
+                cls._rehash_password(user.uid, user.password, password)
+                user.password = None
+                return user
+            raise AuthenticationException("Wrong Password!")
+        raise ValueException("Invalid phone value!")
+
+    @classmethod
+    def _rehash_password(cls, uid: int, hashed_password: str, password: str):
+        if not cls._password_service.needs_rehash(hashed_password):
+            return
+        task = asyncio.get_running_loop().create_task(cls._store_rehashed_password(uid, hashed_password, password))
+        cls._background_tasks.add(task)
+        task.add_done_callback(cls._background_tasks.discard)
+
+    @classmethod
+    async def _store_rehashed_password(cls, uid: int, hashed_password: str, password: str):
+        try:
+            new_hash = await cls._password_service.hashing_password_async(password)
+        except OverloadException:
+            # the pool is busy with logins, the next successful login tries again
+            return
+        async with async_session_scope(cls._Session) as session:
+            # only replace the hash that was verified, a password changed in between wins
+            await session.execute(update(User).where(User.uid == uid, User.password == hashed_password)
+                                  .values(password=new_hash).execution_options(synchronize_session=False))
+            await session.commit()
+
+    @classmethod
+    async def update_user_info(cls, uid: int, first_name: str = None, last_name: str = None) -> User:
+        async with async_session_scope(cls._Session) as session:
+            user = await session.get(User, uid)
+            if first_name:
+                user.first_name = first_name
+            if last_name:
+                user.last_name = last_name
+            await session.commit()
+            user.password = None
+        cls._cache.invalidate(uid)
+        return user
+
+    @classmethod
+    async def change_password(cls, user_id, old_password, new_password):
+        async with async_session_scope(cls._Session) as session:
+            user = await session.get(User, user_id)
+            if not user:
+                raise SecurityException("User doesn't exist!")
+            if not await cls._password_service.password_verification_async(user.password, old_password):
+                raise AuthenticationException("Wrong Password!")
+            if not cls._password_service.password_validation(new_password):
+                raise ValueException("Entered password is not valid!")
+            user.password = await cls._password_service.hashing_password_async(new_password)
+            await session.commit()
+        cls._cache.invalidate(user_id)
+        return True
+
+    @classmethod
+    async def change_password_by_hex_token(cls, user_id, hex_token, new_password):
+        if not cls._password_service.password_validation(new_password):
+            raise ValueException("Password is not valid!")
+        if await cls._hex_token_verification(user_id, hex_token):
+            async with async_session_scope(cls._Session) as session:
+                user = await session.get(User, user_id)
+                user.password = await cls._password_service.hashing_password_async(new_password)
+                await session.commit()
+            cls._cache.invalidate(user_id)
+            return True
+        raise SecurityException("Token is not valid!")
+
+    @classmethod
+    async def change_password_by_url_token(cls, url_token, new_password):
+        if not cls._password_service.password_validation(new_password):
+            raise ValueException("Password is not valid!")
+        user_id, _ = await cls._url_token_verification(url_token)
+        async with async_session_scope(cls._Session) as session:
+            user = await session.get(User, user_id)
+            user.password = await cls._password_service.hashing_password_async(new_password)
+            await session.commit()
+        cls._cache.invalidate(user_id)
+        return True
@@ -0,0 +1,88 @@
+__all__ = ['CatalogHandler', 'LoadProfile']
+
+from enum import Enum
+from typing import List
+
+from sqlalchemy.orm import selectinload, joinedload, load_only, raiseload
+
+from core.exceptions import ValueException, TypeException
+from core.metrics import instrument_handler
+from domain.models import DBInitializer, session_scope
+from domain.models import Category, Collection, Product
+
+
+class LoadProfile(Enum):
+    """What a use case reads of the catalog; everything else raises instead of lazy loading."""
+    # categories with the listing columns of their products
+    CATEGORY_PAGE = 'category_page'
+    # collections with the listing columns of their products
+    COLLECTION_GRID = 'collection_grid'
+    # categories or collections alone, for menus and filters
+    NAVIGATION = 'navigation'
+    # a product with its category and collection
+    PRODUCT_DETAIL = 'product_detail'
+
+
+_LISTING_COLUMNS = (Product.uid, Product.title, Product.price, Product.discount, Product.effective_price,
+                    Product.Images, Product.category_id, Product.collection_id)
+_HEADER_COLUMNS = {Category: (Category.uid, Category.title, Category.images),
+                   Collection: (Collection.uid, Collection.title, Collection.images)}
+
+
+def _options(profile: LoadProfile, entity) -> list:
+    if profile == LoadProfile.PRODUCT_DETAIL:
+        if entity is not Product:
+            raise ValueException(f'{profile.value} profile loads products!')
+        # many to one, a join costs less than a second round trip
+        return [joinedload(Product.categories).load_only(*_HEADER_COLUMNS[Category]),
+                joinedload(Product.collections).load_only(*_HEADER_COLUMNS[Collection]),
+                raiseload('*')]
+    if entity is Product:
+        raise ValueException(f'{profile.value} profile loads categories or collections!')
+    if profile == LoadProfile.NAVIGATION:
+        return [load_only(*_HEADER_COLUMNS[entity]), raiseload('*')]
+    if (profile, entity) not in ((LoadProfile.CATEGORY_PAGE, Category), (LoadProfile.COLLECTION_GRID, Collection)):
+        raise ValueException(f'{profile.value} profile does not load {entity.__tablename__}!')
+    # one IN query for the products of every parent, instead of one query per parent
+    return [selectinload(entity.products).load_only(*_LISTING_COLUMNS).raiseload('*'), raiseload('*')]
+
+
+@instrument_handler
+class CatalogHandler:
+    # reads only, may be served by a replica, see domain.models.routing
+    _ReadSession = DBInitializer.get_read_session
+
+    @classmethod
+    def _get(cls, entity, uid: int, profile: LoadProfile):
+        if not isinstance(uid, int):
+            raise TypeException("uid parameter type must be int!")
+        with session_scope(cls._ReadSession) as session:
+            item = session.query(entity).options(*_options(profile, entity)).filter(entity.uid == uid).first()
+            if not item:
+                raise ValueException(f"{entity.__name__.lower()} with this id <{uid}> doesn't exist!")
+            return item
+
+    @classmethod
+    def _list(cls, entity, profile: LoadProfile) -> list:
+        with session_scope(cls._ReadSession) as session:
+            return session.query(entity).options(*_options(profile, entity)).order_by(entity.uid).all()
+
+    @classmethod
+    def get_category(cls, uid: int, profile: LoadProfile = LoadProfile.CATEGORY_PAGE) -> Category:
+        return cls._get(Category, uid, profile)
+
+    @classmethod
+    def list_categories(cls, profile: LoadProfile = LoadProfile.NAVIGATION) -> List[Category]:
+        return cls._list(Category, profile)
+
+    @classmethod
+    def get_collection(cls, uid: int, profile: LoadProfile = LoadProfile.COLLECTION_GRID) -> Collection:
+        return cls._get(Collection, uid, profile)
+
+    @classmethod
+    def list_collections(cls, profile: LoadProfile = LoadProfile.NAVIGATION) -> List[Collection]:
+        return cls._list(Collection, profile)
+
+    @classmethod
+    def get_product(cls, uid: int) -> Product:
+        return cls._get(Product, uid, LoadProfile.PRODUCT_DETAIL)
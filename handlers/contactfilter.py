@@ -0,0 +1,213 @@
+"""
+Which emails and phones are registered, approximately: a Bloom filter that answers "definitely not registered"
+without a query. A maybe still goes to the database, so a false positive costs no more than before.
+
+The filter is per process and read again only every ``refresh`` seconds, so a user another process created is a
+false negative until then. That is why its one user is the duplicate check of a bulk import, where the unique
+constraints back a wrong "no" up; log in, ``get_user_by_*`` and ``is_*_registered`` can't trust a "no" and don't
+use it. Users are never deleted and never change their email or phone, so nothing is ever taken out.
+"""
+__all__ = ['BloomFilter', 'ContactFilter', 'contact_filter']
+
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from core.exceptions import ValueException
+from domain.models import DBInitializer, session_scope
+from domain.models import User
+
+_logger = logging.getLogger('numen.contactfilter')
+
+# seconds before a failed read of the table is tried again
+_RETRY = 30.0
+
+
+class BloomFilter:
+    """``size`` bits and ``hashes`` positions per item."""
+
+    def __init__(self, size: int, hashes: int):
+        if size < 1 or hashes < 1:
+            raise ValueException('size and hashes must be positive!')
+        self.size = size
+        self.hashes = hashes
+        self._bits = bytearray((size + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity: int, error_rate: float) -> 'BloomFilter':
+        """Sized so ``capacity`` items give about ``error_rate`` false positives."""
+        if capacity < 1 or not 0 < error_rate < 1:
+            raise ValueException('capacity must be positive and error rate between 0 and 1!')
+        size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        return cls(size, max(1, round(size / capacity * math.log(2))))
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._bits)
+
+    def _positions(self, item: str) -> Iterable[int]:
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        # double hashing: k positions out of two 64 bit hashes
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, item: str):
+        bits = self._bits
+        for position in self._positions(item):
+            bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class ContactFilter:
+    """
+    Registered emails and phones of the users table. It is read in keyset batches by ``build`` at start up, or on a
+    background thread after the first lookup (everything might exist until that is done), writes of this process are
+    added right away, and it is read again in the background every ``refresh`` seconds: users another process
+    created are unseen until then. No lookup waits for a read of the table. ``capacity`` 0 turns the filter off,
+    everything might exist.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], capacity: int = 1000000, error_rate: float = 0.01,
+                 refresh: float = 300.0, batch_size: int = 10000, clock: Callable[[], float] = time.monotonic):
+        self._Session = session_factory
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh = refresh
+        self.batch_size = batch_size
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._filter: Optional[BloomFilter] = None
+        self._built_at = None
+        self._tried_at = None
+        self._thread = None
+        # items added while a build scans, replayed into the new filter
+        self._pending = None
+
+    @classmethod
+    def from_env(cls, session_factory: Callable[[], Session]) -> 'ContactFilter':
+        return cls(session_factory, capacity=int(os.environ.get('NUMEN_CONTACT_FILTER_CAPACITY', 1000000)),
+                   error_rate=float(os.environ.get('NUMEN_CONTACT_FILTER_ERROR_RATE', 0.01)),
+                   refresh=float(os.environ.get('NUMEN_CONTACT_FILTER_REFRESH', 300)))
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    @property
+    def nbytes(self) -> int:
+        return self._filter.nbytes if self._filter is not None else 0
+
+    @staticmethod
+    def _items(email: str = None, phone: str = None) -> list:
+        items = []
+        if email:
+            items.append('e:' + email)
+        if phone:
+            items.append('p:' + phone)
+        return items
+
+    def build(self):
+        """Reads every email and phone, in batches of ``batch_size`` users; lookups meanwhile use the old filter."""
+        if not self.enabled:
+            return
+        with self._build_lock:
+            self._build()
+
+    def _build(self):
+        with self._lock:
+            self._pending = []
+        fresh = BloomFilter.for_capacity(self.capacity, self.error_rate)
+        try:
+            last = 0
+            while True:
+                with session_scope(self._Session) as session:
+                    rows = session.execute(select(User.uid, User.email, User.phone).where(User.uid > last)
+                                           .order_by(User.uid).limit(self.batch_size)).all()
+                for _, email, phone in rows:
+                    for item in self._items(email, phone):
+                        fresh.add(item)
+                if len(rows) < self.batch_size:
+                    break
+                last = rows[-1].uid
+        except BaseException:
+            with self._lock:
+                self._pending = None
+            raise
+        with self._lock:
+            for item in self._pending:
+                fresh.add(item)
+            self._pending = None
+            self._filter = fresh
+            self._built_at = self._clock()
+
+    def _rebuild_in_background(self):
+        if not self._build_lock.acquire(blocking=False):
+            # a build is running already
+            return
+        self._tried_at = self._clock()
+
+        def run():
+            try:
+                self._build()
+            except Exception:
+                # lookups keep the old filter (or none) and the table is read again after _RETRY seconds
+                _logger.exception('reading the contact filter failed')
+            finally:
+                self._build_lock.release()
+
+        self._thread = threading.Thread(target=run, name='contact-filter', daemon=True)
+        self._thread.start()
+
+    def _current(self) -> Optional[BloomFilter]:
+        current, built_at, now = self._filter, self._built_at, self._clock()
+        stale = current is None or built_at is None or (self.refresh and now - built_at >= self.refresh)
+        if stale and (self._tried_at is None or now - self._tried_at >= min(_RETRY, self.refresh or _RETRY)):
+            self._rebuild_in_background()
+        return current
+
+    def _might_contain(self, item: str) -> bool:
+        if not self.enabled:
+            return True
+        current = self._current()
+        return current is None or item in current
+
+    def might_have_email(self, email: str) -> bool:
+        """False only when no user has ``email``."""
+        return self._might_contain('e:' + email)
+
+    def might_have_phone(self, phone: str) -> bool:
+        """False only when no user has ``phone``."""
+        return self._might_contain('p:' + phone)
+
+    def add(self, email: str = None, phone: str = None):
+        with self._lock:
+            if self._filter is None and self._pending is None:
+                # not read yet, the first lookup reads it from the table
+                return
+            for item in self._items(email, phone):
+                if self._pending is not None:
+                    self._pending.append(item)
+                if self._filter is not None:
+                    self._filter.add(item)
+
+    def clear(self):
+        """Forgets everything, the next lookup reads the table again."""
+        with self._lock:
+            self._filter = None
+            self._built_at = None
+            self._tried_at = None
+
+
+# shared by UserHandler and AsyncUserHandler
+contact_filter = ContactFilter.from_env(DBInitializer.get_session)
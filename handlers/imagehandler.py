@@ -0,0 +1,66 @@
+__all__ = ['ImageHandler']
+
+from typing import List
+
+from core.exceptions import ValueException, TypeException
+from core.metrics import instrument_handler
+from domain.models import DBInitializer, session_scope
+from domain.models import Category, Collection, Product
+from handlers.imagestore import ImagePipeline, image_pipeline_from_env
+
+# entity -> attribute of its image manifest
+_MANIFESTS = {Product: 'Images', Category: 'images', Collection: 'images'}
+
+
+@instrument_handler
+class ImageHandler:
+    _Session = DBInitializer.get_session
+    # None builds the pipeline from the environment on first use
+    _pipeline = None
+
+    @classmethod
+    def _image_pipeline(cls) -> ImagePipeline:
+        if cls._pipeline is None:
+            cls._pipeline = image_pipeline_from_env()
+        return cls._pipeline
+
+    @staticmethod
+    def _attribute(entity) -> str:
+        if entity not in _MANIFESTS:
+            raise TypeException("entity must be Product, Category or Collection!")
+        return _MANIFESTS[entity]
+
+    @classmethod
+    def add_images(cls, entity, uid: int, images: List[bytes]) -> List[dict]:
+        """
+        Appends ``images`` (raw file contents) to the manifest of an entity and returns the manifest. The files
+        are stored and resized before the transaction starts, the row is locked only to append to its manifest.
+        """
+        attribute = cls._attribute(entity)
+        entries = cls._image_pipeline().ingest(images)
+        with session_scope(cls._Session) as session:
+            # two uploads to one entity must not lose each other's entries
+            item = session.query(entity).filter(entity.uid == uid).with_for_update().first()
+            if not item:
+                raise ValueException(f"{entity.__name__.lower()} with this id <{uid}> doesn't exist!")
+            # a new list, the ORM does not see changes inside a JSON value
+            manifest = list(getattr(item, attribute) or []) + entries
+            setattr(item, attribute, manifest)
+            session.commit()
+        return manifest
+
+    @classmethod
+    def remove_image(cls, entity, uid: int, digest: str) -> bool:
+        """Drops an image from the manifest; its files stay, another entity may show the same image."""
+        attribute = cls._attribute(entity)
+        with session_scope(cls._Session) as session:
+            item = session.query(entity).filter(entity.uid == uid).with_for_update().first()
+            if not item:
+                raise ValueException(f"{entity.__name__.lower()} with this id <{uid}> doesn't exist!")
+            manifest = getattr(item, attribute) or []
+            kept = [entry for entry in manifest if entry.get('digest') != digest]
+            if len(kept) == len(manifest):
+                return False
+            setattr(item, attribute, kept)
+            session.commit()
+        return True
@@ -0,0 +1,249 @@
+"""
+Images of products, categories and collections: a content addressed store on the local filesystem and a pipeline
+that makes the thumbnail variants on a worker pool.
+
+Every file is named by the SHA-256 of its bytes, so an image uploaded twice is stored once and a name never changes
+its content: responses can be cached forever, with the digest as the ETag. The catalog keeps a manifest per entity
+(a JSON list, see ``manifest_entry``) instead of free text.
+"""
+__all__ = ['ImageStore', 'ImagePipeline', 'DEFAULT_VARIANTS', 'sniff_content_type', 'pillow_thumbnail',
+           'manifest_entry', 'thumbnail_url', 'image_url', 'image_pipeline_from_env']
+
+import hashlib
+import io
+import json
+import mmap
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from core.exceptions import ValueException
+
+# name -> bounding box; a variant keeps the aspect ratio and is never larger than the original
+DEFAULT_VARIANTS = {'thumb': (200, 200), 'card': (600, 600)}
+
+_SIGNATURES = ((b'\x89PNG\r\n\x1a\n', 'image/png'), (b'\xff\xd8\xff', 'image/jpeg'), (b'GIF87a', 'image/gif'),
+               (b'GIF89a', 'image/gif'))
+_DIGEST = re.compile('^[0-9a-f]{64}$')
+_CHUNK = 1 << 20
+
+
+def sniff_content_type(data: bytes) -> Optional[str]:
+    """The image type by its magic bytes, None for anything else; the uploader's word for it is not trusted."""
+    for signature, content_type in _SIGNATURES:
+        if data.startswith(signature):
+            return content_type
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+def pillow_thumbnail(data: bytes, size: Tuple[int, int]) -> bytes:
+    """Default resize of ImagePipeline; needs Pillow, which releases the GIL while it decodes and scales."""
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as image:
+        image.thumbnail(size)
+        output = io.BytesIO()
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image.save(output, 'PNG', optimize=True)
+        else:
+            image.convert('RGB').save(output, 'JPEG', quality=85, optimize=True)
+    return output.getvalue()
+
+
+class ImageStore:
+    """Files under ``root/objects/<first two hex digits>/<digest>``, written through a temporary file and a rename."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self._objects = os.path.join(root, 'objects')
+        self._tmp = os.path.join(root, 'tmp')
+        self._variants = os.path.join(root, 'variants')
+        for directory in (self._objects, self._tmp, self._variants):
+            os.makedirs(directory, exist_ok=True)
+
+    def path(self, digest: str) -> str:
+        if not _DIGEST.match(digest or ''):
+            # digests come from urls, nothing else may reach the filesystem
+            raise ValueException('Invalid image digest!')
+        return os.path.join(self._objects, digest[:2], digest)
+
+    def __contains__(self, digest: str) -> bool:
+        return os.path.exists(self.path(digest))
+
+    def put(self, data: bytes) -> str:
+        """Stores ``data`` unless the same bytes are there already; returns the digest."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if os.path.exists(path):
+            return digest
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=self._tmp)
+        try:
+            with os.fdopen(descriptor, 'wb') as output:
+                output.write(data)
+            # atomic: a reader sees the whole file or none, and two writers of one image write the same bytes
+            os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        with open(self.path(digest), 'rb') as image:
+            return image.read()
+
+    def size(self, digest: str) -> int:
+        return os.path.getsize(self.path(digest))
+
+    def stream(self, digest: str, chunk_size: int = _CHUNK) -> Iterator[memoryview]:
+        """
+        The file in chunks of a read only memory map: the page cache is handed out as is, nothing is copied
+        into Python. A chunk is valid until the next one is asked for.
+        """
+        with open(self.path(digest), 'rb') as image:
+            size = os.fstat(image.fileno()).st_size
+            if not size:
+                return
+            with mmap.mmap(image.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                with memoryview(mapped) as view:
+                    for offset in range(0, size, chunk_size):
+                        chunk = view[offset:offset + chunk_size]
+                        try:
+                            yield chunk
+                        finally:
+                            chunk.release()
+
+    def sendfile(self, digest: str, sock, offset: int = 0, count: int = None) -> int:
+        """
+        Writes the file (or ``count`` bytes of it from ``offset``, for range requests) to ``sock``; the kernel
+        copies it from the page cache to the socket with sendfile(2) where there is one. Returns the bytes sent.
+        """
+        with open(self.path(digest), 'rb') as image:
+            return sock.sendfile(image, offset, count)
+
+    def variants(self, digest: str) -> Optional[Dict[str, str]]:
+        """The variant digests made of an original before, so a re-upload is not resized again."""
+        try:
+            with open(os.path.join(self._variants, digest), 'r') as index:
+                return json.load(index)
+        except FileNotFoundError:
+            return None
+
+    def set_variants(self, digest: str, variants: Dict[str, str]):
+        descriptor, temporary = tempfile.mkstemp(dir=self._tmp)
+        with os.fdopen(descriptor, 'w') as output:
+            json.dump(variants, output)
+        os.replace(temporary, os.path.join(self._variants, digest))
+
+    def collect(self, keep: set) -> int:
+        """
+        Removes the files no manifest refers to; ``keep`` holds every digest still in use, variants included.
+        Uploads that are not in a manifest yet look unused too, run it while none is in flight. Returns how many.
+        """
+        removed = 0
+        for directory, _, names in os.walk(self._objects):
+            for name in names:
+                if name not in keep:
+                    os.remove(os.path.join(directory, name))
+                    removed += 1
+        for name in os.listdir(self._variants):
+            if name not in keep:
+                os.remove(os.path.join(self._variants, name))
+        return removed
+
+
+def manifest_entry(digest: str, content_type: str, size: int, variants: Dict[str, str]) -> dict:
+    """One image of a manifest. Legacy free text images are ``{'url': ...}`` entries, see migration 0007."""
+    return {'digest': digest, 'content_type': content_type, 'size': size, 'variants': variants}
+
+
+def image_url(digest: str, prefix: str = None) -> str:
+    prefix = prefix if prefix is not None else os.environ.get('NUMEN_IMAGE_URL_PREFIX', '/images/')
+    return prefix + digest
+
+
+def thumbnail_url(manifest: Optional[List[dict]], variant: str = 'thumb', prefix: str = None) -> Optional[str]:
+    """What a grid shows of an entity: the ``variant`` of its first image, the original when there is none."""
+    if not manifest:
+        return None
+    first = manifest[0]
+    if 'url' in first:
+        return first['url']
+    return image_url(first['variants'].get(variant, first['digest']), prefix)
+
+
+class ImagePipeline:
+    """
+    Stores uploads and makes their ``variants`` with ``resize(data, size) -> bytes`` on a pool of ``workers``
+    threads; every variant of every image of a batch is a job of its own.
+    """
+
+    def __init__(self, store: ImageStore, variants: Dict[str, Tuple[int, int]] = None, workers: int = 4,
+                 resize: Callable[[bytes, Tuple[int, int]], bytes] = pillow_thumbnail, max_bytes: int = 10 << 20):
+        self.store = store
+        self.variants = dict(DEFAULT_VARIANTS if variants is None else variants)
+        self.workers = workers
+        self.max_bytes = max_bytes
+        self._resize = resize
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='numen-images')
+            return self._executor
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def _variant(self, data: bytes, size: Tuple[int, int]) -> str:
+        return self.store.put(self._resize(data, size))
+
+    def ingest(self, images: List[bytes]) -> List[dict]:
+        """Manifest entries of ``images``, in order; raises ValueException for anything that is not an image."""
+        checked = []
+        for data in images:
+            if len(data) > self.max_bytes:
+                raise ValueException(f'image is larger than {self.max_bytes} bytes!')
+            content_type = sniff_content_type(data)
+            if content_type is None:
+                raise ValueException('not a png, jpeg, gif or webp image!')
+            checked.append((data, content_type))
+        jobs, entries = {}, []
+        for data, content_type in checked:
+            digest = self.store.put(data)
+            variants = self.store.variants(digest)
+            if variants is None or set(variants) != set(self.variants):
+                # the same image twice in a batch is resized once
+                if digest not in jobs:
+                    jobs[digest] = {name: self._pool().submit(self._variant, data, size)
+                                    for name, size in self.variants.items()}
+                variants = None
+            entries.append(manifest_entry(digest, content_type, len(data), variants))
+        for digest, futures in jobs.items():
+            try:
+                variants = {name: future.result() for name, future in futures.items()}
+            except Exception:
+                # a broken file with the right magic bytes; its original is left to collect()
+                raise ValueException('image could not be decoded!')
+            self.store.set_variants(digest, variants)
+        for entry in entries:
+            if entry['variants'] is None:
+                entry['variants'] = self.store.variants(entry['digest'])
+        return entries
+
+
+def image_pipeline_from_env() -> ImagePipeline:
+    """``NUMEN_IMAGE_ROOT`` (``./images``), ``NUMEN_IMAGE_WORKERS`` (4) and ``NUMEN_IMAGE_MAX_BYTES`` (10 MiB)."""
+    return ImagePipeline(ImageStore(os.environ.get('NUMEN_IMAGE_ROOT', 'images')),
+                         workers=int(os.environ.get('NUMEN_IMAGE_WORKERS', 4)),
+                         max_bytes=int(os.environ.get('NUMEN_IMAGE_MAX_BYTES', 10 << 20)))
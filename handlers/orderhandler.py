@@ -0,0 +1,183 @@
+__all__ = ['OrderHandler', 'CartLine', 'CHECKOUT_OUT_OF_STOCK']
+
+from collections import namedtuple
+from datetime import datetime
+from typing import Dict, List
+
+from sqlalchemy import update, delete, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, selectinload
+
+from core.exceptions import ValueException, TypeException, OutOfStockException
+from core.metrics import REGISTRY, Counter, instrument_handler
+from domain.models import DBInitializer, session_scope
+from domain.models import Cart, CartItem, Order, OrderLine, Product
+from domain.models.order import OrderState
+
+CartLine = namedtuple('CartLine', ['product_id', 'quantity'])
+
+CHECKOUT_OUT_OF_STOCK = REGISTRY.register(Counter('numen_checkout_out_of_stock_total',
+                                                  'Checkouts refused because a product ran out of stock.'))
+
+
+def _check_ids(**ids):
+    for name, value in ids.items():
+        if not isinstance(value, int):
+            raise TypeException(f"{name} parameter type must be int!")
+
+
+@instrument_handler
+class OrderHandler:
+    """
+    Carts and orders. A cart reserves nothing; checkout takes the stock with one conditional
+    ``UPDATE products SET stock = stock - n WHERE uid = ? AND stock >= n`` per product, no row is locked across
+    requests and no read of the stock has to be repeated.
+    """
+    _Session = DBInitializer.get_session
+    # reads that may be served by a replica, see domain.models.routing
+    _ReadSession = DBInitializer.get_read_session
+
+    @staticmethod
+    def _cart(session: Session, user_id: int) -> Cart:
+        cart = session.query(Cart).filter_by(user_id=user_id).first()
+        if cart is None:
+            cart = Cart(user_id=user_id)
+            session.add(cart)
+            session.flush()
+        return cart
+
+    @classmethod
+    def add_to_cart(cls, user_id: int, product_id: int, quantity: int = 1) -> int:
+        """Adds ``quantity`` units to the user's cart and returns how many of the product it holds."""
+        _check_ids(user_id=user_id, product_id=product_id)
+        if not isinstance(quantity, int) or quantity < 1:
+            raise ValueException("quantity must be a positive int!")
+        # the first item of two concurrent calls creates the cart (or the item), the loser finds it on the second
+        # attempt
+        for attempt in range(2):
+            try:
+                with session_scope(cls._Session) as session:
+                    if session.query(Product.uid).filter_by(uid=product_id).first() is None:
+                        raise ValueException(f"product with this id <{product_id}> doesn't exist!")
+                    cart = cls._cart(session, user_id)
+                    cart.updated_time = datetime.utcnow()
+                    # in the database, concurrent adds of one product all count
+                    added = session.execute(update(CartItem)
+                                            .where(CartItem.cart_id == cart.uid, CartItem.product_id == product_id)
+                                            .values(quantity=CartItem.quantity + quantity)
+                                            .execution_options(synchronize_session=False)).rowcount
+                    if not added:
+                        session.add(CartItem(cart_id=cart.uid, product_id=product_id, quantity=quantity))
+                        session.flush()
+                    held = session.query(CartItem.quantity).filter_by(cart_id=cart.uid, product_id=product_id) \
+                        .scalar()
+                    session.commit()
+                    return held
+            except IntegrityError:
+                if attempt:
+                    raise
+
+    @classmethod
+    def remove_from_cart(cls, user_id: int, product_id: int) -> bool:
+        _check_ids(user_id=user_id, product_id=product_id)
+        with session_scope(cls._Session) as session:
+            cart_ids = session.query(Cart.uid).filter_by(user_id=user_id).scalar_subquery()
+            removed = session.query(CartItem).filter(CartItem.cart_id == cart_ids,
+                                                     CartItem.product_id == product_id) \
+                .delete(synchronize_session=False)
+            session.commit()
+        return bool(removed)
+
+    @classmethod
+    def get_cart(cls, user_id: int) -> List[CartLine]:
+        _check_ids(user_id=user_id)
+        # the user's own cart; read on the primary, it was most likely just written
+        with session_scope(cls._Session) as session:
+            rows = session.query(CartItem.product_id, CartItem.quantity).join(Cart) \
+                .filter(Cart.user_id == user_id).order_by(CartItem.product_id).all()
+        return [CartLine(*row) for row in rows]
+
+    @classmethod
+    def checkout(cls, user_id: int, session: Session = None) -> Order:
+        """
+        Turns the user's cart into a placed order; raises OutOfStockException and changes nothing when a product
+        is short, ValueException when the cart changed while it was read. The stock is taken last, right before the
+        commit, so a hot product's row is locked for as short as possible and concurrent checkouts of it don't queue
+        behind each other's whole transaction. With ``session`` the order is part of the caller's unit of work and
+        the lock is held until the caller commits.
+        """
+        _check_ids(user_id=user_id)
+        borrowed = session is not None
+        with session_scope(cls._Session, session) as session:
+            items = session.query(CartItem.uid, CartItem.product_id, CartItem.quantity).join(Cart) \
+                .filter(Cart.user_id == user_id).all()
+            if not items:
+                raise ValueException("cart is empty!")
+            cls._claim_cart(session, items)
+            quantities = {product_id: quantity for _, product_id, quantity in items}
+            prices = dict(session.query(Product.uid, Product.effective_price).filter(Product.uid.in_(quantities)))
+            missing = set(quantities) - set(prices)
+            if missing:
+                raise ValueException(f"products with these ids <{sorted(missing)}> don't exist!")
+            lines = [OrderLine(product_id=product_id, quantity=quantity, unit_price=prices[product_id])
+                     for product_id, quantity in sorted(quantities.items())]
+            order = Order(user_id=user_id, state=OrderState.PLACED.value, lines=lines,
+                          total=sum(line.unit_price * line.quantity for line in lines))
+            session.add(order)
+            session.flush()
+            cls._take_stock(session, quantities)
+            if not borrowed:
+                session.commit()
+        return order
+
+    @staticmethod
+    def _claim_cart(session: Session, items: list):
+        # the items are deleted as they were read: of two checkouts of one cart only the one that deletes them all
+        # goes on, and an item added to since it was read isn't sold at the old quantity
+        claimed = session.execute(delete(CartItem)
+                                  .where(tuple_(CartItem.uid, CartItem.quantity)
+                                         .in_([(uid, quantity) for uid, _, quantity in items]))
+                                  .execution_options(synchronize_session=False)).rowcount
+        if claimed != len(items):
+            raise ValueException("cart changed during checkout, try again!")
+
+    @staticmethod
+    def _take_stock(session: Session, quantities: Dict[int, int]):
+        # in product order: two checkouts of the same products lock them in the same order and can't deadlock
+        for product_id, quantity in sorted(quantities.items()):
+            taken = session.execute(update(Product).where(Product.uid == product_id, Product.stock >= quantity)
+                                    .values(stock=Product.stock - quantity)
+                                    .execution_options(synchronize_session=False)).rowcount
+            if not taken:
+                CHECKOUT_OUT_OF_STOCK.inc()
+                raise OutOfStockException(f"product <{product_id}> is out of stock!", [product_id])
+
+    @classmethod
+    def get_order(cls, order_id: int) -> Order:
+        _check_ids(order_id=order_id)
+        with session_scope(cls._ReadSession) as session:
+            order = session.query(Order).options(selectinload(Order.lines)).filter_by(uid=order_id).first()
+            if not order:
+                raise ValueException(f"order with this id <{order_id}> doesn't exist!")
+            return order
+
+    @classmethod
+    def cancel_order(cls, order_id: int) -> bool:
+        """Cancels a placed order and puts its stock back; False when it was already cancelled or paid."""
+        _check_ids(order_id=order_id)
+        with session_scope(cls._Session) as session:
+            # only the caller that moves the state restocks, even when cancels race
+            cancelled = session.query(Order).filter_by(uid=order_id, state=OrderState.PLACED.value) \
+                .update({Order.state: OrderState.CANCELLED.value}, synchronize_session=False)
+            if not cancelled:
+                if session.query(Order.uid).filter_by(uid=order_id).first() is None:
+                    raise ValueException(f"order with this id <{order_id}> doesn't exist!")
+                return False
+            lines = session.query(OrderLine.product_id, OrderLine.quantity).filter_by(order_id=order_id) \
+                .order_by(OrderLine.product_id).all()
+            for product_id, quantity in lines:
+                session.execute(update(Product).where(Product.uid == product_id)
+                                .values(stock=Product.stock + quantity)
+                                .execution_options(synchronize_session=False))
+            session.commit()
+        return True
@@ -0,0 +1,369 @@
+"""
+Delivery of the notifications handlers write to the ``outbox`` table (see domain.models.outbox): a request only
+inserts a row in its own transaction, an OutboxDispatcher sends the rows later in batches per provider.
+
+Delivery is at least once. A batch is claimed in a short transaction of its own and recorded in another one, so a
+dispatcher that dies in between leaves its batch to be claimed again when the lease runs out.
+"""
+__all__ = ['Notification', 'Provider', 'SmtpProvider', 'HttpSmsProvider', 'OutboxDispatcher', 'DispatchStats',
+           'outbox_dispatcher_from_env', 'OUTBOX_SENT', 'OUTBOX_RETRIED', 'OUTBOX_FAILED']
+
+import json
+import logging
+import os
+import random
+import secrets
+import smtplib
+import threading
+import urllib.request
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from typing import Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import select, update, delete
+
+from core.exceptions import ValueException
+from core.metrics import REGISTRY, Counter
+from domain.models import DBInitializer, OutboxMessage, session_scope
+from domain.models.outbox import OutboxState, EMAIL, SMS
+
+# ``claim`` is the lease the message was taken under, its outcome is only recorded while the lease holds
+Notification = namedtuple('Notification', ['uid', 'channel', 'recipient', 'subject', 'body', 'attempts', 'claim'])
+
+OUTBOX_SENT = REGISTRY.register(Counter('numen_outbox_sent_total', 'Outbox messages delivered.', ['channel']))
+OUTBOX_RETRIED = REGISTRY.register(Counter('numen_outbox_retried_total',
+                                           'Outbox deliveries that failed and were scheduled again.', ['channel']))
+OUTBOX_FAILED = REGISTRY.register(Counter('numen_outbox_failed_total',
+                                          'Outbox messages given up after their last attempt.', ['channel']))
+
+_logger = logging.getLogger('numen.outbox')
+
+
+class Provider(ABC):
+    """Sends the messages of one channel. ``send`` returns an error (or None) per message; raising fails them all."""
+    channel: str = None
+
+    @abstractmethod
+    def send(self, messages: List[Notification]) -> List[Optional[str]]:
+        """One error message or None per message, in order."""
+
+
+class SmtpProvider(Provider):
+    """Email over SMTP, one connection per batch."""
+    channel = EMAIL
+
+    def __init__(self, host: str, port: int = 25, sender: str = 'no-reply@localhost', username: str = None,
+                 password: str = None, starttls: bool = False, timeout: float = 10.0):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+
+    def _email(self, message: Notification) -> EmailMessage:
+        email = EmailMessage()
+        email['From'] = self.sender
+        email['To'] = message.recipient
+        email['Subject'] = message.subject or ''
+        email.set_content(message.body)
+        return email
+
+    def send(self, messages: List[Notification]) -> List[Optional[str]]:
+        errors, broken = [], None
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            for message in messages:
+                if broken:
+                    errors.append(broken)
+                    continue
+                try:
+                    smtp.send_message(self._email(message))
+                except smtplib.SMTPServerDisconnected as ex:
+                    # the rest of the batch never reached the server
+                    broken = str(ex) or 'disconnected'
+                    errors.append(broken)
+                except smtplib.SMTPException as ex:
+                    errors.append(str(ex))
+                else:
+                    errors.append(None)
+        return errors
+
+
+class HttpSmsProvider(Provider):
+    """
+    Text messages through an HTTP gateway: one JSON POST per batch,
+    ``{"from": sender, "messages": [{"to": ..., "text": ...}, ...]}``; any 2xx answer accepts them all.
+    """
+    channel = SMS
+
+    def __init__(self, url: str, token: str = None, sender: str = None, timeout: float = 10.0):
+        self.url = url
+        self.token = token
+        self.sender = sender
+        self.timeout = timeout
+
+    def send(self, messages: List[Notification]) -> List[Optional[str]]:
+        payload = {'from': self.sender, 'messages': [{'to': m.recipient, 'text': m.body} for m in messages]}
+        request = urllib.request.Request(self.url, json.dumps(payload).encode(), method='POST',
+                                         headers={'Content-Type': 'application/json'})
+        if self.token:
+            request.add_header('Authorization', f'Bearer {self.token}')
+        # urlopen raises HTTPError for anything but 2xx
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+        return [None] * len(messages)
+
+
+class DispatchStats:
+    def __init__(self):
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.batches = 0
+        self.errors = 0
+        self.last_run = None
+
+    def __repr__(self):
+        return "DispatchStats(sent=%r, retried=%r, failed=%r, batches=%r, errors=%r)" \
+               % (self.sent, self.retried, self.failed, self.batches, self.errors)
+
+
+class OutboxDispatcher:
+    """
+    Sends due outbox messages through ``providers`` (one per channel) on a pool of ``workers`` threads.
+
+    Every channel is drained by at most ``concurrency`` batches at a time (a number, or a ``{channel: number}``
+    map), so a slow or rate limited provider neither gets flooded nor holds up the others. A failed message is
+    tried again after ``base_delay * 2 ** (attempts - 1)`` seconds, at most ``max_delay``, shortened by up to
+    ``jitter`` of it so retries of one outage don't come back together; after ``max_attempts`` it is given up.
+    """
+    _Session = DBInitializer.get_session
+
+    def __init__(self, providers: Iterable[Provider], batch_size: int = 100, workers: int = 4,
+                 concurrency=2, max_attempts: int = 8, base_delay: float = 1.0, max_delay: float = 300.0,
+                 jitter: float = 0.5, lease: float = 60.0, clock: Callable[[], datetime] = datetime.utcnow):
+        if batch_size < 1:
+            raise ValueException('batch size must be positive!')
+        self.providers: Dict[str, Provider] = {provider.channel: provider for provider in providers}
+        if isinstance(concurrency, int):
+            concurrency = {channel: concurrency for channel in self.providers}
+        self.concurrency = {channel: max(1, concurrency.get(channel, 1)) for channel in self.providers}
+        self.batch_size = batch_size
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.lease = timedelta(seconds=lease)
+        self.stats = DispatchStats()
+        self._clock = clock
+        self._random = random.Random()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='numen-outbox')
+            return self._executor
+
+    def backoff(self, attempts: int) -> float:
+        """Seconds to wait before the next attempt of a message that failed ``attempts`` times."""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay * (1 - self.jitter * self._random.random())
+
+    def claim(self, channel: str) -> List[Notification]:
+        """
+        Takes up to ``batch_size`` due messages of ``channel`` for one lease; an attempt is counted when it is
+        claimed, so a message that crashes its dispatcher is still given up in the end.
+        """
+        now = self._clock()
+        claim = secrets.token_hex(8)
+        with session_scope(self._Session) as session:
+            # SKIP LOCKED: concurrent dispatchers take different rows instead of waiting for each other
+            due = session.execute(
+                select(OutboxMessage.uid)
+                .where(OutboxMessage.state == OutboxState.PENDING.value, OutboxMessage.channel == channel,
+                       OutboxMessage.next_attempt_time <= now)
+                .order_by(OutboxMessage.next_attempt_time).limit(self.batch_size)
+                .with_for_update(skip_locked=True)).scalars().all()
+            if not due:
+                return []
+            # conditional, a row another dispatcher claimed in the meantime is left out (sqlite has no row locks)
+            session.execute(update(OutboxMessage)
+                            .where(OutboxMessage.uid.in_(due), OutboxMessage.state == OutboxState.PENDING.value,
+                                   OutboxMessage.next_attempt_time <= now)
+                            .values(claim=claim, attempts=OutboxMessage.attempts + 1,
+                                    next_attempt_time=now + self.lease)
+                            .execution_options(synchronize_session=False))
+            rows = session.execute(select(OutboxMessage.uid, OutboxMessage.channel, OutboxMessage.recipient,
+                                          OutboxMessage.subject, OutboxMessage.body, OutboxMessage.attempts,
+                                          OutboxMessage.claim)
+                                   .where(OutboxMessage.claim == claim).order_by(OutboxMessage.uid)).all()
+            session.commit()
+        return [Notification(*row) for row in rows]
+
+    def record(self, batch: List[Notification], errors: List[Optional[str]]):
+        """
+        Stores the outcome of a claimed batch: sent, due again after a backoff, or given up. A message whose lease
+        ran out and was claimed again belongs to the new claim and is left alone.
+        """
+        now = self._clock()
+        sent = [message for message, error in zip(batch, errors) if error is None]
+        recorded_sent = failed = retried = 0
+        with session_scope(self._Session) as session:
+            if sent:
+                recorded_sent = session.execute(
+                    update(OutboxMessage)
+                    .where(OutboxMessage.uid.in_([message.uid for message in sent]),
+                           OutboxMessage.claim == sent[0].claim)
+                    .values(state=OutboxState.SENT.value, sent_time=now, claim=None, last_error=None)
+                    .execution_options(synchronize_session=False)).rowcount
+            for message, error in zip(batch, errors):
+                if error is None:
+                    continue
+                given_up = message.attempts >= self.max_attempts
+                if given_up:
+                    values = {'state': OutboxState.FAILED.value}
+                else:
+                    values = {'next_attempt_time': now + timedelta(seconds=self.backoff(message.attempts))}
+                if session.execute(update(OutboxMessage)
+                                   .where(OutboxMessage.uid == message.uid, OutboxMessage.claim == message.claim)
+                                   .values(claim=None, last_error=error[:500], **values)
+                                   .execution_options(synchronize_session=False)).rowcount:
+                    failed += given_up
+                    retried += not given_up
+            session.commit()
+        channel = batch[0].channel
+        with self._lock:
+            self.stats.sent += recorded_sent
+            self.stats.retried += retried
+            self.stats.failed += failed
+            self.stats.batches += 1
+        OUTBOX_SENT.inc(recorded_sent, channel=channel)
+        OUTBOX_RETRIED.inc(retried, channel=channel)
+        OUTBOX_FAILED.inc(failed, channel=channel)
+
+    def deliver(self, batch: List[Notification]):
+        """Sends a claimed batch through its provider and records the outcome."""
+        try:
+            errors = self.providers[batch[0].channel].send(batch)
+        except Exception as ex:
+            errors = [f'{type(ex).__name__}: {ex}'] * len(batch)
+        self.record(batch, errors)
+
+    def dispatch(self, channel: str) -> int:
+        """Claims, sends and records one batch of ``channel``; returns its size."""
+        batch = self.claim(channel)
+        if batch:
+            self.deliver(batch)
+        return len(batch)
+
+    def _deliver(self, batch: List[Notification], slot: threading.Semaphore, freed: threading.Event):
+        try:
+            self.deliver(batch)
+        finally:
+            slot.release()
+            freed.set()
+
+    def run_once(self) -> int:
+        """
+        Sends everything that is due and returns the number of messages handled. Batches are claimed here, one at a
+        time, and sent on the pool while their channel has a free slot; a full channel doesn't stop the others.
+        """
+        slots = {channel: threading.Semaphore(limit) for channel, limit in self.concurrency.items()}
+        freed = threading.Event()
+        pending, futures, handled = list(self.providers), [], 0
+        while pending and not self._stop.is_set():
+            claimed = False
+            for channel in list(pending):
+                if not slots[channel].acquire(blocking=False):
+                    continue
+                claimed = True
+                batch = self.claim(channel)
+                if not batch:
+                    slots[channel].release()
+                    pending.remove(channel)
+                    continue
+                handled += len(batch)
+                futures.append(self._pool().submit(self._deliver, batch, slots[channel], freed))
+            if not claimed:
+                # every channel with work left is at its limit, a finished batch frees a slot
+                freed.wait()
+                freed.clear()
+        for future in futures:
+            future.result()
+        self.stats.last_run = datetime.utcnow()
+        return handled
+
+    def purge(self, older_than: timedelta = timedelta(days=7)) -> int:
+        """Deletes messages sent before ``older_than``; the failed ones stay for a look."""
+        with session_scope(self._Session) as session:
+            removed = session.execute(delete(OutboxMessage)
+                                      .where(OutboxMessage.state == OutboxState.SENT.value,
+                                             OutboxMessage.sent_time < self._clock() - older_than)
+                                      .execution_options(synchronize_session=False)).rowcount
+            session.commit()
+        return removed
+
+    def start(self, interval: float = 0.5):
+        """Runs ``run_once`` every ``interval`` seconds on a daemon thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+
+        def loop():
+            while not self._stop.is_set():
+                try:
+                    self.run_once()
+                except Exception:
+                    # the database went away; claimed batches come back when their lease runs out
+                    self.stats.errors += 1
+                    _logger.exception('outbox dispatch failed')
+                self._stop.wait(interval)
+
+        self._thread = threading.Thread(target=loop, name='outbox-dispatcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+def outbox_dispatcher_from_env() -> OutboxDispatcher:
+    """
+    Email goes out when ``NUMEN_SMTP_HOST`` is set (with ``NUMEN_SMTP_PORT``, ``_SENDER``, ``_USER``,
+    ``_PASSWORD`` and ``_STARTTLS``), text messages when ``NUMEN_SMS_URL`` is (with ``NUMEN_SMS_TOKEN`` and
+    ``_SENDER``); the messages of a channel without a provider wait in the outbox. ``NUMEN_OUTBOX_WORKERS`` (4),
+    ``NUMEN_OUTBOX_BATCH`` (100), ``NUMEN_OUTBOX_CONCURRENCY`` (2 per channel) and ``NUMEN_OUTBOX_MAX_ATTEMPTS``
+    (8) tune the dispatcher.
+    """
+    providers = []
+    if os.environ.get('NUMEN_SMTP_HOST'):
+        providers.append(SmtpProvider(os.environ['NUMEN_SMTP_HOST'], int(os.environ.get('NUMEN_SMTP_PORT', 25)),
+                                      os.environ.get('NUMEN_SMTP_SENDER', 'no-reply@localhost'),
+                                      os.environ.get('NUMEN_SMTP_USER'), os.environ.get('NUMEN_SMTP_PASSWORD'),
+                                      os.environ.get('NUMEN_SMTP_STARTTLS', '') in ('1', 'true', 'yes')))
+    if os.environ.get('NUMEN_SMS_URL'):
+        providers.append(HttpSmsProvider(os.environ['NUMEN_SMS_URL'], os.environ.get('NUMEN_SMS_TOKEN'),
+                                         os.environ.get('NUMEN_SMS_SENDER')))
+    return OutboxDispatcher(providers, batch_size=int(os.environ.get('NUMEN_OUTBOX_BATCH', 100)),
+                            workers=int(os.environ.get('NUMEN_OUTBOX_WORKERS', 4)),
+                            concurrency=int(os.environ.get('NUMEN_OUTBOX_CONCURRENCY', 2)),
+                            max_attempts=int(os.environ.get('NUMEN_OUTBOX_MAX_ATTEMPTS', 8)))
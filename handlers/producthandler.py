@@ -0,0 +1,249 @@
+__all__ = ['ProductHandler', 'ProductSort', 'ProductSummary', 'ProductPage', 'MAX_PAGE_SIZE']
+
+import base64
+import json
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+from enum import Enum
+from typing import List
+
+from sqlalchemy import tuple_, func, cast
+
+from core.exceptions import ValueException, TypeException
+from core.metrics import instrument_handler
+from domain.models import DBInitializer, session_scope
+from domain.models import Product
+from domain.models.pricing import PRICE, to_decimal, effective_price_sql
+from handlers.imagestore import thumbnail_url
+from handlers.productsearch import ProductSearchIndex, search_index_from_env
+
+MAX_PAGE_SIZE = 100
+
+# listing rows carry only these columns; description is filled only when it is asked for, thumbnail is the url a
+# grid shows (the thumb variant of the first image, not the original)
+ProductSummary = namedtuple('ProductSummary', ['uid', 'title', 'price', 'discount', 'effective_price', 'images',
+                                               'category_id', 'collection_id', 'thumbnail', 'description'],
+                            defaults=[None, None])
+# next_cursor is None on the last page
+ProductPage = namedtuple('ProductPage', ['items', 'next_cursor'])
+
+
+class ProductSort(Enum):
+    NEWEST = 'newest'
+    PRICE_ASC = 'price_asc'
+    PRICE_DESC = 'price_desc'
+
+
+_PRODUCT_COLUMNS = ('title', 'description', 'Images', 'price', 'discount', 'collection_id', 'category_id')
+
+_SUMMARY_COLUMNS = (Product.uid, Product.title, Product.price, Product.discount, Product.effective_price,
+                    Product.Images.label('images'), Product.category_id, Product.collection_id)
+
+
+def _sort_key(sort: ProductSort):
+    """Columns of the keyset and whether the listing runs backwards on them."""
+    if sort == ProductSort.NEWEST:
+        return (Product.uid,), True
+    return (Product.effective_price, Product.uid), sort == ProductSort.PRICE_DESC
+
+
+def _check_limit(limit: int):
+    if not isinstance(limit, int) or isinstance(limit, bool):
+        raise TypeException("limit parameter type must be int!")
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise ValueException(f"limit must be between 1 and {MAX_PAGE_SIZE}!")
+
+
+def _summary(row) -> ProductSummary:
+    return ProductSummary(thumbnail=thumbnail_url(row.images), **row._asdict())
+
+
+def encode_cursor(sort: ProductSort, key: tuple) -> str:
+    # prices as decimal strings, a float could land between two stored prices
+    key = [str(value) if isinstance(value, Decimal) else value for value in key]
+    raw = json.dumps([sort.value, key], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(sort: ProductSort, cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, key = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueException('Invalid cursor!')
+    if cursor_sort != sort.value or not isinstance(key, list) or len(key) != len(_sort_key(sort)[0]):
+        raise ValueException('Cursor belongs to another sort order!')
+    # the last value is the uid; anything else would only fail in the database
+    if not isinstance(key[-1], int) or isinstance(key[-1], bool):
+        raise ValueException('Invalid cursor!')
+    if sort != ProductSort.NEWEST:
+        try:
+            key[0] = to_decimal(key[0])
+        except (InvalidOperation, TypeError):
+            raise ValueException('Invalid cursor!')
+    return tuple(key)
+
+
+@instrument_handler
+class ProductHandler:
+    _Session = DBInitializer.get_session
+    # reads that may be served by a replica, see domain.models.routing
+    _ReadSession = DBInitializer.get_read_session
+    # None picks the backend from the environment on first use
+    _search_index = None
+
+    @classmethod
+    def _product_search(cls) -> ProductSearchIndex:
+        if cls._search_index is None:
+            cls._search_index = search_index_from_env(cls._Session)
+        return cls._search_index
+
+    @classmethod
+    def create_product(cls, product: Product) -> int:
+        with session_scope(cls._Session) as session:
+            session.add(product)
+            session.commit()
+        cls._product_search().index(product.uid, product.title, product.description)
+        return product.uid
+
+    @classmethod
+    def update_product(cls, uid: int, **values) -> Product:
+        unknown = set(values) - set(_PRODUCT_COLUMNS)
+        if unknown:
+            raise ValueException(f"unknown product fields: {', '.join(sorted(unknown))}")
+        with session_scope(cls._Session) as session:
+            product = session.query(Product).get(uid)
+            if not product:
+                raise ValueException(f"product with this id <{uid}> doesn't exist!")
+            for name, value in values.items():
+                setattr(product, name, value)
+            session.commit()
+        if 'title' in values or 'description' in values:
+            cls._product_search().index(product.uid, product.title, product.description)
+        return product
+
+    @classmethod
+    def delete_product(cls, uid: int) -> bool:
+        with session_scope(cls._Session) as session:
+            deleted = session.query(Product).filter_by(uid=uid).delete(synchronize_session=False)
+            session.commit()
+        cls._product_search().remove(uid)
+        return bool(deleted)
+
+    @classmethod
+    def apply_discount(cls, percent: float, category_id: int = None, collection_id: int = None) -> int:
+        """
+        Sets the discount of every product of the category and/or collection (of all products when neither is
+        given) to ``percent`` of its price, 0 ends a campaign. One UPDATE computes the discounts and the effective
+        prices in the database, however many products it touches; returns how many it did.
+        """
+        if not isinstance(percent, (int, float, Decimal)) or not 0 <= percent <= 100:
+            raise ValueException("percent must be between 0 and 100!")
+        discount = func.round(cast(Product.price, PRICE) * to_decimal(percent) / 100, 2)
+        with session_scope(cls._Session) as session:
+            query = session.query(Product)
+            if category_id is not None:
+                query = query.filter(Product.category_id == category_id)
+            if collection_id is not None:
+                query = query.filter(Product.collection_id == collection_id)
+            # both SET expressions see the row as it was, so the price is discounted by the new discount
+            updated = query.update({Product.discount: discount,
+                                    Product.effective_price: effective_price_sql(Product.price, discount)},
+                                   synchronize_session=False)
+            session.commit()
+        return updated
+
+    @classmethod
+    def recompute_effective_prices(cls) -> int:
+        """
+        For prices and discounts written around the handlers (imports, manual fixes): one UPDATE of the rows whose
+        stored effective price is off; returns how many there were.
+        """
+        expected = effective_price_sql(Product.price, Product.discount)
+        with session_scope(cls._Session) as session:
+            updated = session.query(Product).filter(Product.effective_price != expected) \
+                .update({Product.effective_price: expected}, synchronize_session=False)
+            session.commit()
+        return updated
+
+    @classmethod
+    def add_stock(cls, uid: int, quantity: int) -> int:
+        """Adds ``quantity`` units in place (concurrent checkouts keep theirs) and returns the new stock."""
+        if not isinstance(quantity, int) or quantity < 1:
+            raise ValueException("quantity must be a positive int!")
+        with session_scope(cls._Session) as session:
+            added = session.query(Product).filter_by(uid=uid) \
+                .update({Product.stock: Product.stock + quantity}, synchronize_session=False)
+            if not added:
+                raise ValueException(f"product with this id <{uid}> doesn't exist!")
+            stock = session.query(Product.stock).filter_by(uid=uid).scalar()
+            session.commit()
+        return stock
+
+    @classmethod
+    def get_product(cls, uid: int) -> Product:
+        if not isinstance(uid, int):
+            raise TypeException("uid parameter type must be int!")
+        with session_scope(cls._ReadSession) as session:
+            product = session.query(Product).get(uid)
+            if not product:
+                raise ValueException(f"product with this id <{uid}> doesn't exist!")
+            return product
+
+    @classmethod
+    def list_products(cls, category_id: int = None, collection_id: int = None, min_price: float = None,
+                      max_price: float = None, sort: ProductSort = ProductSort.NEWEST, limit: int = 20,
+                      cursor: str = None, with_description: bool = False) -> ProductPage:
+        """
+        One page of products, filtered by category, collection and range of the effective price (the price after
+        discount), which is also what the price sorts order by.
+
+        Pages are cut by keyset instead of OFFSET: ``cursor`` (the ``next_cursor`` of the previous page) holds
+        the sort key of the last row, and the query seeks past it on the listing indexes, so a deep page
+        costs the same as the first one.
+        """
+        if not isinstance(sort, ProductSort):
+            raise TypeException("sort parameter type must be ProductSort!")
+        _check_limit(limit)
+        # a bad cursor is refused before a connection is taken
+        after = decode_cursor(sort, cursor) if cursor else None
+        key_columns, descending = _sort_key(sort)
+        columns = _SUMMARY_COLUMNS + ((Product.description,) if with_description else ())
+        with session_scope(cls._ReadSession) as session:
+            query = session.query(*columns)
+            if category_id is not None:
+                query = query.filter(Product.category_id == category_id)
+            if collection_id is not None:
+                query = query.filter(Product.collection_id == collection_id)
+            if min_price is not None:
+                query = query.filter(Product.effective_price >= to_decimal(min_price))
+            if max_price is not None:
+                query = query.filter(Product.effective_price <= to_decimal(max_price))
+            if after is not None:
+                key, after = tuple_(*key_columns), tuple_(*after)
+                query = query.filter(key < after if descending else key > after)
+            query = query.order_by(*(column.desc() if descending else column for column in key_columns))
+            # one row more than asked tells whether there is a next page
+            rows = query.limit(limit + 1).all()
+        items = [_summary(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = items[-1]
+            next_cursor = encode_cursor(sort, tuple(getattr(last, column.key) for column in key_columns))
+        return ProductPage(items, next_cursor)
+
+    @classmethod
+    def search(cls, query: str, limit: int = 20, with_description: bool = False) -> List[ProductSummary]:
+        """Products matching every word of ``query`` (as a prefix), best match first."""
+        if not isinstance(query, str):
+            raise TypeException("query parameter type must be string!")
+        _check_limit(limit)
+        hits = cls._product_search().search(query, limit)
+        if not hits:
+            return []
+        columns = _SUMMARY_COLUMNS + ((Product.description,) if with_description else ())
+        with session_scope(cls._ReadSession) as session:
+            rows = session.query(*columns).filter(Product.uid.in_([hit.uid for hit in hits])).all()
+        by_uid = {row.uid: _summary(row) for row in rows}
+        # a product deleted by another process may still be in an in process index
+        return [by_uid[hit.uid] for hit in hits if hit.uid in by_uid]
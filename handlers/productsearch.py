@@ -0,0 +1,201 @@
+__all__ = ['SearchHit', 'ProductSearchIndex', 'MemorySearchIndex', 'PostgresSearchIndex', 'tokenize',
+           'search_index_from_env', 'TITLE_WEIGHT']
+
+import bisect
+import math
+import os
+import re
+import threading
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from typing import Callable, Dict, List
+
+from sqlalchemy import func, literal_column, select
+from sqlalchemy.orm import Session
+
+from core.exceptions import ValueException
+from domain.models import DBInitializer, session_scope
+from domain.models import Product
+
+SearchHit = namedtuple('SearchHit', ['uid', 'score'])
+
+# a term in the title counts as much as this many in the description
+TITLE_WEIGHT = 3
+
+# letters and digits; underscores split words as in postgres
+_WORD = re.compile(r'[^\W_]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower cased words, the same split postgres' ``simple`` configuration makes."""
+    return _WORD.findall(text.lower()) if text else []
+
+
+class ProductSearchIndex(ABC):
+    """Ranked search over product title and description; every query term matches as a prefix."""
+
+    @abstractmethod
+    def search(self, query: str, limit: int = 20) -> List[SearchHit]:
+        """Best ``limit`` hits, highest score first."""
+
+    def index(self, uid: int, title: str, description: str):
+        """Called after a product was written; a no-op for indexes the database keeps up to date."""
+
+    def remove(self, uid: int):
+        """Called after a product was deleted."""
+
+
+class MemorySearchIndex(ProductSearchIndex):
+    """
+    In process inverted index for SQLite and tests. It is built from the products table on the first search
+    and kept current by ``index``/``remove``; writes made by other processes are not seen.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session] = None, batch_size: int = 1000):
+        self._Session = session_factory
+        self.batch_size = batch_size
+        self._lock = threading.RLock()
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._documents: Dict[int, Dict[str, int]] = {}
+        # sorted for prefix lookups
+        self._terms: List[str] = []
+        self._built = False
+
+    def __len__(self):
+        return len(self._documents)
+
+    def build(self):
+        """Reads every product, in keyset batches of ``batch_size``."""
+        with self._lock:
+            self._postings.clear()
+            self._documents.clear()
+            self._terms.clear()
+            last = 0
+            while True:
+                with session_scope(self._Session) as session:
+                    rows = session.execute(select(Product.uid, Product.title, Product.description)
+                                           .where(Product.uid > last).order_by(Product.uid)
+                                           .limit(self.batch_size)).all()
+                for uid, title, description in rows:
+                    self._add(uid, title, description)
+                if len(rows) < self.batch_size:
+                    break
+                last = rows[-1].uid
+            self._built = True
+
+    def _ensure_built(self):
+        if not self._built:
+            self.build()
+
+    @staticmethod
+    def _weights(title: str, description: str) -> Dict[str, int]:
+        weights = {}
+        for term in tokenize(title):
+            weights[term] = weights.get(term, 0) + TITLE_WEIGHT
+        for term in tokenize(description):
+            weights[term] = weights.get(term, 0) + 1
+        return weights
+
+    def _add(self, uid: int, title: str, description: str):
+        weights = self._weights(title, description)
+        self._documents[uid] = weights
+        for term, weight in weights.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                bisect.insort(self._terms, term)
+            postings[uid] = weight
+
+    def _discard(self, uid: int):
+        for term in self._documents.pop(uid, {}):
+            postings = self._postings[term]
+            del postings[uid]
+            if not postings:
+                del self._postings[term]
+                del self._terms[bisect.bisect_left(self._terms, term)]
+
+    def index(self, uid: int, title: str, description: str):
+        with self._lock:
+            if not self._built:
+                # the first search reads the product from the table anyway
+                return
+            self._discard(uid)
+            self._add(uid, title, description)
+
+    def remove(self, uid: int):
+        with self._lock:
+            self._discard(uid)
+
+    def _expand(self, prefix: str) -> List[str]:
+        start = bisect.bisect_left(self._terms, prefix)
+        end = bisect.bisect_left(self._terms, prefix + '\U0010ffff', start)
+        return self._terms[start:end]
+
+    def search(self, query: str, limit: int = 20) -> List[SearchHit]:
+        terms = tokenize(query)
+        if not terms:
+            return []
+        with self._lock:
+            self._ensure_built()
+            total = len(self._documents)
+            scores = None
+            for term in terms:
+                term_scores = {}
+                for expanded in self._expand(term):
+                    postings = self._postings[expanded]
+                    idf = math.log(1 + total / len(postings))
+                    for uid, weight in postings.items():
+                        term_scores[uid] = term_scores.get(uid, 0.0) + weight * idf
+                # every query term has to match
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {uid: score + term_scores[uid] for uid, score in scores.items() if uid in term_scores}
+                if not scores:
+                    return []
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [SearchHit(uid, score) for uid, score in ranked[:limit]]
+
+
+# the expression of the ix_products_search GIN index (see domain.models.product); queries must repeat it
+# exactly for postgres to use the index
+_SIMPLE = literal_column("'simple'::regconfig")
+_DOCUMENT = func.setweight(func.to_tsvector(_SIMPLE, Product.title), literal_column("'A'")) \
+    .op('||')(func.setweight(func.to_tsvector(_SIMPLE, Product.description), literal_column("'B'")))
+
+
+class PostgresSearchIndex(ProductSearchIndex):
+    """``tsvector`` search on the GIN expression index; postgres keeps it current on every write."""
+
+    def __init__(self, session_factory: Callable[[], Session] = None):
+        self._Session = session_factory
+
+    @staticmethod
+    def ts_query(query: str) -> str:
+        # each word becomes a prefix term, words are ANDed; tokenize leaves no tsquery operators behind
+        return ' & '.join(f'{term}:*' for term in tokenize(query))
+
+    def statement(self, query: str, limit: int):
+        ts_query = func.to_tsquery(_SIMPLE, self.ts_query(query))
+        # ts_rank weights are {D, C, B, A}
+        rank = func.ts_rank(literal_column("'{0, 0, 0.33, 1}'::float4[]"), _DOCUMENT, ts_query)
+        return select(Product.uid, rank.label('score')).where(_DOCUMENT.op('@@')(ts_query)) \
+            .order_by(rank.desc(), Product.uid).limit(limit)
+
+    def search(self, query: str, limit: int = 20) -> List[SearchHit]:
+        if not tokenize(query):
+            return []
+        with session_scope(self._Session) as session:
+            return [SearchHit(uid, score) for uid, score in session.execute(self.statement(query, limit))]
+
+
+def search_index_from_env(session_factory: Callable[[], Session] = None) -> ProductSearchIndex:
+    """``NUMEN_PRODUCT_SEARCH``: ``postgres``, ``memory`` or ``auto`` (default, postgres on a postgres database)."""
+    kind = os.environ.get('NUMEN_PRODUCT_SEARCH', 'auto')
+    if kind == 'auto':
+        kind = 'postgres' if DBInitializer.get_config().backend == 'postgresql' else 'memory'
+    if kind == 'postgres':
+        return PostgresSearchIndex(session_factory)
+    if kind == 'memory':
+        return MemorySearchIndex(session_factory)
+    raise ValueException(f'Unknown product search backend: {kind}')
@@ -0,0 +1,208 @@
+"""
+Sliding window rate limits, checked before work that is expensive to do for anyone who asks (password hashing).
+
+A window counter keeps two numbers per key, the attempts of the current and of the previous fixed window; the
+previous one is weighted by how much of it still overlaps the sliding window. Memory per key is constant and the
+estimate stays within a few percent of an exact sliding log.
+"""
+__all__ = ['RateLimiter', 'MemoryRateLimiter', 'RedisRateLimiter', 'LoginLimiter', 'login_limiter_from_env',
+           'login_limiter', 'LOGIN_THROTTLED']
+
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Optional, Tuple
+
+from core.exceptions import RateLimitException, ValueException
+from core.logging import log_event
+from core.metrics import REGISTRY, Counter
+
+LOGIN_THROTTLED = REGISTRY.register(Counter('numen_login_throttled_total', 'Log in attempts rejected by a rate limit.',
+                                            ('scope',)))
+
+_logger = logging.getLogger('numen.security')
+
+
+def _estimate(previous: int, current: int, elapsed: float, window: float) -> float:
+    return previous * (1 - elapsed / window) + current
+
+
+def _retry_after(previous: int, current: int, elapsed: float, window: float, limit: int) -> float:
+    if current >= limit or not previous:
+        # nothing frees up before the next window starts
+        return window - elapsed
+    # the previous window's weight decays until one more attempt fits
+    return max(0.0, (1 - (limit - current - 1) / previous) * window - elapsed)
+
+
+class RateLimiter(ABC):
+    """At most ``limit`` admitted attempts per key in any ``window`` seconds."""
+    # waits on the network, an event loop calls it in an executor (see LoginLimiter.acquire_async)
+    blocking = True
+
+    def __init__(self, limit: int, window: float):
+        if limit < 1 or window <= 0:
+            raise ValueException('limit must be at least 1 and window positive!')
+        self.limit = limit
+        self.window = window
+
+    @abstractmethod
+    def hit(self, key: str) -> Tuple[bool, float]:
+        """Counts an attempt if it is admitted; returns (admitted, seconds until the next one can be)."""
+
+    @abstractmethod
+    def reset(self, key: str):
+        """Forgets the attempts of ``key``."""
+
+
+class MemoryRateLimiter(RateLimiter):
+    """Counters of one process; with several workers each gets its own ``limit``."""
+    blocking = False
+
+    def __init__(self, limit: int, window: float, clock: Callable[[], float] = time.monotonic):
+        super().__init__(limit, window)
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> [window number, attempts in it, attempts in the window before]
+        self._counters = {}
+        self._swept = 0
+
+    def __len__(self):
+        return len(self._counters)
+
+    def _sweep(self, number: int):
+        # keys untouched for two windows count nothing any more, a spray of distinct keys must not pile up
+        self._counters = {key: counter for key, counter in self._counters.items() if counter[0] >= number - 1}
+        self._swept = number
+
+    def hit(self, key: str) -> Tuple[bool, float]:
+        number, elapsed = divmod(self._clock(), self.window)
+        number = int(number)
+        with self._lock:
+            if number > self._swept:
+                self._sweep(number)
+            counter = self._counters.get(key)
+            if counter is None or counter[0] < number - 1:
+                counter = [number, 0, 0]
+            elif counter[0] == number - 1:
+                counter = [number, 0, counter[1]]
+            previous, current = counter[2], counter[1]
+            if _estimate(previous, current + 1, elapsed, self.window) > self.limit:
+                self._counters[key] = counter
+                return False, _retry_after(previous, current, elapsed, self.window, self.limit)
+            counter[1] += 1
+            self._counters[key] = counter
+            return True, 0.0
+
+    def reset(self, key: str):
+        with self._lock:
+            self._counters.pop(key, None)
+
+
+class RedisRateLimiter(RateLimiter):
+    """
+    Counters shared by every worker in Redis (or anything speaking its protocol), one key per key and window that
+    expires after two windows. ``client`` is a redis-py compatible client.
+    """
+
+    def __init__(self, client, limit: int, window: float, prefix: str = 'numen:rate:',
+                 clock: Callable[[], float] = time.time):
+        super().__init__(limit, window)
+        self.client = client
+        self.prefix = prefix
+        self._clock = clock
+
+    def _key(self, key: str, number: int) -> str:
+        return f'{self.prefix}{key}:{number}'
+
+    def hit(self, key: str) -> Tuple[bool, float]:
+        number, elapsed = divmod(self._clock(), self.window)
+        number = int(number)
+        current_key = self._key(key, number)
+        # one round trip; the increment is atomic, concurrent attempts all see a distinct count
+        pipe = self.client.pipeline()
+        pipe.incr(current_key)
+        pipe.expire(current_key, math.ceil(self.window * 2))
+        pipe.get(self._key(key, number - 1))
+        current, _, previous = pipe.execute()
+        previous = int(previous or 0)
+        if _estimate(previous, current, elapsed, self.window) > self.limit:
+            # only admitted attempts count
+            self.client.decr(current_key)
+            return False, _retry_after(previous, current - 1, elapsed, self.window, self.limit)
+        return True, 0.0
+
+    def reset(self, key: str):
+        number = int(self._clock() // self.window)
+        self.client.delete(self._key(key, number), self._key(key, number - 1))
+
+
+class LoginLimiter:
+    """
+    Log in attempts per account (``email:...``, ``phone:...``) and per client (an ip address). A successful log
+    in clears the account's count, a client's count only expires.
+    """
+
+    def __init__(self, account: Optional[RateLimiter], client: Optional[RateLimiter] = None):
+        self.account = account
+        self.client = client
+
+    def acquire(self, account: str, client: str = None):
+        """Raises RateLimitException when either limit is used up; call before verifying the password."""
+        for scope, limiter, key in (('client', self.client, client), ('account', self.account, account)):
+            if limiter is None or key is None:
+                continue
+            admitted, retry_after = limiter.hit(f'{scope}:{key}')
+            if not admitted:
+                LOGIN_THROTTLED.inc(scope=scope)
+                log_event(_logger, logging.WARNING, 'login.throttled', sample=f'login.throttled.{scope}',
+                          scope=scope, retry_after=round(retry_after, 3))
+                raise RateLimitException('Too many log in attempts, try again later!', retry_after)
+
+    def succeeded(self, account: str):
+        if self.account is not None:
+            self.account.reset(f'account:{account}')
+
+    def _blocking(self) -> bool:
+        return any(limiter is not None and limiter.blocking for limiter in (self.account, self.client))
+
+    async def _off_loop(self, function, *args):
+        if not self._blocking():
+            return function(*args)
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    async def acquire_async(self, account: str, client: str = None):
+        """``acquire`` for the event loop, a redis round trip runs in the default executor."""
+        await self._off_loop(self.acquire, account, client)
+
+    async def succeeded_async(self, account: str):
+        await self._off_loop(self.succeeded, account)
+
+
+def login_limiter_from_env() -> LoginLimiter:
+    """
+    ``NUMEN_RATE_LIMIT``: ``memory`` (default), a ``redis://`` url or ``off``. ``NUMEN_LOGIN_ACCOUNT_LIMIT``
+    attempts (10) per ``NUMEN_LOGIN_ACCOUNT_WINDOW`` seconds (300) per account, ``NUMEN_LOGIN_CLIENT_LIMIT`` (100)
+    per ``NUMEN_LOGIN_CLIENT_WINDOW`` (60) per client.
+    """
+    kind = os.environ.get('NUMEN_RATE_LIMIT', 'memory')
+    if kind == 'off':
+        return LoginLimiter(None, None)
+    limits = [(int(os.environ.get(f'NUMEN_LOGIN_{scope}_LIMIT', limit)),
+               float(os.environ.get(f'NUMEN_LOGIN_{scope}_WINDOW', window)))
+              for scope, limit, window in (('ACCOUNT', 10, 300), ('CLIENT', 100, 60))]
+    if kind == 'memory':
+        return LoginLimiter(*(MemoryRateLimiter(limit, window) for limit, window in limits))
+    if kind.startswith(('redis://', 'rediss://', 'unix://')):
+        import redis
+        client = redis.Redis.from_url(kind)
+        return LoginLimiter(*(RedisRateLimiter(client, limit, window) for limit, window in limits))
+    raise ValueException(f'Unknown rate limit backend: {kind}')
+
+
+# shared by UserHandler and AsyncUserHandler
+login_limiter = login_limiter_from_env()
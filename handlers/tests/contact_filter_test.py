@@ -0,0 +1,128 @@
+from collections import namedtuple
+from unittest import TestCase
+from unittest.mock import Mock
+
+from core.exceptions import ValueException
+from handlers.contactfilter import BloomFilter, ContactFilter
+from handlers.ratelimit import LoginLimiter
+from handlers.userhandler import UserHandler
+
+Row = namedtuple('Row', ['uid', 'email', 'phone'])
+
+USERS = [Row(1, 'a@b.c', '9120000001'), Row(2, 'd@e.f', None), Row(3, None, '9120000003')]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class BloomFilterTest(TestCase):
+
+    def test_no_false_negatives_and_few_false_positives(self):
+        bloom = BloomFilter.for_capacity(1000, 0.01)
+        for i in range(1000):
+            bloom.add(f'in {i}')
+        self.assertTrue(all(f'in {i}' in bloom for i in range(1000)))
+        false_positives = sum(f'out {i}' in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+        # one bit per slot, about 9.6 bits per item at 1%
+        self.assertLess(bloom.nbytes, 1000 * 10 / 8)
+
+    def test_invalid_sizes(self):
+        with self.assertRaises(ValueException):
+            BloomFilter.for_capacity(0, 0.01)
+        with self.assertRaises(ValueException):
+            BloomFilter.for_capacity(10, 1)
+
+
+class ContactFilterTest(TestCase):
+
+    def setUp(self) -> None:
+        self.session = Mock()
+        self.session.execute().all.return_value = USERS
+        self.session.execute.reset_mock()
+        self.clock = Clock()
+        self.filter = ContactFilter(Mock(return_value=self.session), capacity=100, refresh=60, clock=self.clock)
+
+    def wait(self):
+        if self.filter._thread is not None:
+            self.filter._thread.join()
+
+    def test_first_use_reads_in_the_background(self):
+        # nothing read yet: everything might exist
+        self.assertTrue(self.filter.might_have_email('x@y.z'))
+        self.wait()
+        self.assertTrue(self.filter.might_have_email('a@b.c'))
+        self.assertTrue(self.filter.might_have_phone('9120000003'))
+        self.assertFalse(self.filter.might_have_email('x@y.z'))
+        # an email is not a phone
+        self.assertFalse(self.filter.might_have_phone('a@b.c'))
+        self.assertEqual(1, self.session.execute.call_count)
+
+    def test_add_and_refresh(self):
+        self.filter.add('x@y.z', '9129999999')
+        # not read yet, the table has it by the first read
+        self.filter.build()
+        self.filter.add('x@y.z', '9129999999')
+        self.assertTrue(self.filter.might_have_email('x@y.z'))
+        self.assertTrue(self.filter.might_have_phone('9129999999'))
+        self.clock.now = 60
+        # the lookup that finds the filter stale still gets the old one
+        self.assertTrue(self.filter.might_have_email('x@y.z'))
+        self.wait()
+        # read again: the added user is not in the (mock) table any more
+        self.assertFalse(self.filter.might_have_email('x@y.z'))
+        self.assertEqual(2, self.session.execute.call_count)
+
+    def test_failed_read_is_retried_later(self):
+        self.session.execute.side_effect = ConnectionError('database is down')
+        with self.assertLogs('numen.contactfilter', 'ERROR'):
+            self.assertTrue(self.filter.might_have_email('x@y.z'))
+            self.wait()
+        self.session.execute.side_effect = None
+        self.assertTrue(self.filter.might_have_email('x@y.z'))
+        self.assertEqual(1, self.session.execute.call_count)
+        self.clock.now = 30
+        self.filter.might_have_email('x@y.z')
+        self.wait()
+        self.assertFalse(self.filter.might_have_email('x@y.z'))
+
+    def test_disabled(self):
+        disabled = ContactFilter(Mock(), capacity=0)
+        self.assertTrue(disabled.might_have_email('x@y.z'))
+        self.assertEqual(0, disabled.nbytes)
+
+
+class UserHandlerFilterTest(TestCase):
+
+    def setUp(self) -> None:
+        UserHandler._Session = UserHandler._ReadSession = Mock()
+        UserHandler._contact_filter = Mock()
+        UserHandler._contact_filter.might_have_email.return_value = False
+        UserHandler._contact_filter.might_have_phone.return_value = False
+        UserHandler._email_validation = Mock(return_value=True)
+        UserHandler._phone_validation = Mock(return_value=True)
+        UserHandler._login_limiter = LoginLimiter(None)
+        UserHandler._password_service = Mock()
+
+    def test_filter_never_turns_a_user_away(self):
+        # another process may have signed the user up since the filter was read
+        user = Mock(uid=1, password='hash')
+        UserHandler._Session().query().filter_by().first.return_value = user
+        UserHandler._password_service.password_verification.return_value = True
+        UserHandler._password_service.needs_rehash.return_value = False
+        self.assertIs(user, UserHandler.log_in_by_email('x@y.z', 'password'))
+        self.assertIs(user, UserHandler.log_in_by_phone('9129999999', 'password'))
+        self.assertTrue(UserHandler.is_email_registered('x@y.z'))
+        self.assertTrue(UserHandler.is_phone_registered('9129999999'))
+
+    def test_possible_contacts_are_looked_up(self):
+        UserHandler._contact_filter.might_have_email.return_value = True
+        UserHandler._Session().query().filter_by().first.return_value = None
+        self.assertFalse(UserHandler.is_email_registered('x@y.z'))
+        UserHandler._Session().query().filter_by().first.return_value = Mock()
+        self.assertTrue(UserHandler.is_email_registered('x@y.z'))
@@ -0,0 +1,117 @@
+import hashlib
+import shutil
+import socket
+import tempfile
+import threading
+from unittest import TestCase
+
+from core.exceptions import ValueException
+from handlers.imagestore import ImageStore, ImagePipeline, sniff_content_type, thumbnail_url
+
+PNG = b'\x89PNG\r\n\x1a\n'
+
+
+def png(payload: bytes) -> bytes:
+    return PNG + payload
+
+
+class FakeResize:
+    """Stands in for Pillow: a variant is the original's payload tagged with the box size."""
+
+    def __init__(self):
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, data, size):
+        with self._lock:
+            self.calls += 1
+        if b'broken' in data:
+            raise OSError('cannot identify image file')
+        return png(f'{size[0]}x{size[1]}:'.encode() + data[len(PNG):])
+
+
+class ImageStoreTest(TestCase):
+
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        self.store = ImageStore(self.root)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.root)
+
+    def test_same_bytes_are_stored_once(self):
+        digest = self.store.put(png(b'a'))
+        self.assertEqual(hashlib.sha256(png(b'a')).hexdigest(), digest)
+        self.assertEqual(digest, self.store.put(png(b'a')))
+        self.assertIn(digest, self.store)
+        self.assertEqual(png(b'a'), self.store.get(digest))
+
+    def test_digests_are_checked(self):
+        for bad in ('../../etc/passwd', 'ab', 'A' * 64, None):
+            with self.assertRaises(ValueException):
+                self.store.path(bad)
+
+    def test_stream_in_chunks(self):
+        data = png(bytes(range(256)) * 40)
+        digest = self.store.put(data)
+        chunks = [bytes(chunk) for chunk in self.store.stream(digest, chunk_size=1000)]
+        self.assertEqual(data, b''.join(chunks))
+        self.assertEqual([1000] * 10, [len(chunk) for chunk in chunks[:-1]])
+
+    def test_sendfile(self):
+        data = png(b'x' * 10000)
+        digest = self.store.put(data)
+        server, client = socket.socketpair()
+        with server, client:
+            self.assertEqual(100, self.store.sendfile(digest, server, offset=8, count=100))
+            self.assertEqual(b'x' * 100, client.recv(1000))
+
+    def test_collect(self):
+        keep, drop = self.store.put(png(b'keep')), self.store.put(png(b'drop'))
+        self.assertEqual(1, self.store.collect({keep}))
+        self.assertIn(keep, self.store)
+        self.assertNotIn(drop, self.store)
+
+
+class ImagePipelineTest(TestCase):
+
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        self.resize = FakeResize()
+        self.pipeline = ImagePipeline(ImageStore(self.root), {'thumb': (2, 2), 'card': (6, 6)}, workers=2,
+                                      resize=self.resize, max_bytes=1000)
+
+    def tearDown(self) -> None:
+        self.pipeline.close()
+        shutil.rmtree(self.root)
+
+    def test_variants_are_made_once_per_image(self):
+        first, again = self.pipeline.ingest([png(b'a'), png(b'a')])
+        self.assertEqual(first, again)
+        self.assertEqual({'thumb', 'card'}, set(first['variants']))
+        self.assertEqual(png(b'2x2:a'), self.pipeline.store.get(first['variants']['thumb']))
+        self.assertEqual('image/png', first['content_type'])
+        self.assertEqual(2, self.resize.calls)
+        # a later upload of the same file reuses them
+        self.assertEqual([first], self.pipeline.ingest([png(b'a')]))
+        self.assertEqual(2, self.resize.calls)
+
+    def test_only_images_are_taken(self):
+        with self.assertRaises(ValueException):
+            self.pipeline.ingest([png(b'a'), b'<script>'])
+        with self.assertRaises(ValueException):
+            self.pipeline.ingest([png(b'x' * 1000)])
+        # a batch is checked before anything is stored or resized
+        self.assertEqual(0, self.resize.calls)
+        with self.assertRaises(ValueException):
+            self.pipeline.ingest([png(b'broken')])
+
+    def test_sniff_and_thumbnail_url(self):
+        self.assertEqual('image/jpeg', sniff_content_type(b'\xff\xd8\xff\xe0'))
+        self.assertEqual('image/webp', sniff_content_type(b'RIFF\x00\x00\x00\x00WEBPVP8 '))
+        self.assertIsNone(sniff_content_type(b'GIF'))
+        entry = self.pipeline.ingest([png(b'a')])[0]
+        self.assertEqual('/img/' + entry['variants']['thumb'], thumbnail_url([entry], prefix='/img/'))
+        self.assertEqual('/img/' + entry['digest'], thumbnail_url([entry], 'zoom', prefix='/img/'))
+        self.assertEqual('http://cdn/a.png', thumbnail_url([{'url': 'http://cdn/a.png'}]))
+        self.assertIsNone(thumbnail_url(None))
@@ -0,0 +1,39 @@
+from unittest import TestCase
+from unittest.mock import Mock
+
+from core.exceptions import ValueException, TypeException, OutOfStockException
+from handlers.orderhandler import OrderHandler, CHECKOUT_OUT_OF_STOCK
+
+
+class OrderHandlerTest(TestCase):
+
+    def setUp(self) -> None:
+        OrderHandler._Session = OrderHandler._ReadSession = Mock()
+
+    def test_arguments_are_checked(self):
+        with self.assertRaises(TypeException):
+            OrderHandler.add_to_cart('1', 1)
+        with self.assertRaises(ValueException):
+            OrderHandler.add_to_cart(1, 1, 0)
+        with self.assertRaises(TypeException):
+            OrderHandler.checkout(None)
+        with self.assertRaises(TypeException):
+            OrderHandler.cancel_order('1')
+        OrderHandler._Session.assert_not_called()
+
+    def test_short_stock_stops_at_the_first_product(self):
+        session = Mock()
+        session.execute().rowcount = 0
+        session.execute.reset_mock()
+        refused = CHECKOUT_OUT_OF_STOCK.value()
+        with self.assertRaises(OutOfStockException) as context:
+            OrderHandler._take_stock(session, {3: 1, 2: 5})
+        self.assertEqual([2], context.exception.product_ids)
+        self.assertEqual(1, session.execute.call_count)
+        self.assertEqual(refused + 1, CHECKOUT_OUT_OF_STOCK.value())
+
+    def test_changed_cart_is_not_checked_out(self):
+        session = Mock()
+        session.execute().rowcount = 1
+        with self.assertRaises(ValueException):
+            OrderHandler._claim_cart(session, [(1, 7, 2), (2, 8, 1)])
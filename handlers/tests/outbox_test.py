@@ -0,0 +1,116 @@
+import time
+from unittest import TestCase
+from unittest.mock import Mock
+from urllib.error import HTTPError
+
+from domain.models.token import ExchangeMethods
+from handlers.outbox import Notification, OutboxDispatcher, SmtpProvider, HttpSmsProvider
+from handlers.tests.sinks import SmtpSink, SmsSink
+from handlers.tokenhandler import token_values, token_message
+
+
+def notification(uid: int, channel: str = 'email', recipient: str = None, attempts: int = 1) -> Notification:
+    return Notification(uid, channel, recipient or f'user{uid}@domain.tld', 'Your verification code',
+                        f'code {uid}', attempts, 'claim')
+
+
+class TokenMessageTest(TestCase):
+
+    def test_email_carries_code_and_link(self):
+        values = token_values(1, ExchangeMethods.EMAIL)
+        message = token_message(values, 'email@domain.tld', link_prefix='https://shop.tld/verify/')
+        self.assertEqual(('email', 'email@domain.tld'), (message['channel'], message['recipient']))
+        self.assertIn(values['hex_token'], message['body'])
+        self.assertIn('https://shop.tld/verify/' + values['url_token'], message['body'])
+
+    def test_sms_carries_the_code_only(self):
+        values = token_values(1, ExchangeMethods.PHONE)
+        message = token_message(values, '9121234567')
+        self.assertEqual(('sms', None), (message['channel'], message['subject']))
+        self.assertEqual(f"Your verification code: {values['hex_token']}", message['body'])
+
+
+class SmtpProviderTest(TestCase):
+
+    def setUp(self) -> None:
+        self.sink = SmtpSink().start()
+        self.provider = SmtpProvider('127.0.0.1', self.sink.port, sender='shop@domain.tld')
+
+    def tearDown(self) -> None:
+        self.sink.stop()
+
+    def test_batch_goes_over_one_connection(self):
+        self.assertEqual([None, None, None], self.provider.send([notification(uid) for uid in (1, 2, 3)]))
+        self.assertEqual(['user1@domain.tld', 'user2@domain.tld', 'user3@domain.tld'],
+                         [message['To'] for message in self.sink.received])
+        self.assertEqual('shop@domain.tld', self.sink.received[0]['From'])
+        self.assertEqual('code 1', self.sink.received[0].get_payload().strip())
+        self.assertEqual(1, self.sink.max_connections)
+
+    def test_refused_message_does_not_fail_the_batch(self):
+        self.sink.reject = 1
+        errors = self.provider.send([notification(1), notification(2)])
+        self.assertIn('451', errors[0])
+        self.assertIsNone(errors[1])
+        self.assertEqual(['user2@domain.tld'], [message['To'] for message in self.sink.received])
+
+
+class HttpSmsProviderTest(TestCase):
+
+    def setUp(self) -> None:
+        self.sink = SmsSink().start()
+        self.provider = HttpSmsProvider(f'http://127.0.0.1:{self.sink.port}/send', sender='Numen')
+
+    def tearDown(self) -> None:
+        self.sink.stop()
+
+    def test_batch_is_one_request(self):
+        batch = [notification(1, 'sms', '912'), notification(2, 'sms', '913')]
+        self.assertEqual([None, None], self.provider.send(batch))
+        self.assertEqual([{'to': '912', 'text': 'code 1'}, {'to': '913', 'text': 'code 2'}], self.sink.received)
+
+    def test_refused_batch_raises(self):
+        self.sink.reject = 1
+        with self.assertRaises(HTTPError):
+            self.provider.send([notification(1, 'sms', '912')])
+        self.assertEqual([], self.sink.received)
+
+
+class OutboxDispatcherTest(TestCase):
+
+    def test_backoff_doubles_up_to_max_delay(self):
+        dispatcher = OutboxDispatcher([], base_delay=1.0, max_delay=10.0, jitter=0)
+        self.assertEqual([1.0, 2.0, 4.0, 8.0, 10.0, 10.0], [dispatcher.backoff(attempts) for attempts in range(1, 7)])
+
+    def test_jitter_only_shortens_the_delay(self):
+        dispatcher = OutboxDispatcher([], base_delay=4.0, jitter=0.5)
+        delays = [dispatcher.backoff(1) for _ in range(100)]
+        self.assertTrue(all(2.0 <= delay <= 4.0 for delay in delays))
+        self.assertGreater(len(set(delays)), 1)
+
+    def test_provider_error_fails_the_whole_batch(self):
+        provider = Mock(channel='sms')
+        provider.send.side_effect = ConnectionRefusedError('gateway down')
+        dispatcher = OutboxDispatcher([provider])
+        batch = [notification(1, 'sms'), notification(2, 'sms')]
+        dispatcher.claim = Mock(return_value=batch)
+        dispatcher.record = Mock()
+        self.assertEqual(2, dispatcher.dispatch('sms'))
+        dispatcher.record.assert_called_once_with(batch, ['ConnectionRefusedError: gateway down'] * 2)
+
+    def test_background_failure_is_logged(self):
+        dispatcher = OutboxDispatcher([Mock(channel='sms')])
+        dispatcher.claim = Mock(side_effect=ConnectionRefusedError('database down'))
+        with self.assertLogs('numen.outbox', 'ERROR') as logs:
+            dispatcher.start(interval=0.01)
+            deadline = time.monotonic() + 5
+            while not dispatcher.stats.errors and time.monotonic() < deadline:
+                time.sleep(0.01)
+            dispatcher.stop()
+        self.assertGreaterEqual(dispatcher.stats.errors, 1)
+        self.assertIn('database down', logs.output[0])
+
+    def test_concurrency_per_channel(self):
+        providers = [Mock(channel='email'), Mock(channel='sms')]
+        dispatcher = OutboxDispatcher(providers, concurrency={'email': 3})
+        self.assertEqual({'email': 3, 'sms': 1}, dispatcher.concurrency)
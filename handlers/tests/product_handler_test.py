@@ -0,0 +1,51 @@
+from unittest import TestCase
+from unittest.mock import Mock
+
+from core.exceptions import ValueException, TypeException
+from handlers.producthandler import ProductHandler, ProductSort, encode_cursor, decode_cursor, MAX_PAGE_SIZE
+
+
+class ProductHandlerTest(TestCase):
+
+    def setUp(self) -> None:
+        ProductHandler._Session = ProductHandler._ReadSession = Mock()
+
+    def test_cursor_round_trip(self):
+        cursor = encode_cursor(ProductSort.PRICE_ASC, (12.5, 7))
+        self.assertEqual((12.5, 7), decode_cursor(ProductSort.PRICE_ASC, cursor))
+
+    def test_cursor_of_another_sort_raise_exception(self):
+        cursor = encode_cursor(ProductSort.NEWEST, (7,))
+        with self.assertRaises(ValueException) as _ex:
+            decode_cursor(ProductSort.PRICE_DESC, cursor)
+        self.assertEqual('Cursor belongs to another sort order!', str(_ex.exception))
+
+    def test_broken_cursor_raise_exception(self):
+        with self.assertRaises(ValueException) as _ex:
+            ProductHandler.list_products(cursor='not a cursor')
+        self.assertEqual('Invalid cursor!', str(_ex.exception))
+
+    def test_cursor_key_type_is_checked(self):
+        for sort, key in ((ProductSort.NEWEST, ('7',)), (ProductSort.NEWEST, (None,)),
+                          (ProductSort.PRICE_ASC, ('12.5', 'x')), (ProductSort.PRICE_DESC, ('x', 7))):
+            with self.assertRaises(ValueException) as _ex:
+                ProductHandler.list_products(sort=sort, cursor=encode_cursor(sort, key))
+            self.assertEqual('Invalid cursor!', str(_ex.exception))
+        ProductHandler._Session.assert_not_called()
+
+    def test_limit_and_sort_are_checked(self):
+        with self.assertRaises(TypeException):
+            ProductHandler.list_products(limit='20')
+        with self.assertRaises(TypeException):
+            ProductHandler.search('shoe', limit=2.5)
+        with self.assertRaises(ValueException):
+            ProductHandler.list_products(limit=0)
+        with self.assertRaises(ValueException):
+            ProductHandler.list_products(limit=MAX_PAGE_SIZE + 1)
+        with self.assertRaises(TypeException):
+            ProductHandler.list_products(sort='price')
+        ProductHandler._Session.assert_not_called()
+
+    def test_get_product_type_check(self):
+        with self.assertRaises(TypeException):
+            ProductHandler.get_product('1')
@@ -0,0 +1,58 @@
+from collections import namedtuple
+from unittest import TestCase
+from unittest.mock import Mock
+
+from sqlalchemy.dialects import postgresql
+
+from handlers.productsearch import MemorySearchIndex, PostgresSearchIndex, tokenize
+
+Row = namedtuple('Row', ['uid', 'title', 'description'])
+
+PRODUCTS = [Row(1, 'Red running shoes', 'light shoes for the road'),
+            Row(2, 'Blue hat', 'a hat that goes with red shoes'),
+            Row(3, 'Rain coat', 'keeps the rain out')]
+
+
+class MemorySearchIndexTest(TestCase):
+
+    def setUp(self) -> None:
+        session = Mock()
+        session.execute().all.return_value = PRODUCTS
+        self.index = MemorySearchIndex(Mock(return_value=session))
+        self.index.build()
+
+    def uids(self, query):
+        return [hit.uid for hit in self.index.search(query)]
+
+    def test_tokenize(self):
+        self.assertEqual(['shoes'], tokenize('  Shoes!'))
+        self.assertEqual(['a', 'b', '42'], tokenize('A_b 42'))
+
+    def test_title_matches_rank_first(self):
+        self.assertEqual([1, 2], self.uids('red shoes'))
+
+    def test_prefix_and_all_terms_required(self):
+        self.assertEqual([3], self.uids('rai'))
+        self.assertEqual([1], self.uids('run sho'))
+        self.assertEqual([], self.uids('red coat'))
+        self.assertEqual([], self.uids('!!'))
+
+    def test_incremental_updates(self):
+        self.index.index(3, 'Rain boots', 'waterproof')
+        self.assertEqual([3], self.uids('boots'))
+        self.assertEqual([], self.uids('coat'))
+        self.index.remove(1)
+        self.assertEqual([2], self.uids('shoes'))
+        self.assertEqual([], self.uids('running'))
+        self.assertEqual(2, len(self.index))
+
+
+class PostgresSearchIndexTest(TestCase):
+
+    def test_query_uses_the_index_expression(self):
+        self.assertEqual('red:* & shoe:*', PostgresSearchIndex.ts_query("red' & shoe|"))
+        sql = str(PostgresSearchIndex().statement('red shoe', 10).compile(dialect=postgresql.dialect()))
+        self.assertIn("setweight(to_tsvector('simple'::regconfig, products.title), 'A') || "
+                      "setweight(to_tsvector('simple'::regconfig, products.description), 'B')", sql)
+        self.assertIn('@@ to_tsquery', sql)
+        self.assertIn('ORDER BY ts_rank', sql)
@@ -0,0 +1,187 @@
+import threading
+from unittest import TestCase, IsolatedAsyncioTestCase
+from unittest.mock import Mock
+
+from core.exceptions import RateLimitException, AuthenticationException, ValueException
+from handlers.contactfilter import ContactFilter
+from handlers.ratelimit import MemoryRateLimiter, RedisRateLimiter, LoginLimiter, LOGIN_THROTTLED
+from handlers.tests.token_store_test import FakeRedis
+from handlers.userhandler import UserHandler
+
+
+class Clock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeRateRedis(FakeRedis):
+    """FakeRedis plus the commands RedisRateLimiter uses."""
+
+    def expire(self, key, seconds):
+        # the limiter runs on a fake clock here, real time expiry would not line up with it
+        pass
+
+    def decr(self, key):
+        value = int(self.get(key) or 0) - 1
+        self.data[key] = self._bytes(value)
+        return value
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+
+class RateLimiterContract:
+    """Behaviour every limiter must have; mixed into one TestCase per backend."""
+
+    def new_limiter(self, limit, window, clock):
+        raise NotImplementedError()
+
+    def setUp(self) -> None:
+        self.clock = Clock()
+        self.limiter = self.new_limiter(3, 10, self.clock)
+
+    def test_limit_per_key(self):
+        self.assertEqual([True, True, True, False], [self.limiter.hit('a')[0] for _ in range(4)])
+        self.assertTrue(self.limiter.hit('b')[0])
+
+    def test_rejected_attempts_do_not_count(self):
+        for _ in range(3):
+            self.limiter.hit('a')
+        for _ in range(5):
+            admitted, retry_after = self.limiter.hit('a')
+            self.assertFalse(admitted)
+            self.assertGreater(retry_after, 0)
+        # two windows later nothing of the burst is left, rejected attempts didn't push it out
+        self.clock.now += 20
+        self.assertTrue(self.limiter.hit('a')[0])
+
+    def test_window_slides(self):
+        for _ in range(3):
+            self.limiter.hit('a')
+        # the next window starts at 1010; at 1015 half of the previous window still counts: 1.5 + 1 <= 3
+        self.clock.now = 1015
+        self.assertTrue(self.limiter.hit('a')[0])
+        self.assertFalse(self.limiter.hit('a')[0])
+
+    def test_retry_after_is_when_an_attempt_fits(self):
+        for _ in range(3):
+            self.limiter.hit('a')
+        self.clock.now = 1011
+        admitted, retry_after = self.limiter.hit('a')
+        self.assertFalse(admitted)
+        # 3 * (1 - elapsed / 10) + 1 <= 3 once elapsed reaches 3.33
+        self.assertAlmostEqual(10 / 3 - 1, retry_after)
+        self.clock.now += retry_after - 0.01
+        self.assertFalse(self.limiter.hit('a')[0])
+        self.clock.now += 0.02
+        self.assertTrue(self.limiter.hit('a')[0])
+
+    def test_reset(self):
+        for _ in range(3):
+            self.limiter.hit('a')
+        self.limiter.reset('a')
+        self.assertTrue(self.limiter.hit('a')[0])
+
+    def test_invalid_limits(self):
+        with self.assertRaises(ValueException):
+            self.new_limiter(0, 10, self.clock)
+
+
+class MemoryRateLimiterTest(RateLimiterContract, TestCase):
+
+    def new_limiter(self, limit, window, clock):
+        return MemoryRateLimiter(limit, window, clock)
+
+    def test_idle_keys_are_swept(self):
+        for key in range(100):
+            self.limiter.hit(str(key))
+        self.clock.now += 20
+        self.limiter.hit('a')
+        self.assertEqual(1, len(self.limiter))
+
+
+class RedisRateLimiterTest(RateLimiterContract, TestCase):
+
+    def new_limiter(self, limit, window, clock):
+        self.client = FakeRateRedis()
+        return RedisRateLimiter(self.client, limit, window, clock=clock)
+
+    def test_one_key_per_window(self):
+        self.limiter.hit('a')
+        self.clock.now += 10
+        self.limiter.hit('a')
+        self.assertEqual({'numen:rate:a:100', 'numen:rate:a:101'}, set(self.client.data))
+
+
+class LoginLimiterTest(TestCase):
+
+    def setUp(self) -> None:
+        self.clock = Clock()
+        UserHandler._login_limiter = LoginLimiter(MemoryRateLimiter(2, 60, self.clock),
+                                                  MemoryRateLimiter(5, 60, self.clock))
+        UserHandler._email_validation = Mock(return_value=True)
+        UserHandler._Session = UserHandler._ReadSession = Mock()
+        UserHandler._contact_filter = ContactFilter(UserHandler._Session, capacity=0)
+        UserHandler._password_service = Mock()
+
+    def test_throttled_attempt_skips_lookup_and_hash(self):
+        UserHandler._password_service.password_verification = Mock(return_value=False)
+        for _ in range(2):
+            with self.assertRaises(AuthenticationException):
+                UserHandler.log_in_by_email('a@b.c', 'wrong')
+        throttled = LOGIN_THROTTLED.value(scope='account')
+        UserHandler._Session.reset_mock()
+        with self.assertRaises(RateLimitException) as context:
+            UserHandler.log_in_by_email('A@b.c', 'wrong')
+        self.assertGreater(context.exception.retry_after, 0)
+        UserHandler._Session.assert_not_called()
+        self.assertEqual(2, UserHandler._password_service.password_verification.call_count)
+        self.assertEqual(throttled + 1, LOGIN_THROTTLED.value(scope='account'))
+
+    def test_success_clears_the_account(self):
+        UserHandler._password_service.password_verification = Mock(return_value=True)
+        for _ in range(5):
+            UserHandler.log_in_by_email('a@b.c', 'right')
+
+    def test_client_limit_spans_accounts(self):
+        UserHandler._password_service.password_verification = Mock(return_value=False)
+        for i in range(5):
+            with self.assertRaises(AuthenticationException):
+                UserHandler.log_in_by_email(f'{i}@b.c', 'wrong', client='10.0.0.1')
+        with self.assertRaises(RateLimitException):
+            UserHandler.log_in_by_email('new@b.c', 'wrong', client='10.0.0.1')
+        with self.assertRaises(AuthenticationException):
+            UserHandler.log_in_by_email('new@b.c', 'wrong', client='10.0.0.2')
+
+
+class AsyncLoginLimiterTest(IsolatedAsyncioTestCase):
+
+    @staticmethod
+    def recording(limiter):
+        limiter.threads = []
+        hit = limiter.hit
+
+        def recorded(key):
+            limiter.threads.append(threading.current_thread())
+            return hit(key)
+        limiter.hit = recorded
+        return limiter
+
+    async def test_redis_round_trips_leave_the_event_loop(self):
+        limiter = self.recording(RedisRateLimiter(FakeRateRedis(), 1, 60, clock=Clock()))
+        login_limiter = LoginLimiter(limiter)
+        await login_limiter.acquire_async('email:a@b.c')
+        with self.assertRaises(RateLimitException):
+            await login_limiter.acquire_async('email:a@b.c')
+        await login_limiter.succeeded_async('email:a@b.c')
+        await login_limiter.acquire_async('email:a@b.c')
+        self.assertNotIn(threading.current_thread(), limiter.threads)
+
+    async def test_memory_limiter_stays_on_the_loop(self):
+        limiter = self.recording(MemoryRateLimiter(1, 60, Clock()))
+        await LoginLimiter(limiter).acquire_async('email:a@b.c')
+        self.assertEqual([threading.current_thread()], limiter.threads)
@@ -0,0 +1,122 @@
+"""Local stand-ins for the mail server and the SMS gateway, see handlers.outbox."""
+import email
+import json
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Sink:
+    def __init__(self, delay: float = 0.0):
+        # seconds every message takes, a slow provider
+        self.delay = delay
+        # the next ``reject`` messages are refused with a temporary error
+        self.reject = 0
+        self.received = []
+        self.connections = 0
+        self.max_connections = 0
+        self._lock = threading.Lock()
+
+    def _enter(self):
+        with self._lock:
+            self.connections += 1
+            self.max_connections = max(self.max_connections, self.connections)
+
+    def _leave(self):
+        with self._lock:
+            self.connections -= 1
+
+    def _rejects(self) -> bool:
+        with self._lock:
+            if self.reject:
+                self.reject -= 1
+                return True
+            return False
+
+    def start(self):
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+
+class SmtpSink(_Sink):
+    """Just enough SMTP for smtplib: every accepted message is kept as an ``email.message.Message``."""
+
+    def __init__(self, delay: float = 0.0):
+        super().__init__(delay)
+        sink = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line: str):
+                self.wfile.write(line.encode() + b'\r\n')
+
+            def handle(self):
+                sink._enter()
+                try:
+                    self.reply('220 sink ready')
+                    while True:
+                        line = self.rfile.readline()
+                        if not line:
+                            return
+                        command = line.decode().strip().upper()
+                        if command.startswith(('EHLO', 'HELO')):
+                            self.reply('250 sink')
+                        elif command.startswith('RCPT') and sink._rejects():
+                            self.reply('451 try again later')
+                        elif command.startswith(('MAIL', 'RCPT', 'RSET', 'NOOP')):
+                            self.reply('250 OK')
+                        elif command == 'DATA':
+                            self.reply('354 go ahead')
+                            data = b''.join(iter(self.rfile.readline, b'.\r\n'))
+                            time.sleep(sink.delay)
+                            with sink._lock:
+                                sink.received.append(email.message_from_bytes(data))
+                            self.reply('250 queued')
+                        elif command == 'QUIT':
+                            self.reply('221 bye')
+                            return
+                        else:
+                            self.reply('502 not implemented')
+                finally:
+                    sink._leave()
+
+        self._server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+
+
+class SmsSink(_Sink):
+    """An HTTP gateway for HttpSmsProvider: keeps the posted ``messages``, a refused batch gets a 503."""
+
+    def __init__(self, delay: float = 0.0):
+        super().__init__(delay)
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                sink._enter()
+                try:
+                    payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                    if sink._rejects():
+                        self.send_response(503)
+                    else:
+                        time.sleep(sink.delay * len(payload['messages']))
+                        with sink._lock:
+                            sink.received.extend(payload['messages'])
+                        self.send_response(200)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                finally:
+                    sink._leave()
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
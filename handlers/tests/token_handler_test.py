@@ -3,7 +3,7 @@ from unittest import TestCase
 from unittest.mock import Mock
 
 from core.exceptions import SecurityException, InnerException, TimeoutException
-from domain.models import Token
+from domain.models import Token, OutboxMessage
 from domain.models.token import ExchangeMethods
 from handlers.tokenhandler import TokenHandler
 
@@ -24,15 +24,25 @@ class TokenHandlerTest(TestCase):
         TokenHandler._Session = Mock()
         TokenHandler._get_user = Mock()
 
+        added = []
+
         def pr(token):
+            if isinstance(token, OutboxMessage):
+                added.append(token)
+                return
             self.assertIsNotNone(token.hex_token)
             self.assertIsNotNone(token.url_token)
             self.assertIsNotNone(token.url_token)
             self.assertTrue(token.requested_time < datetime.utcnow())
+            added.append(token)
 
         TokenHandler._Session().add = pr
         TokenHandler.generate_token(0, ExchangeMethods.EMAIL)
-        TokenHandler._Session().commit.assert_called()
+        TokenHandler._Session().commit.assert_called_once()
+        # the message is part of the token's transaction
+        token, message = added
+        self.assertEqual('email', message.channel)
+        self.assertIn(token.hex_token, message.body)
 
     def test_generate_new_token_error_deactivated_token(self):
         TokenHandler._Session = Mock()
@@ -0,0 +1,182 @@
+import time
+from datetime import datetime, timedelta
+from unittest import TestCase
+from unittest.mock import Mock
+
+from core.exceptions import SecurityException, AuthenticationException, InnerException
+from domain.models.token import ExchangeMethods
+from handlers.tokenhandler import TokenHandler, token_values
+from handlers.tokenstore import MemoryTokenStore, RedisTokenStore
+
+
+class FakeRedis:
+    """The handful of redis-py commands RedisTokenStore uses, values come back as bytes like the real client."""
+
+    def __init__(self):
+        self.data = {}
+        self.expire_at = {}
+
+    def _alive(self, key):
+        if key in self.expire_at and self.expire_at[key] <= time.time():
+            self.data.pop(key, None)
+            self.expire_at.pop(key)
+        return key in self.data
+
+    @staticmethod
+    def _bytes(value):
+        return value if isinstance(value, bytes) else str(value).encode()
+
+    def get(self, key):
+        return self.data[key] if self._alive(key) else None
+
+    def set(self, key, value):
+        self.data[key] = self._bytes(value)
+        self.expire_at.pop(key, None)
+
+    def incr(self, key):
+        return self.incrby(key, 1)
+
+    def incrby(self, key, amount):
+        value = int(self.get(key) or 0) + amount
+        self.data[key] = self._bytes(value)
+        return value
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        fields = self.data.setdefault(key, {}) if self._alive(key) else self.data.setdefault(key, {})
+        for k, v in (mapping or {field: value}).items():
+            fields[self._bytes(k)] = self._bytes(v)
+
+    def hgetall(self, key):
+        return dict(self.data[key]) if self._alive(key) else {}
+
+    def hincrby(self, key, field, amount):
+        fields = self.data.setdefault(key, {})
+        value = int(fields.get(self._bytes(field), b'0')) + amount
+        fields[self._bytes(field)] = self._bytes(value)
+        return value
+
+    def expireat(self, key, when):
+        self.expire_at[key] = when
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+    def execute(self):
+        return [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+
+class TokenStoreContract:
+    """Behaviour every token store must have; mixed into one TestCase per store."""
+
+    def new_store(self):
+        raise NotImplementedError()
+
+    def setUp(self) -> None:
+        self.store = self.new_store()
+
+    def test_latest_and_find_by_url(self):
+        first = token_values(1, ExchangeMethods.EMAIL, datetime.utcnow() - timedelta(minutes=1))
+        second = token_values(1, ExchangeMethods.PHONE)
+        self.store.add(first)
+        self.store.add(second)
+        self.assertEqual(second['hex_token'], self.store.latest(1).hex_token)
+        self.assertEqual(first['hex_token'], self.store.latest(1, ExchangeMethods.EMAIL.value).hex_token)
+        self.assertIsNone(self.store.latest(2))
+        token = self.store.find_by_url_token(first['url_token'])
+        self.assertEqual(1, token.user_id)
+        self.assertEqual(ExchangeMethods.EMAIL.value, token.exchange_method)
+        self.assertEqual(first['time_limit'].replace(microsecond=0), token.time_limit.replace(microsecond=0))
+        self.assertIsNone(self.store.find_by_url_token('wrong'))
+
+    def test_put_batch(self):
+        tokens = [token_values(user_id, via) for user_id in (1, 2) for via in (ExchangeMethods.EMAIL,
+                                                                               ExchangeMethods.PHONE)]
+        self.store.put(tokens)
+        self.store.put([])
+        for values in tokens:
+            token = self.store.find_by_url_token(values['url_token'])
+            self.assertEqual(values['hex_token'], token.hex_token)
+            self.assertEqual(values['user_id'], token.user_id)
+        self.assertEqual(tokens[3]['hex_token'], self.store.latest(2).hex_token)
+        self.assertEqual(tokens[2]['hex_token'], self.store.latest(2, ExchangeMethods.EMAIL.value).hex_token)
+        # every token got a uid of its own
+        self.assertEqual(4, len({self.store.find_by_url_token(t['url_token']).uid for t in tokens}))
+
+    def test_failures_deactivate(self):
+        self.store.add(token_values(1, ExchangeMethods.PHONE))
+        for attempt in range(1, 5):
+            token = self.store.latest(1)
+            self.store.register_failure(token)
+            self.assertEqual(attempt, token.failed_attempts)
+            self.assertEqual(attempt > 3, token.deactivate)
+        self.assertTrue(self.store.latest(1).deactivate)
+
+    def test_mark_used(self):
+        self.store.add(token_values(1, ExchangeMethods.PHONE))
+        when = datetime.utcnow().replace(microsecond=0)
+        self.store.mark_used(self.store.latest(1), when)
+        self.assertEqual(when, self.store.latest(1).last_used_time)
+
+    def test_expired_tokens_disappear(self):
+        self.store.add(token_values(1, ExchangeMethods.PHONE, datetime.utcnow() - timedelta(hours=3)))
+        self.assertIsNone(self.store.latest(1))
+
+
+class MemoryTokenStoreTest(TokenStoreContract, TestCase):
+    def new_store(self):
+        return MemoryTokenStore(grace=timedelta(minutes=30))
+
+
+class RedisTokenStoreTest(TokenStoreContract, TestCase):
+    def new_store(self):
+        return RedisTokenStore(FakeRedis(), grace=timedelta(minutes=30))
+
+
+class TokenHandlerWithStoreTest(TestCase):
+
+    def setUp(self) -> None:
+        TokenHandler._Session = Mock()
+        TokenHandler._get_user = Mock(return_value=Mock(uid=1, phone='9121234567', email='email@domain.tld'))
+        TokenHandler._store = MemoryTokenStore()
+
+    def tearDown(self) -> None:
+        TokenHandler._store = None
+
+    def test_token_life_cycle_without_database(self):
+        TokenHandler.generate_token(1, ExchangeMethods.PHONE)
+        with self.assertRaises(InnerException):
+            TokenHandler.generate_token(1, ExchangeMethods.PHONE)
+        token = TokenHandler._store.latest(1)
+        self.assertEqual(ExchangeMethods.PHONE.value,
+                         TokenHandler.hexadecimal_token_validation(1, token.hex_token, ExchangeMethods.PHONE))
+        self.assertEqual((1, ExchangeMethods.PHONE.value), TokenHandler.url_token_validation(token.url_token))
+        for _ in range(3):
+            with self.assertRaises(AuthenticationException):
+                TokenHandler.hexadecimal_token_validation(1, 'wrong')
+        with self.assertRaises(SecurityException) as _ex:
+            TokenHandler.hexadecimal_token_validation(1, 'wrong')
+        self.assertEqual('Token is Deactivated!', str(_ex.exception))
+        # the database only gets the message that carries the token
+        added = [call.args[0] for call in TokenHandler._Session().add.call_args_list]
+        self.assertEqual(['sms'], [message.channel for message in added])
+        self.assertIn(token.hex_token, added[0].body)
+
+    def test_security_events_are_logged(self):
+        TokenHandler.generate_token(1, ExchangeMethods.PHONE)
+        with self.assertLogs('numen.security', 'WARNING') as logs:
+            for _ in range(4):
+                with self.assertRaises(InnerException):
+                    TokenHandler.hexadecimal_token_validation(1, 'wrong')
+        events = [(r.event, r.failed_attempts) for r in logs.records]
+        self.assertEqual([('token.failed', 1), ('token.failed', 2), ('token.failed', 3), ('token.deactivated', 4)],
+                         events)
+        self.assertEqual('token.failed', logs.records[0].sample)
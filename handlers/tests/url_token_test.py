@@ -0,0 +1,162 @@
+import threading
+from datetime import datetime, timedelta
+from unittest import TestCase, IsolatedAsyncioTestCase
+from unittest.mock import Mock
+
+from core.exceptions import AuthenticationException, SecurityException, TimeoutException
+from domain.models.token import ExchangeMethods
+from handlers.tests.token_store_test import FakeRedis
+from handlers.asynctokenhandler import AsyncTokenHandler
+from handlers.tokenhandler import TokenHandler, token_values
+from handlers.tokenstore import MemoryTokenStore
+from handlers.urltokens import UrlTokenSigner, MemoryRevocationSet, RedisRevocationSet, \
+    url_token_signer, revocation_set
+
+
+class FakeRevocationRedis(FakeRedis):
+
+    def __init__(self):
+        super().__init__()
+        self.threads = []
+
+    def set(self, key, value, nx=False, ex=None):
+        self.threads.append(threading.current_thread())
+        if nx and self.get(key) is not None:
+            return None
+        super().set(key, value)
+        return True
+
+
+class UrlTokenSignerTest(TestCase):
+
+    def setUp(self) -> None:
+        self.signer = UrlTokenSigner([b'secret'])
+        self.expires = datetime(2030, 1, 1, 12, 30)
+
+    def test_round_trip(self):
+        token = self.signer.unsign(self.signer.sign(7, ExchangeMethods.EMAIL.value, self.expires, b'12345678'))
+        self.assertEqual((7, ExchangeMethods.EMAIL.value, self.expires, b'12345678'), tuple(token))
+
+    def test_tokens_are_unique_and_short(self):
+        tokens = {self.signer.sign(7, 1, self.expires) for _ in range(100)}
+        self.assertEqual(100, len(tokens))
+        self.assertLess(max(map(len, tokens)), 60)
+
+    def test_forged_tokens_are_refused(self):
+        token = self.signer.sign(7, 1, self.expires)
+        payload, mac = token.split('.')
+        forged = self.signer.sign(8, 1, self.expires).split('.')[0] + '.' + mac
+        for bad in (forged, payload + '.' + mac[::-1], 'garbage', '', 'a.b.c', payload + '.',
+                    UrlTokenSigner([b'other']).sign(7, 1, self.expires)):
+            with self.assertRaises(AuthenticationException, msg=bad):
+                self.signer.unsign(bad)
+
+    def test_rotated_keys_still_verify(self):
+        old = self.signer.sign(7, 1, self.expires)
+        rotated = UrlTokenSigner([b'new', b'secret'])
+        self.assertEqual(7, rotated.unsign(old).user_id)
+        with self.assertRaises(AuthenticationException):
+            self.signer.unsign(rotated.sign(7, 1, self.expires))
+
+
+class RevocationSetContract:
+
+    def new_set(self, clock):
+        raise NotImplementedError()
+
+    def test_claim_once(self):
+        revocations = self.new_set(lambda: 1000)
+        self.assertTrue(revocations.claim(b'nonce', 2000))
+        self.assertFalse(revocations.claim(b'nonce', 2000))
+        self.assertTrue(revocations.claim(b'other', 2000))
+
+
+class MemoryRevocationSetTest(RevocationSetContract, TestCase):
+
+    def new_set(self, clock):
+        return MemoryRevocationSet(clock)
+
+    def test_expired_nonces_are_dropped(self):
+        now = [1000]
+        revocations = self.new_set(lambda: now[0])
+        revocations.claim(b'a', 1500)
+        revocations.claim(b'b', 3000)
+        now[0] = 2000
+        self.assertEqual(1, len(revocations))
+
+
+class RedisRevocationSetTest(RevocationSetContract, TestCase):
+
+    def new_set(self, clock):
+        return RedisRevocationSet(FakeRevocationRedis(), clock=clock)
+
+
+class SignedUrlTokenHandlerTest(TestCase):
+
+    def setUp(self) -> None:
+        TokenHandler._Session = Mock()
+        TokenHandler._get_user = Mock(return_value=Mock(uid=1, phone='9121234567', email='email@domain.tld'))
+        TokenHandler._store = Mock(wraps=MemoryTokenStore())
+        TokenHandler._signer = UrlTokenSigner([b'secret'])
+        TokenHandler._revocations = MemoryRevocationSet()
+
+    def tearDown(self) -> None:
+        TokenHandler._store = None
+        TokenHandler._signer = None
+
+    def test_link_works_once_without_the_store(self):
+        TokenHandler.generate_token(1, ExchangeMethods.EMAIL)
+        url_token = TokenHandler._store.latest(1).url_token
+        self.assertEqual((1, ExchangeMethods.EMAIL.value), TokenHandler.url_token_validation(url_token))
+        with self.assertRaises(SecurityException):
+            TokenHandler.url_token_validation(url_token)
+        TokenHandler._store.find_by_url_token.assert_not_called()
+        TokenHandler._store.mark_used.assert_not_called()
+
+    def test_forged_and_expired_links_are_refused(self):
+        with self.assertLogs('numen.security', 'WARNING') as logs:
+            with self.assertRaises(AuthenticationException):
+                TokenHandler.url_token_validation('forged.link')
+        self.assertEqual('token.url_invalid', logs.records[0].event)
+        expired = token_values(1, ExchangeMethods.EMAIL, datetime.utcnow() - timedelta(hours=2),
+                               TokenHandler._signer)['url_token']
+        with self.assertRaises(TimeoutException):
+            TokenHandler.url_token_validation(expired)
+        TokenHandler._store.find_by_url_token.assert_not_called()
+
+    def test_deactivated_token_revokes_its_link(self):
+        TokenHandler.generate_token(1, ExchangeMethods.EMAIL)
+        url_token = TokenHandler._store.latest(1).url_token
+        for _ in range(3):
+            with self.assertRaises(AuthenticationException):
+                TokenHandler.hexadecimal_token_validation(1, 'wrong')
+        with self.assertRaises(SecurityException):
+            TokenHandler.hexadecimal_token_validation(1, 'wrong')
+        with self.assertRaises(SecurityException):
+            TokenHandler.url_token_validation(url_token)
+
+
+class AsyncSignedUrlTokenTest(IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self.client = FakeRevocationRedis()
+        AsyncTokenHandler._signer = UrlTokenSigner([b'secret'])
+        AsyncTokenHandler._revocations = RedisRevocationSet(self.client)
+
+    def tearDown(self) -> None:
+        AsyncTokenHandler._signer = url_token_signer
+        AsyncTokenHandler._revocations = revocation_set
+
+    async def test_redis_claim_leaves_the_event_loop(self):
+        url_token = token_values(1, ExchangeMethods.EMAIL, signer=AsyncTokenHandler._signer)['url_token']
+        self.assertEqual((1, ExchangeMethods.EMAIL.value), await AsyncTokenHandler.url_token_validation(url_token))
+        with self.assertRaises(SecurityException):
+            await AsyncTokenHandler.url_token_validation(url_token)
+        self.assertEqual(2, len(self.client.threads))
+        self.assertNotIn(threading.current_thread(), self.client.threads)
+
+    async def test_forged_link_is_logged(self):
+        with self.assertLogs('numen.security', 'WARNING') as logs:
+            with self.assertRaises(AuthenticationException):
+                await AsyncTokenHandler.url_token_validation('forged.link')
+        self.assertEqual('token.url_invalid', logs.records[0].event)
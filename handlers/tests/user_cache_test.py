@@ -0,0 +1,97 @@
+from unittest import TestCase
+from unittest.mock import Mock
+
+from domain.models import User
+from handlers.usercache import UserCache, UserSnapshot
+from handlers.userhandler import UserHandler
+
+
+def snapshot(uid=1, email='email@domain.tld', phone='9121234567'):
+    return UserSnapshot(uid=uid, first_name='first name', last_name='last name', email=email, phone=phone)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class UserCacheTest(TestCase):
+
+    def setUp(self) -> None:
+        self.clock = Clock()
+        self.cache = UserCache(max_size=2, ttl=10, clock=self.clock)
+
+    def test_snapshot_is_read_only_and_has_no_password(self):
+        user = User(uid=1, password='hash', first_name='first name', email='email@domain.tld', state=2)
+        s = UserSnapshot.from_user(user)
+        self.assertIsNone(s.password)
+        self.assertEqual(2, s.state)
+        with self.assertRaises(AttributeError):
+            s.first_name = 'other'
+
+    def test_get_by_uid_email_and_phone(self):
+        self.cache.put(snapshot())
+        self.assertEqual(1, self.cache.get(uid=1).uid)
+        self.assertEqual(1, self.cache.get(email='email@domain.tld').uid)
+        self.assertEqual(1, self.cache.get(phone='9121234567').uid)
+        self.assertIsNone(self.cache.get(email='other@domain.tld'))
+        self.assertEqual(3, self.cache.hits)
+        self.assertEqual(1, self.cache.misses)
+
+    def test_entries_expire(self):
+        self.cache.put(snapshot())
+        self.clock.now = 10
+        self.assertIsNone(self.cache.get(email='email@domain.tld'))
+        self.assertEqual(0, len(self.cache))
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.put(snapshot(1, 'a@domain.tld', '1'))
+        self.cache.put(snapshot(2, 'b@domain.tld', '2'))
+        self.cache.get(uid=1)
+        self.cache.put(snapshot(3, 'c@domain.tld', '3'))
+        self.assertIsNone(self.cache.get(uid=2))
+        self.assertIsNone(self.cache.get(email='b@domain.tld'))
+        self.assertIsNotNone(self.cache.get(uid=1))
+        self.assertIsNotNone(self.cache.get(uid=3))
+
+    def test_invalidate(self):
+        self.cache.put(snapshot())
+        self.cache.invalidate(email='email@domain.tld')
+        self.assertIsNone(self.cache.get(uid=1))
+        self.assertIsNone(self.cache.get(phone='9121234567'))
+
+    def test_load_started_before_invalidation_is_not_stored(self):
+        generation = self.cache.generation
+        self.cache.invalidate(1)
+        self.cache.put(snapshot(), generation)
+        self.assertIsNone(self.cache.get(uid=1))
+
+    def test_zero_size_disables_cache(self):
+        cache = UserCache(max_size=0)
+        cache.put(snapshot())
+        self.assertIsNone(cache.get(uid=1))
+
+
+class UserHandlerCacheTest(TestCase):
+
+    def setUp(self) -> None:
+        self.session = Mock()
+        self.session.query().get.return_value = User(uid=1, password='hash', first_name='first name',
+                                                     email='email@domain.tld', phone='9121234567')
+        UserHandler._Session = UserHandler._ReadSession = Mock(return_value=self.session)
+        UserHandler._cache = UserCache()
+
+    def test_hot_user_is_read_once(self):
+        u = UserHandler.get_user_by_id(1)
+        self.assertIsNone(u.password)
+        self.assertIs(u, UserHandler.get_user_by_id(1))
+        UserHandler._Session.assert_called_once()
+
+    def test_writes_invalidate(self):
+        UserHandler.get_user_by_id(1)
+        UserHandler.update_user_info(1, 'new name')
+        self.assertEqual('new name', UserHandler.get_user_by_id(1).first_name)
+        self.assertEqual(3, UserHandler._Session.call_count)
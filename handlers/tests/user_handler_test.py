@@ -3,6 +3,9 @@ from unittest import TestCase
 from unittest.mock import Mock
 
 from core.exceptions import TypeException, AuthenticationException, ValueException
+from handlers.contactfilter import ContactFilter
+from handlers.ratelimit import LoginLimiter, MemoryRateLimiter
+from handlers.usercache import UserCache
 from handlers.userhandler import UserHandler
 
 
@@ -19,8 +22,12 @@ class CreateUserHandlerTest(TestCase):
 
     def setUp(self) -> None:
         self.factory = Mock()
-        UserHandler._Session = self.factory.session
+        UserHandler._Session = UserHandler._ReadSession = self.factory.session
         UserHandler._generate_token = Mock()
+        UserHandler._cache = UserCache()
+        UserHandler._login_limiter = LoginLimiter(MemoryRateLimiter(10, 300), MemoryRateLimiter(100, 60))
+        # the sessions are mocks, there is no table to read the filter from
+        UserHandler._contact_filter = ContactFilter(self.factory.session, capacity=0)
 
     def test_get_user_by_id(self):
         # check if exception rises for the wrong data type
@@ -145,3 +152,13 @@ class CreateUserHandlerTest(TestCase):
         with self.assertRaises(ValueException) as _ex:
             UserHandler.change_password(0, '', '')
         self.assertEqual('Entered password is not valid!', str(_ex.exception))
+
+    def test_returning_rows_are_matched_by_contact(self):
+        session = Mock()
+        session.get_bind().dialect.full_returning = True
+        # the database may hand RETURNING rows back in any order
+        session.execute.side_effect = [[(11, 'b@domain.tld', None), (10, 'a@domain.tld', '9121234567')],
+                                       Mock(inserted_primary_key=[12])]
+        rows = [{'email': 'a@domain.tld', 'phone': '9121234567'}, {'email': None, 'phone': None},
+                {'email': 'b@domain.tld', 'phone': None}]
+        self.assertEqual([10, 12, 11], UserHandler._insert_users(session, rows))
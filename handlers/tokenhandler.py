@@ -1,12 +1,108 @@
+import calendar
+import logging
+import os
 import secrets
 from datetime import datetime
+from typing import Optional
 
-from sqlalchemy import desc
+from sqlalchemy.orm import Session
 
 from core.exceptions import SecurityException, TimeoutException, AuthenticationException, InnerException
-from domain.models import DBInitializer
-from domain.models import Token
-from domain.models.token import ExchangeMethods
+from core.logging import log_event
+from core.metrics import instrument_handler
+from domain.models import DBInitializer, OutboxMessage, session_scope
+from domain.models.outbox import EMAIL, SMS
+from domain.models.token import ExchangeMethods, TIME_SPAN
+from handlers.tokenstore import TokenStore, SqlTokenStore, token_store
+from handlers.urltokens import UrlTokenSigner, RevocationSet, url_token_signer, revocation_set
+
+# security events; tokens themselves are never logged
+_logger = logging.getLogger('numen.security')
+
+
+def token_values(user_id: int, via: ExchangeMethods, now: datetime = None, signer: UrlTokenSigner = None) -> dict:
+    """Column values of a fresh token, shared by single and bulk token issuing; ``signer`` signs the url token."""
+    now = now or datetime.utcnow()
+    time_limit = now + TIME_SPAN
+    url_token = signer.sign(user_id, via.value, time_limit) if signer else secrets.token_urlsafe()
+    return {'user_id': user_id, 'requested_time': now, 'time_limit': time_limit,
+            'hex_token': secrets.token_hex(2), 'url_token': url_token, 'exchange_method': via.value}
+
+
+def token_message(values: dict, recipient: str, link_prefix: str = None) -> dict:
+    """
+    Outbox columns of the message that carries a token (``token_values``) to its user; the link is
+    ``NUMEN_VERIFY_URL_PREFIX`` (``/verify/``) followed by the url token.
+    """
+    link_prefix = link_prefix if link_prefix is not None else os.environ.get('NUMEN_VERIFY_URL_PREFIX', '/verify/')
+    code, link = values['hex_token'], link_prefix + values['url_token']
+    if values['exchange_method'] == ExchangeMethods.EMAIL.value:
+        return {'channel': EMAIL, 'recipient': recipient, 'subject': 'Your verification code',
+                'body': f'Your verification code is {code}.\n\nOr open this link: {link}\n'}
+    return {'channel': SMS, 'recipient': recipient, 'subject': None, 'body': f'Your verification code: {code}'}
+
+
+def signed_url_token_validation(signer: UrlTokenSigner, revocations: RevocationSet, url_token: str) -> tuple:
+    """Checks a signed url token in memory and uses it up; the tokens table isn't read."""
+    token = signer.unsign(url_token)
+    if datetime.utcnow() > token.expires:
+        raise TimeoutException('Token is Expired!')
+    if not revocations.claim(token.nonce, calendar.timegm(token.expires.utctimetuple())):
+        raise SecurityException('Token is Deactivated!')
+    return token.user_id, token.exchange_method
+
+
+def revoke_signed_url_token(signer: UrlTokenSigner, revocations: RevocationSet, url_token: str):
+    """For a token deactivated by failed attempts: its link must stop working too."""
+    try:
+        token = signer.unsign(url_token)
+    except AuthenticationException:
+        # issued before signing was turned on, the tokens table still has it deactivated
+        return
+    revocations.revoke(token.nonce, calendar.timegm(token.expires.utctimetuple()))
+
+
+def store_hex_token_validation(store: TokenStore, signer: Optional[UrlTokenSigner], revocations: RevocationSet,
+                                user_id: int, auth_token: str, exchange_method: ExchangeMethods = None,
+                                session: Session = None) -> int:
+    """Checks a hex token kept in ``store``; shared by TokenHandler and AsyncTokenHandler."""
+    token = store.latest(user_id, exchange_method.value if exchange_method else None, session)
+    if not token:
+        raise SecurityException('User has no token!')
+    if token.deactivate:
+        log_event(_logger, logging.WARNING, 'token.deactivated_used', sample='token.deactivated_used',
+                  user_id=user_id)
+        raise SecurityException('Token is Deactivated!')
+    if datetime.utcnow() > token.time_limit:
+        raise TimeoutException('Token is Expired!')
+    if secrets.compare_digest(token.hex_token, auth_token):
+        store.mark_used(token, datetime.utcnow(), session)
+        return token.exchange_method
+    store.register_failure(token)
+    if token.deactivate:
+        if signer is not None:
+            revoke_signed_url_token(signer, revocations, token.url_token)
+        log_event(_logger, logging.WARNING, 'token.deactivated', user_id=user_id,
+                  failed_attempts=token.failed_attempts)
+        raise SecurityException('Token is Deactivated!')
+    # the busiest security event, sampled so a brute force run can't flood the log
+    log_event(_logger, logging.WARNING, 'token.failed', sample='token.failed', user_id=user_id,
+              failed_attempts=token.failed_attempts)
+    raise AuthenticationException('Token is not valid!')
+
+
+def store_url_token_validation(store: TokenStore, url_token: str, session: Session = None) -> tuple:
+    """Checks an unsigned url token kept in ``store`` and marks it used."""
+    tk = store.find_by_url_token(url_token, session)
+    if not tk:
+        log_event(_logger, logging.WARNING, 'token.url_invalid', sample='token.url_invalid')
+        raise AuthenticationException('Url Token is not valid!')
+    if tk.deactivate:
+        raise SecurityException('Token is Deactivated!')
+    if datetime.utcnow() > tk.time_limit:
+        raise TimeoutException('Token is Expired!')
+    store.mark_used(tk, datetime.utcnow(), session)
+    return tk.user_id, tk.exchange_method
 
 
 def get_user_builder(user_id):
@@ -14,12 +110,23 @@ def get_user_builder(user_id):
     return UserHandler.get_user_by_id(user_id)
 
 
+@instrument_handler
 class TokenHandler:
     _Session = DBInitializer.get_session
     _get_user = get_user_builder
+    # None keeps the tokens in the database through _Session
+    _store = token_store
+    # None keeps url tokens random and looked up in the store
+    _signer = url_token_signer
+    _revocations = revocation_set
+
+    @classmethod
+    def _token_store(cls) -> TokenStore:
+        # an empty store is falsy (it has a length), so compare with None
+        return SqlTokenStore(cls._Session) if cls._store is None else cls._store
 
     @classmethod
-    def generate_token(cls, user_id: int, via: ExchangeMethods) -> bool:
+    def generate_token(cls, user_id: int, via: ExchangeMethods, session: Session = None) -> bool:
         u = cls._get_user(user_id)
         if not u:
             raise SecurityException(f"User doesn't exist! user_id: {user_id}")
@@ -27,58 +134,39 @@ class TokenHandler:
             raise InnerException('User phone is not registered')
         if via == ExchangeMethods.EMAIL and not u.email:
             raise InnerException('User email is not registered')
-        session = cls._Session()
-
-        last_token = session.query(Token).filter_by(user_id=user_id).order_by(desc(Token.requested_time)).first()
-
-        if last_token and not last_token.deactivate and last_token.exchange_method == via.value \
-                and datetime.utcnow() < last_token.time_limit:
-            raise InnerException('A valid token already issued!')
-        token = Token(user_id=u.uid, requested_time=datetime.utcnow())
-        token.hex_token = secrets.token_hex(2)
-        token.url_token = secrets.token_urlsafe()
-        token.exchange_method = via.value
-        session.add(token)
-        session.commit()
-        # Todo: ******* send the token to the service provider (MailService|SMSService) ********
+        store = cls._token_store()
+        borrowed = session is not None
+        # the token and its message commit together; nothing is sent here, see handlers.outbox
+        with session_scope(cls._Session, session) as session:
+            last_token = store.latest(user_id, session=session)
+
+            if last_token and not last_token.deactivate and last_token.exchange_method == via.value \
+                    and datetime.utcnow() < last_token.time_limit:
+                raise InnerException('A valid token already issued!')
+            values = token_values(u.uid, via, signer=cls._signer)
+            store.add(values, session)
+            session.add(OutboxMessage(**token_message(values, u.email if via == ExchangeMethods.EMAIL else u.phone)))
+            if not borrowed:
+                session.commit()
         return True
 
     @classmethod
-    def hexadecimal_token_validation(cls, user_id, auth_token: str, exchange_method: ExchangeMethods = None) -> bool:
-        session = cls._Session()
-        token = None
-        if exchange_method:
-            token = session.query(Token).filter_by(user_id=user_id, exchange_method=exchange_method.value).order_by(
-                desc(Token.requested_time)).first()
-        else:
-            token = session.query(Token).filter_by(user_id=user_id).order_by(desc(Token.requested_time)).first()
-        if not token:
-            raise SecurityException('User has no token!')
-        if token.deactivate:
-            raise SecurityException('Token is Deactivated!')
-        if datetime.utcnow() > token.time_limit:
-            raise TimeoutException('Token is Expired!')
-        if secrets.compare_digest(token.hex_token, auth_token):
-            token.last_used_time = datetime.utcnow()
-            session.commit()
-            return token.exchange_method
-        token.failed_attempts += 1
-        if token.failed_attempts > 3:
-            token.deactivate = True
-        session.commit()
-        if token.deactivate:
-            raise SecurityException('Token is Deactivated!')
-        raise AuthenticationException('Token is not valid!')
+    def hexadecimal_token_validation(cls, user_id, auth_token: str, exchange_method: ExchangeMethods = None,
+                                     session: Session = None) -> bool:
+        """
+        With ``session`` the token is read and marked used in the caller's unit of work; a failed attempt is
+        always counted in a transaction of its own.
+        """
+        return store_hex_token_validation(cls._token_store(), cls._signer, cls._revocations, user_id, auth_token,
+                                          exchange_method, session)
 
     @classmethod
-    def url_token_validation(cls, url_token: str) -> ():
-        session = cls._Session()
-        tk = session.query(Token).filter_by(url_token=url_token).first()
-        if not tk:
-            raise AuthenticationException('Url Token is not valid!')
-        if tk.deactivate:
-            raise SecurityException('Token is Deactivated!')
-        if datetime.utcnow() > tk.time_limit:
-            raise TimeoutException('Token is Expired!')
-        tk.last_used_time = datetime.utcnow()
-        return tk.user.uid, tk.exchange_method
+    def url_token_validation(cls, url_token: str, session: Session = None) -> ():
+        """Returns (user id, exchange method); a signed url token is checked without the store and works once."""
+        if cls._signer is not None:
+            try:
+                return signed_url_token_validation(cls._signer, cls._revocations, url_token)
+            except AuthenticationException:
+                log_event(_logger, logging.WARNING, 'token.url_invalid', sample='token.url_invalid')
+                raise
+        return store_url_token_validation(cls._token_store(), url_token, session)
@@ -0,0 +1,320 @@
+__all__ = ['TokenStore', 'TokenRecord', 'SqlTokenStore', 'MemoryTokenStore', 'RedisTokenStore',
+           'token_store_from_env', 'token_store', 'MAX_FAILED_ATTEMPTS']
+
+import calendar
+import heapq
+import os
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+from sqlalchemy import desc, insert
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from core.exceptions import ValueException
+from domain.models import session_scope
+from domain.models import Token
+from domain.models.token import TIME_SPAN
+
+# a token is deactivated once it failed more often than this
+MAX_FAILED_ATTEMPTS = 3
+
+
+class TokenRecord:
+    """Plain token used by the non SQL stores; same attributes as the ``Token`` model."""
+    __slots__ = ('uid', 'user_id', 'hex_token', 'url_token', 'requested_time', 'time_limit', 'failed_attempts',
+                 'last_used_time', 'deactivate', 'exchange_method')
+
+    def __init__(self, uid: int, user_id: int, hex_token: str, url_token: str, requested_time: datetime,
+                 time_limit: datetime, exchange_method: int, failed_attempts: int = 0,
+                 last_used_time: datetime = None, deactivate: bool = False):
+        self.uid = uid
+        self.user_id = user_id
+        self.hex_token = hex_token
+        self.url_token = url_token
+        self.requested_time = requested_time
+        self.time_limit = time_limit
+        self.exchange_method = exchange_method
+        self.failed_attempts = failed_attempts
+        self.last_used_time = last_used_time
+        self.deactivate = deactivate
+
+    def __repr__(self):
+        return ("TokenRecord(%r, %r, %r, %r, %r)"
+                % (self.user_id, self.requested_time, self.failed_attempts, self.last_used_time, self.deactivate))
+
+
+class TokenStore(ABC):
+    """
+    Where TokenHandler keeps its tokens. Returned tokens are read only, changes go through the store. ``session``
+    is the caller's unit of work; stores outside the database ignore it.
+    """
+
+    @abstractmethod
+    def latest(self, user_id: int, exchange_method: int = None, session: Session = None):
+        """Most recently requested token of the user, optionally of one exchange method, or None."""
+
+    @abstractmethod
+    def find_by_url_token(self, url_token: str, session: Session = None):
+        """The token carrying ``url_token``, or None."""
+
+    @abstractmethod
+    def add(self, values: dict, session: Session = None):
+        """Stores a new token from ``tokenhandler.token_values``."""
+
+    @abstractmethod
+    def put(self, tokens: List[dict], session: Session = None):
+        """Stores a batch of new tokens at once, as ``add`` does for one; used by the bulk user import."""
+
+    @abstractmethod
+    def mark_used(self, token, when: datetime, session: Session = None):
+        """Records ``when`` as the token's last use."""
+
+    @abstractmethod
+    def register_failure(self, token):
+        """
+        Atomically counts a failed attempt and deactivates the token past MAX_FAILED_ATTEMPTS. Always a
+        transaction of its own: the caller rolls back on the failure, the count must stay.
+        """
+
+
+class SqlTokenStore(TokenStore):
+    """Tokens in the ``tokens`` table, the default."""
+
+    def __init__(self, session_factory: Callable[[], Session]):
+        self._Session = session_factory
+
+    def latest(self, user_id: int, exchange_method: int = None, session: Session = None):
+        with session_scope(self._Session, session) as session:
+            if exchange_method:
+                query = session.query(Token).filter_by(user_id=user_id, exchange_method=exchange_method)
+            else:
+                query = session.query(Token).filter_by(user_id=user_id)
+            return query.order_by(desc(Token.requested_time)).first()
+
+    def find_by_url_token(self, url_token: str, session: Session = None):
+        with session_scope(self._Session, session) as session:
+            return session.query(Token).filter_by(url_token=url_token).first()
+
+    def add(self, values: dict, session: Session = None):
+        borrowed = session is not None
+        with session_scope(self._Session, session) as session:
+            session.add(Token(**values))
+            if not borrowed:
+                session.commit()
+
+    def put(self, tokens: List[dict], session: Session = None):
+        if not tokens:
+            return
+        borrowed = session is not None
+        with session_scope(self._Session, session) as session:
+            session.execute(insert(Token), tokens)
+            if not borrowed:
+                session.commit()
+
+    def mark_used(self, token, when: datetime, session: Session = None):
+        borrowed = session is not None
+        with session_scope(self._Session, session) as session:
+            session.query(Token).filter_by(uid=token.uid).update({Token.last_used_time: when},
+                                                                 synchronize_session=False)
+            if not borrowed:
+                session.commit()
+        # no history, a token loaded in the caller's session must not be written a second time
+        set_committed_value(token, 'last_used_time', when)
+
+    def register_failure(self, token):
+        with session_scope(self._Session) as session:
+            # computed by the database from the current row, concurrent failures can't get lost
+            session.query(Token).filter_by(uid=token.uid).update(
+                {Token.failed_attempts: Token.failed_attempts + 1,
+                 Token.deactivate: Token.deactivate | (Token.failed_attempts + 1 > MAX_FAILED_ATTEMPTS)},
+                synchronize_session=False)
+            row = session.query(Token.failed_attempts, Token.deactivate).filter_by(uid=token.uid).one()
+            session.commit()
+        # as in mark_used: a token of the caller's session must not flush these back over a concurrent count
+        set_committed_value(token, 'failed_attempts', row.failed_attempts)
+        set_committed_value(token, 'deactivate', row.deactivate)
+
+
+class MemoryTokenStore(TokenStore):
+    """
+    In process store for a single worker (or tests). Tokens disappear ``grace`` after their time limit, the
+    grace keeps 'Token is Expired!' answers meaningful for a while.
+    """
+
+    def __init__(self, grace: timedelta = TIME_SPAN, clock: Callable[[], datetime] = datetime.utcnow):
+        self.grace = grace
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._tokens = {}
+        self._latest = {}
+        self._by_url = {}
+        self._expiry = []
+        self._sequence = 0
+
+    def __len__(self):
+        with self._lock:
+            self._purge()
+            return len(self._tokens)
+
+    def _purge(self):
+        now = self._clock()
+        while self._expiry and self._expiry[0][0] <= now:
+            _, uid = heapq.heappop(self._expiry)
+            token = self._tokens.pop(uid, None)
+            if token is None:
+                continue
+            for key in ((token.user_id, None), (token.user_id, token.exchange_method)):
+                if self._latest.get(key) == uid:
+                    del self._latest[key]
+            if self._by_url.get(token.url_token) == uid:
+                del self._by_url[token.url_token]
+
+    def latest(self, user_id: int, exchange_method: int = None, session: Session = None):
+        with self._lock:
+            self._purge()
+            return self._tokens.get(self._latest.get((user_id, exchange_method)))
+
+    def find_by_url_token(self, url_token: str, session: Session = None):
+        with self._lock:
+            self._purge()
+            return self._tokens.get(self._by_url.get(url_token))
+
+    def add(self, values: dict, session: Session = None):
+        self.put([values], session)
+
+    def put(self, tokens: List[dict], session: Session = None):
+        with self._lock:
+            self._purge()
+            for values in tokens:
+                self._sequence += 1
+                token = TokenRecord(uid=self._sequence, **values)
+                self._tokens[token.uid] = token
+                self._latest[(token.user_id, None)] = token.uid
+                self._latest[(token.user_id, token.exchange_method)] = token.uid
+                self._by_url[token.url_token] = token.uid
+                heapq.heappush(self._expiry, (token.time_limit + self.grace, token.uid))
+
+    def mark_used(self, token, when: datetime, session: Session = None):
+        with self._lock:
+            token.last_used_time = when
+
+    def register_failure(self, token):
+        with self._lock:
+            token.failed_attempts += 1
+            if token.failed_attempts > MAX_FAILED_ATTEMPTS:
+                token.deactivate = True
+
+
+def _timestamp(value: datetime) -> int:
+    return calendar.timegm(value.utctimetuple())
+
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class RedisTokenStore(TokenStore):
+    """
+    Tokens in Redis (or anything speaking its protocol), one hash per token plus index keys, all expiring
+    ``grace`` after the token's time limit. ``client`` is a redis-py compatible client.
+    """
+    _DATES = ('requested_time', 'time_limit', 'last_used_time')
+
+    def __init__(self, client, prefix: str = 'numen:token:', grace: timedelta = TIME_SPAN):
+        self.client = client
+        self.prefix = prefix
+        self.grace = grace
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> 'RedisTokenStore':
+        import redis
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def _key(self, *parts) -> str:
+        return self.prefix + ':'.join(str(part) for part in parts)
+
+    def _load(self, uid) -> Optional[TokenRecord]:
+        if uid is None:
+            return None
+        fields = {_text(k): _text(v) for k, v in self.client.hgetall(self._key(_text(uid))).items()}
+        if not fields:
+            return None
+        values = {}
+        for name in TokenRecord.__slots__:
+            value = fields.get(name, '')
+            if name in self._DATES:
+                values[name] = datetime.fromisoformat(value) if value else None
+            elif name in ('hex_token', 'url_token'):
+                values[name] = value
+            elif name == 'deactivate':
+                values[name] = value == '1'
+            else:
+                values[name] = int(value) if value else None
+        return TokenRecord(**values)
+
+    def latest(self, user_id: int, exchange_method: int = None, session: Session = None):
+        return self._load(self.client.get(self._key('user', user_id, exchange_method or 'any')))
+
+    def find_by_url_token(self, url_token: str, session: Session = None):
+        return self._load(self.client.get(self._key('url', url_token)))
+
+    def add(self, values: dict, session: Session = None):
+        self.put([values], session)
+
+    def put(self, tokens: List[dict], session: Session = None):
+        if not tokens:
+            return
+        # one round trip for the uids and one for the writes, whatever the batch size
+        last = self.client.incrby(self._key('sequence'), len(tokens))
+        pipe = self.client.pipeline()
+        for uid, values in enumerate(tokens, last - len(tokens) + 1):
+            token = TokenRecord(uid=uid, **values)
+            expire_at = _timestamp(token.time_limit + self.grace)
+            fields = {'uid': uid, 'user_id': token.user_id, 'hex_token': token.hex_token,
+                      'url_token': token.url_token, 'requested_time': token.requested_time.isoformat(),
+                      'time_limit': token.time_limit.isoformat(), 'exchange_method': token.exchange_method,
+                      'failed_attempts': 0, 'last_used_time': '', 'deactivate': 0}
+            pipe.hset(self._key(uid), mapping=fields)
+            pipe.expireat(self._key(uid), expire_at)
+            for key in (self._key('user', token.user_id, 'any'),
+                        self._key('user', token.user_id, token.exchange_method), self._key('url', token.url_token)):
+                pipe.set(key, uid)
+                pipe.expireat(key, expire_at)
+        pipe.execute()
+
+    def mark_used(self, token, when: datetime, session: Session = None):
+        # expiry is set again, a write racing with expiry would otherwise leave a key that never expires
+        pipe = self.client.pipeline()
+        pipe.hset(self._key(token.uid), 'last_used_time', when.isoformat())
+        pipe.expireat(self._key(token.uid), _timestamp(token.time_limit + self.grace))
+        pipe.execute()
+        token.last_used_time = when
+
+    def register_failure(self, token):
+        pipe = self.client.pipeline()
+        pipe.hincrby(self._key(token.uid), 'failed_attempts', 1)
+        pipe.expireat(self._key(token.uid), _timestamp(token.time_limit + self.grace))
+        failed_attempts = pipe.execute()[0]
+        if failed_attempts > MAX_FAILED_ATTEMPTS:
+            self.client.hset(self._key(token.uid), 'deactivate', 1)
+            token.deactivate = True
+        token.failed_attempts = failed_attempts
+
+
+def token_store_from_env() -> Optional[TokenStore]:
+    """``NUMEN_TOKEN_STORE``: ``sql`` (default, None is returned), ``memory`` or a ``redis://`` url."""
+    kind = os.environ.get('NUMEN_TOKEN_STORE', 'sql')
+    if kind == 'sql':
+        return None
+    if kind == 'memory':
+        return MemoryTokenStore()
+    if kind.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisTokenStore.from_url(kind)
+    raise ValueException(f'Unknown token store: {kind}')
+
+
+# shared by TokenHandler and AsyncTokenHandler, so a token issued by one is seen by the other
+token_store = token_store_from_env()
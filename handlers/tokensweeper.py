@@ -0,0 +1,176 @@
+__all__ = ['TokenSweeper', 'SweepStats', 'archive_table', 'archive_tables', 'drop_archives_before']
+
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, Boolean, select, delete, insert, \
+    inspect, literal
+
+from core.exceptions import ValueException
+from domain.models import DBInitializer, session_scope
+from domain.models import Token
+
+_logger = logging.getLogger('numen.tokensweeper')
+
+ARCHIVE_PREFIX = 'tokens_archive_'
+_TOKEN_COLUMNS = ('uid', 'hex_token', 'url_token', 'user_id', 'requested_time', 'time_limit', 'failed_attempts',
+                  'last_used_time', 'deactivate', 'exchange_method')
+
+# archive tables are created on demand, one per month of time_limit, so old months are dropped as a whole
+_archive_metadata = MetaData()
+
+
+def archive_table(period: str) -> Table:
+    """Archive table of a ``YYYYMM`` period."""
+    name = ARCHIVE_PREFIX + period
+    if name in _archive_metadata.tables:
+        return _archive_metadata.tables[name]
+    return Table(name, _archive_metadata,
+                 Column('uid', Integer, primary_key=True, autoincrement=False),
+                 Column('hex_token', String, nullable=False),
+                 Column('url_token', String, nullable=False),
+                 Column('user_id', Integer, nullable=False),
+                 Column('requested_time', DateTime, nullable=False),
+                 Column('time_limit', DateTime, nullable=False),
+                 Column('failed_attempts', Integer, nullable=False),
+                 Column('last_used_time', DateTime, nullable=True),
+                 Column('deactivate', Boolean, nullable=False),
+                 Column('exchange_method', Integer, nullable=True),
+                 Column('archived_at', DateTime, nullable=False))
+
+
+def archive_tables(engine=None) -> List[str]:
+    engine = engine or DBInitializer.get_engine()
+    return sorted(name for name in inspect(engine).get_table_names() if name.startswith(ARCHIVE_PREFIX))
+
+
+def drop_archives_before(before: datetime, engine=None) -> List[str]:
+    """Drops archive months that ended before ``before``; a DROP TABLE instead of deleting rows one by one."""
+    engine = engine or DBInitializer.get_engine()
+    limit = before.strftime('%Y%m')
+    dropped = []
+    for name in archive_tables(engine):
+        period = name[len(ARCHIVE_PREFIX):]
+        if period < limit:
+            archive_table(period).drop(bind=engine, checkfirst=True)
+            dropped.append(name)
+    return dropped
+
+
+class SweepStats:
+    def __init__(self):
+        self.rows = 0
+        self.batches = 0
+        self.seconds = 0.0
+        self.errors = 0
+        self.last_run = None
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def __repr__(self):
+        return "SweepStats(rows=%r, batches=%r, seconds=%.3f, rows_per_second=%.1f, errors=%r)" \
+               % (self.rows, self.batches, self.seconds, self.rows_per_second, self.errors)
+
+
+class TokenSweeper:
+    """
+    Removes tokens whose ``time_limit`` passed more than ``retention`` ago.
+
+    Rows go in batches of ``batch_size``, each in its own short transaction, and the sweeper sleeps between
+    batches to stay under ``max_rows_per_second``. With ``archive`` the rows are copied to monthly
+    ``tokens_archive_YYYYMM`` tables first.
+    """
+    _Session = DBInitializer.get_session
+
+    def __init__(self, batch_size: int = 1000, max_rows_per_second: float = 5000,
+                 retention: timedelta = timedelta(days=1), archive: bool = False):
+        if batch_size < 1:
+            raise ValueException('batch size must be positive!')
+        self.batch_size = batch_size
+        self.max_rows_per_second = max_rows_per_second
+        self.retention = retention
+        self.archive = archive
+        self.stats = SweepStats()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sweep_batch(self, cutoff: datetime) -> int:
+        with session_scope(self._Session) as session:
+            rows = session.execute(select(Token.uid, Token.time_limit).where(Token.time_limit < cutoff)
+                                   .order_by(Token.time_limit).limit(self.batch_size)).all()
+            if not rows:
+                return 0
+            if self.archive:
+                self._archive(session, rows)
+            session.execute(delete(Token).where(Token.uid.in_([uid for uid, _ in rows]))
+                            .execution_options(synchronize_session=False))
+            session.commit()
+        return len(rows)
+
+    def _archive(self, session, rows):
+        periods: Dict[str, List[int]] = {}
+        for uid, time_limit in rows:
+            periods.setdefault(time_limit.strftime('%Y%m'), []).append(uid)
+        now = datetime.utcnow()
+        for period, uids in periods.items():
+            table = archive_table(period)
+            # checked every batch, not remembered: drop_archives_before (here or in another process) may have
+            # dropped the month since
+            table.create(bind=session.connection(), checkfirst=True)
+            columns = [getattr(Token, name) for name in _TOKEN_COLUMNS]
+            session.execute(insert(table).from_select(
+                list(_TOKEN_COLUMNS) + ['archived_at'],
+                select(*columns, literal(now, DateTime)).where(Token.uid.in_(uids))))
+
+    def run_once(self, max_batches: int = None) -> int:
+        """Sweeps until nothing is left (or ``max_batches``), returns the number of rows removed."""
+        cutoff = datetime.utcnow() - self.retention
+        swept = batches = 0
+        start = time.monotonic()
+        while not self._stop.is_set() and (max_batches is None or batches < max_batches):
+            batch_start = time.monotonic()
+            count = self.sweep_batch(cutoff)
+            self.stats.seconds += time.monotonic() - batch_start
+            if not count:
+                break
+            swept += count
+            batches += 1
+            self.stats.rows += count
+            self.stats.batches += 1
+            if self.max_rows_per_second:
+                # throttle: don't get ahead of the allowed rate, short transactions with gaps between them
+                ahead = swept / self.max_rows_per_second - (time.monotonic() - start)
+                if ahead > 0:
+                    self._stop.wait(ahead)
+        self.stats.last_run = datetime.utcnow()
+        return swept
+
+    def start(self, interval: float = 60.0):
+        """Runs ``run_once`` every ``interval`` seconds on a daemon thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+
+        def loop():
+            while not self._stop.is_set():
+                try:
+                    self.run_once()
+                except Exception:
+                    # a failed batch was rolled back, try again on the next round
+                    self.stats.errors += 1
+                    _logger.exception('token sweep failed')
+                self._stop.wait(interval)
+
+        self._thread = threading.Thread(target=loop, name='token-sweeper', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
@@ -0,0 +1,153 @@
+"""
+Signed url tokens: the link carries user id, exchange method, expiry and a nonce under an HMAC, so a forged or
+expired link is refused without reading the tokens table. A link works once; used (and deactivated) nonces are kept
+in a revocation set until the link would have expired anyway.
+"""
+__all__ = ['SignedUrlToken', 'UrlTokenSigner', 'RevocationSet', 'MemoryRevocationSet', 'RedisRevocationSet',
+           'url_token_signer_from_env', 'revocation_set_from_env', 'url_token_signer', 'revocation_set']
+
+import base64
+import binascii
+import calendar
+import hashlib
+import heapq
+import hmac
+import os
+import secrets
+import struct
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from datetime import datetime
+from typing import Callable, Optional, Sequence
+
+from core.exceptions import AuthenticationException, ValueException
+
+SignedUrlToken = namedtuple('SignedUrlToken', ['user_id', 'exchange_method', 'expires', 'nonce'])
+
+# user id, exchange method, expiry (unix seconds), 8 byte nonce
+_PAYLOAD = struct.Struct('>QBI8s')
+# 128 bits of the HMAC-SHA256 are plenty for a link that lives an hour
+_MAC_SIZE = 16
+
+
+def _encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _timestamp(value: datetime) -> int:
+    return calendar.timegm(value.utctimetuple())
+
+
+class UrlTokenSigner:
+    """Signs with the first of ``keys`` and accepts any of them, so a key can be rotated out."""
+
+    def __init__(self, keys: Sequence[bytes]):
+        if not keys or not all(keys):
+            raise ValueException('at least one non empty key is needed!')
+        self.keys = [key if isinstance(key, bytes) else key.encode() for key in keys]
+
+    def _mac(self, key: bytes, payload: bytes) -> bytes:
+        return hmac.new(key, payload, hashlib.sha256).digest()[:_MAC_SIZE]
+
+    def sign(self, user_id: int, exchange_method: int, expires: datetime, nonce: bytes = None) -> str:
+        payload = _PAYLOAD.pack(user_id, exchange_method, _timestamp(expires), nonce or secrets.token_bytes(8))
+        return f'{_encode(payload)}.{_encode(self._mac(self.keys[0], payload))}'
+
+    def unsign(self, token: str) -> SignedUrlToken:
+        """Checks the signature only, the expiry is up to the caller; raises AuthenticationException."""
+        try:
+            payload_text, mac_text = token.split('.')
+            payload, mac = _decode(payload_text), _decode(mac_text)
+            user_id, exchange_method, expires, nonce = _PAYLOAD.unpack(payload)
+        except (ValueError, binascii.Error, struct.error, AttributeError):
+            raise AuthenticationException('Url Token is not valid!')
+        if not any(hmac.compare_digest(self._mac(key, payload), mac) for key in self.keys):
+            raise AuthenticationException('Url Token is not valid!')
+        return SignedUrlToken(user_id, exchange_method, datetime.utcfromtimestamp(expires), nonce)
+
+
+class RevocationSet(ABC):
+    """Nonces of links that must not work any more, each kept until ``expires`` (unix seconds)."""
+    # waits on the network, AsyncTokenHandler calls it in an executor
+    blocking = True
+
+    @abstractmethod
+    def claim(self, nonce: bytes, expires: int) -> bool:
+        """Revokes ``nonce`` and tells whether this call did it; of concurrent claims exactly one wins."""
+
+    def revoke(self, nonce: bytes, expires: int):
+        self.claim(nonce, expires)
+
+
+class MemoryRevocationSet(RevocationSet):
+    """Revocations of one process; with several workers a link could be used once per worker."""
+    blocking = False
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._nonces = {}
+        self._expiry = []
+
+    def __len__(self):
+        with self._lock:
+            self._purge()
+            return len(self._nonces)
+
+    def _purge(self):
+        now = self._clock()
+        while self._expiry and self._expiry[0][0] <= now:
+            expires, nonce = heapq.heappop(self._expiry)
+            if self._nonces.get(nonce) == expires:
+                del self._nonces[nonce]
+
+    def claim(self, nonce: bytes, expires: int) -> bool:
+        with self._lock:
+            self._purge()
+            if nonce in self._nonces:
+                return False
+            self._nonces[nonce] = expires
+            heapq.heappush(self._expiry, (expires, nonce))
+            return True
+
+
+class RedisRevocationSet(RevocationSet):
+    """Revocations shared by every worker, one expiring key per nonce. ``client`` is a redis-py compatible client."""
+
+    def __init__(self, client, prefix: str = 'numen:revoked:', clock: Callable[[], float] = time.time):
+        self.client = client
+        self.prefix = prefix
+        self._clock = clock
+
+    def claim(self, nonce: bytes, expires: int) -> bool:
+        # SET NX is atomic, the first claim of a nonce wins
+        ttl = max(1, int(expires - self._clock()) + 1)
+        return bool(self.client.set(self.prefix + nonce.hex(), 1, nx=True, ex=ttl))
+
+
+def url_token_signer_from_env() -> Optional[UrlTokenSigner]:
+    """``NUMEN_URL_TOKEN_KEYS``: comma separated secrets, the first signs; unset keeps random, stored url tokens."""
+    keys = [key.strip() for key in os.environ.get('NUMEN_URL_TOKEN_KEYS', '').split(',') if key.strip()]
+    return UrlTokenSigner([key.encode() for key in keys]) if keys else None
+
+
+def revocation_set_from_env() -> RevocationSet:
+    """``NUMEN_URL_TOKEN_REVOCATIONS``: ``memory`` (default) or a ``redis://`` url."""
+    kind = os.environ.get('NUMEN_URL_TOKEN_REVOCATIONS', 'memory')
+    if kind == 'memory':
+        return MemoryRevocationSet()
+    if kind.startswith(('redis://', 'rediss://', 'unix://')):
+        import redis
+        return RedisRevocationSet(redis.Redis.from_url(kind))
+    raise ValueException(f'Unknown revocation set: {kind}')
+
+
+# shared by TokenHandler and AsyncTokenHandler
+url_token_signer = url_token_signer_from_env()
+revocation_set = revocation_set_from_env()
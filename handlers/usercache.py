@@ -0,0 +1,126 @@
+__all__ = ['UserSnapshot', 'UserCache', 'user_cache']
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date
+from typing import Callable, Optional
+
+from domain.models import User
+
+
+@dataclass(frozen=True)
+class UserSnapshot:
+    """Read only, detached copy of a ``User`` without the password hash."""
+    uid: int
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    birth: Optional[date] = None
+    email: Optional[str] = None
+    is_email_verified: bool = False
+    phone: Optional[str] = None
+    is_phone_verified: bool = False
+    state: int = 1
+
+    @property
+    def password(self):
+        # same attribute as User, but never filled
+        return None
+
+    @classmethod
+    def from_user(cls, user: User) -> 'UserSnapshot':
+        return cls(uid=user.uid, first_name=user.first_name, last_name=user.last_name, birth=user.birth,
+                   email=user.email, is_email_verified=user.is_email_verified, phone=user.phone,
+                   is_phone_verified=user.is_phone_verified, state=user.state)
+
+
+class UserCache:
+    """
+    LRU cache of user snapshots by uid, with email and phone pointing to the uid. Entries live ``ttl``
+    seconds, which also bounds how long another process' writes stay invisible; writes of this process
+    invalidate right away. ``max_size`` 0 turns the cache off.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60.0, clock: Callable[[], float] = time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._keys = {}
+        # bumped by every invalidation, a load that started before one must not be stored
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> 'UserCache':
+        return cls(max_size=int(os.environ.get('NUMEN_USER_CACHE_SIZE', 10000)),
+                   ttl=float(os.environ.get('NUMEN_USER_CACHE_TTL', 60)))
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, uid: int = None, email: str = None, phone: str = None) -> Optional[UserSnapshot]:
+        with self._lock:
+            if uid is None:
+                uid = self._keys.get(('email', email) if email is not None else ('phone', phone))
+            entry = self._entries.get(uid)
+            if entry is None or entry[0] <= self._clock():
+                if entry is not None:
+                    self._remove(uid)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(uid)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, snapshot: UserSnapshot, generation: int = None):
+        """Stores ``snapshot`` unless something was invalidated since ``generation`` was read."""
+        if not self.max_size:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._remove(snapshot.uid)
+            self._entries[snapshot.uid] = (self._clock() + self.ttl, snapshot)
+            if snapshot.email is not None:
+                self._keys[('email', snapshot.email)] = snapshot.uid
+            if snapshot.phone is not None:
+                self._keys[('phone', snapshot.phone)] = snapshot.uid
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, uid: int = None, email: str = None, phone: str = None):
+        with self._lock:
+            self._generation += 1
+            for key in (('email', email), ('phone', phone)):
+                if key[1] is not None and key in self._keys:
+                    self._remove(self._keys[key])
+            if uid is not None:
+                self._remove(uid)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._keys.clear()
+
+    def _remove(self, uid):
+        entry = self._entries.pop(uid, None)
+        if entry is None:
+            return
+        snapshot = entry[1]
+        for key in (('email', snapshot.email), ('phone', snapshot.phone)):
+            if self._keys.get(key) == uid:
+                del self._keys[key]
+
+
+# shared by the sync and async handlers, so writes through either one invalidate it
+user_cache = UserCache.from_env()
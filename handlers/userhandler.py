@@ -1,54 +1,149 @@
-from core.exceptions import TypeException, AuthenticationException, ValueException, SecurityException
-from domain.models import DBInitializer
-from domain.models import User
+from collections import namedtuple
+from datetime import datetime
+from itertools import chain, islice
+from typing import Iterable, List, Union
+
+from sqlalchemy import event, insert, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from core.exceptions import TypeException, AuthenticationException, ValueException, SecurityException, \
+    OverloadException
+from core.metrics import instrument_handler
+from domain.models import DBInitializer, session_scope
+from domain.models import User, OutboxMessage
 from domain.models.token import ExchangeMethods
-from domain.services import user_validation, email_validation, phone_validation, passwordservice
+from domain.services import user_validation, validate_users, email_validation, phone_validation, passwordservice
 from domain.services.userservices import get_user_state
-from handlers.tokenhandler import TokenHandler
+from handlers.contactfilter import contact_filter
+from handlers.ratelimit import login_limiter
+from handlers.tokenhandler import TokenHandler, token_values, token_message
+from handlers.usercache import UserSnapshot, user_cache
+
+# one row of the bulk_create_users report: position in the input, new uid (None on failure), error messages
+BulkUserResult = namedtuple('BulkUserResult', ['index', 'uid', 'errors'])
+
+_USER_COLUMNS = ('first_name', 'last_name', 'birth', 'email', 'phone')
 
 
+def _chunks(iterable: Iterable, size: int):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+@instrument_handler
 class UserHandler:
     _Session = DBInitializer.get_session
+    # reads that may be served by a replica, see domain.models.routing
+    _ReadSession = DBInitializer.get_read_session
+    _router = DBInitializer.get_router
     _user_validation = user_validation
+    _validate_users = validate_users
     _email_validation = email_validation
     _phone_validation = phone_validation
     _password_service = passwordservice
     _hashing = _password_service.hashing_password
     _get_user_state = get_user_state
+    _cache = user_cache
+    _login_limiter = login_limiter
+    _contact_filter = contact_filter
 
     _hex_token_verification = TokenHandler.hexadecimal_token_validation
     _url_token_verification = TokenHandler.url_token_validation
     _generate_token = TokenHandler.generate_token
 
     @classmethod
-    def get_user_by_id(cls, uid: int) -> User:
+    def _cached(cls, **key) -> UserSnapshot:
+        # a context pinned to the primary must see its own writes, the cache may hold what a replica showed
+        if cls._router().pinned():
+            return None
+        return cls._cache.get(**key)
+
+    @classmethod
+    def _remember(cls, session: Session, user: UserSnapshot, generation: int):
+        # a replica may not have an invalidated write yet, its rows would stay cached for the whole ttl
+        if not cls._router().is_replica(session.get_bind()):
+            cls._cache.put(user, generation)
+
+    @classmethod
+    def get_user_by_id(cls, uid: int) -> UserSnapshot:
         if not isinstance(uid, int):
             raise TypeException("uid parameter type must be int!")
-        session = cls._Session()
-        u = session.query(User).get(uid)
-        if not u:
-            raise ValueException(f"user with this id <{uid}> doesn't exist!")
-        u.password = None
-        return u
+        user = cls._cached(uid=uid)
+        if user:
+            return user
+        generation = cls._cache.generation
+        with session_scope(cls._ReadSession) as session:
+            u = session.query(User).get(uid)
+            if not u:
+                raise ValueException(f"user with this id <{uid}> doesn't exist!")
+            user = UserSnapshot.from_user(u)
+            cls._remember(session, user, generation)
+        return user
 
     @classmethod
-    def get_user_by_email(cls, email: str) -> User:
+    def get_user_by_email(cls, email: str) -> UserSnapshot:
         if not isinstance(email, str):
             raise TypeException("email parameter type must be string!")
         cls._email_validation(email)
-        session = cls._Session()
-        user = session.query(User).filter_by(email=email).first()
-        user.password = None
+        user = cls._cached(email=email)
+        if user:
+            return user
+        generation = cls._cache.generation
+        with session_scope(cls._ReadSession) as session:
+            u = session.query(User).filter_by(email=email).first()
+            if not u:
+                raise ValueException(f"user with this email <{email}> doesn't exist!")
+            user = UserSnapshot.from_user(u)
+            cls._remember(session, user, generation)
+        return user
+
+    @classmethod
+    def get_user_by_phone(cls, phone: str) -> UserSnapshot:
+        if not isinstance(phone, str):
+            raise TypeException("phone parameter type must be string!")
+        cls._phone_validation(phone)
+        user = cls._cached(phone=phone)
+        if user:
+            return user
+        generation = cls._cache.generation
+        with session_scope(cls._ReadSession) as session:
+            u = session.query(User).filter_by(phone=phone).first()
+            if not u:
+                raise ValueException(f"user with this phone <{phone}> doesn't exist!")
+            user = UserSnapshot.from_user(u)
+            cls._remember(session, user, generation)
         return user
 
+    @classmethod
+    def is_email_registered(cls, email: str) -> bool:
+        """For sign up forms."""
+        cls._email_validation(email)
+        with session_scope(cls._ReadSession) as session:
+            return session.query(User.uid).filter_by(email=email).first() is not None
+
+    @classmethod
+    def is_phone_registered(cls, phone: str) -> bool:
+        """For sign up forms."""
+        cls._phone_validation(phone)
+        with session_scope(cls._ReadSession) as session:
+            return session.query(User.uid).filter_by(phone=phone).first() is not None
+
     @classmethod
     def create_user(cls, user: User) -> int:
         if cls._user_validation(user):
             user.password = cls._hashing(user.password)
             user.state = cls._get_user_state(user).value
-            session = cls._Session()
-            session.add(user)
-            session.commit()
+            with session_scope(cls._Session) as session:
+                session.add(user)
+                session.commit()
+            # a recreated database hands out old uids again
+            cls._cache.invalidate(user.uid, user.email, user.phone)
+            cls._contact_filter.add(user.email, user.phone)
             if user.email:
                 cls._generate_token(user.uid, ExchangeMethods.EMAIL)
             if user.phone:
@@ -56,92 +151,242 @@ class UserHandler:
         return user.uid
 
     @classmethod
-    def verify_user_email_by_hex_token(cls, user_id: int, hex_token: str):
-        session = cls._Session()
-        user = session.query(User).get(user_id)
-        if user.is_email_verified:
-            return True
-        if not TokenHandler.hexadecimal_token_validation(user_id, hex_token, ExchangeMethods.EMAIL):
-            return False
-        user.is_email_verified = True
-        user.state = get_user_state(user).value
-        session.commit()
+    def bulk_create_users(cls, users: Iterable[Union[User, dict]], chunk_size: int = 1000) -> List[BulkUserResult]:
+        """
+        Imports users chunk by chunk: batch validation, parallel hashing, one INSERT per chunk and the
+        verification tokens in the same transaction. Records may be ``User`` objects or column dicts; a bad
+        record is reported and skipped, it doesn't stop the import. When the hashing executor is saturated the
+        import stops: the chunks before stay imported, every record from the current chunk on is reported failed.
+        """
+        if chunk_size < 1:
+            raise ValueException("chunk size must be positive!")
+        report = []
+        chunks = _chunks(users, chunk_size)
+        for chunk in chunks:
+            try:
+                report.extend(cls._bulk_create_chunk(len(report), chunk))
+            except OverloadException as ex:
+                # drains what is left of the input, the loop ends with it
+                for _ in chain(chunk, chain.from_iterable(chunks)):
+                    report.append(BulkUserResult(len(report), None, [f"User couldn't be stored! {ex}"]))
+        return report
 
     @classmethod
-    def verify_user_phone_by_hex_token(cls, user_id: int, hex_token: str):
-        session = cls._Session()
-        user = session.query(User).get(user_id)
-        if user.is_phone_verified:
-            return True
-        if not TokenHandler.hexadecimal_token_validation(user_id, hex_token, ExchangeMethods.PHONE):
-            return False
-        user.is_phone_verified = True
-        user.state = get_user_state(user).value
-        session.commit()
-
-    @classmethod
-    def verify_user_exchange_method_by_url_token(cls, url_token: str):
-        user_id, ex_method = TokenHandler.url_token_validation(url_token)
-        session = cls._Session()
-        user = session.query(User).get(user_id)
-        if ex_method == ExchangeMethods.PHONE.value:
-            user.is_phone_verified = True
-        elif ex_method == ExchangeMethods.EMAIL.value:
-            user.is_email_verified = True
-        user.state = cls._get_user_state(user).value
-        session.commit()
-
-    @classmethod
-    def log_in_by_email(cls, email: str, password: str) -> User:
+    def _bulk_create_chunk(cls, offset: int, records: List[Union[User, dict]]) -> List[BulkUserResult]:
+        users, errors = [], []
+        for record in records:
+            try:
+                users.append(User(**record) if isinstance(record, dict) else record)
+                errors.append(None)
+            except TypeError as ex:
+                # a key that is no column of users
+                users.append(None)
+                errors.append([f"Invalid record! {ex}"])
+        built = [i for i, user in enumerate(users) if user is not None]
+        for i, user_errors in zip(built, cls._validate_users([users[i] for i in built])):
+            errors[i] = user_errors
+        cls._find_duplicates(users, errors)
+        valid = [i for i, user_errors in enumerate(errors) if not user_errors]
+        # hashing happens before a connection is taken from the pool
+        hashes = cls._password_service.hashing_passwords(users[i].password for i in valid)
+        rows = []
+        for i, hashed in zip(valid, hashes):
+            row = {column: getattr(users[i], column) for column in _USER_COLUMNS}
+            row.update(password=hashed, is_email_verified=False, is_phone_verified=False,
+                       state=cls._get_user_state(users[i]).value)
+            rows.append(row)
+        uids = [None] * len(users)
+        if rows:
+            try:
+                with session_scope(cls._Session) as session:
+                    inserted = cls._insert_users(session, rows)
+                    now = datetime.utcnow()
+                    tokens, messages = [], []
+                    for row, uid in zip(rows, inserted):
+                        for via, recipient in ((ExchangeMethods.EMAIL, row['email']),
+                                               (ExchangeMethods.PHONE, row['phone'])):
+                            if recipient:
+                                tokens.append(token_values(uid, via, now, TokenHandler._signer))
+                                messages.append(token_message(tokens[-1], recipient))
+                    if tokens:
+                        # the configured store, as for a single user; the SQL store joins this transaction
+                        TokenHandler._token_store().put(tokens, session)
+                        session.execute(insert(OutboxMessage), messages)
+                    session.commit()
+            except IntegrityError as ex:
+                # a concurrent writer took an email/phone after the duplicate check, the whole chunk is rolled back
+                for i in valid:
+                    errors[i] = [f"User couldn't be stored! {ex.orig}"]
+            else:
+                for i, uid in zip(valid, inserted):
+                    uids[i] = uid
+                    cls._cache.invalidate(uid, users[i].email, users[i].phone)
+                    cls._contact_filter.add(users[i].email, users[i].phone)
+        return [BulkUserResult(offset + i, uids[i], errors[i]) for i in range(len(users))]
+
+    @classmethod
+    def _find_duplicates(cls, users: List[User], errors: List[List[str]]):
+        # only what may be registered is looked up, a fresh import mostly skips the query
+        emails = {u.email for u, e in zip(users, errors)
+                  if not e and u.email and cls._contact_filter.might_have_email(u.email)}
+        phones = {u.phone for u, e in zip(users, errors)
+                  if not e and u.phone and cls._contact_filter.might_have_phone(u.phone)}
+        taken = []
+        if emails or phones:
+            with session_scope(cls._Session) as session:
+                taken = session.query(User.email, User.phone).filter(
+                    or_(User.email.in_(emails), User.phone.in_(phones))).all()
+        taken_emails = {email for email, _ in taken}
+        taken_phones = {phone for _, phone in taken}
+        for user, user_errors in zip(users, errors):
+            if user_errors:
+                continue
+            if user.email and user.email in taken_emails:
+                user_errors.append("Email is already registered!")
+            if user.phone and user.phone in taken_phones:
+                user_errors.append("Phone is already registered!")
+            # later rows of the same chunk must not reuse what this one takes
+            if not user_errors:
+                taken_emails.add(user.email)
+                taken_phones.add(user.phone)
+
+    @staticmethod
+    def _insert_users(session, rows: List[dict]) -> List[int]:
+        if session.get_bind().dialect.full_returning:
+            # one multi-row INSERT; RETURNING promises no order, its rows are matched by their unique email/phone
+            keyed = [row for row in rows if row['email'] or row['phone']]
+            uids = {}
+            if keyed:
+                uids = {(email, phone): uid for uid, email, phone in session.execute(
+                    insert(User).values(keyed).returning(User.uid, User.email, User.phone))}
+            # a user with neither has nothing to match by
+            return [uids[row['email'], row['phone']] if row['email'] or row['phone']
+                    else session.execute(insert(User).values(row)).inserted_primary_key[0] for row in rows]
+        # without RETURNING (sqlite) the keys are only known per statement, still one transaction per chunk
+        return [session.execute(insert(User).values(row)).inserted_primary_key[0] for row in rows]
+
+    @classmethod
+    def _invalidate(cls, uid: int, session: Session = None):
+        cls._cache.invalidate(uid)
+        if session is not None:
+            # a read between now and the caller's commit could cache the old row again
+            event.listen(session, 'after_commit', lambda _: cls._cache.invalidate(uid), once=True)
+
+    @classmethod
+    def verify_user_email_by_hex_token(cls, user_id: int, hex_token: str, session: Session = None):
+        return cls._verify_by_hex_token(user_id, hex_token, ExchangeMethods.EMAIL, session)
+
+    @classmethod
+    def verify_user_phone_by_hex_token(cls, user_id: int, hex_token: str, session: Session = None):
+        return cls._verify_by_hex_token(user_id, hex_token, ExchangeMethods.PHONE, session)
+
+    @classmethod
+    def _verify_by_hex_token(cls, user_id: int, hex_token: str, via: ExchangeMethods, session: Session = None):
+        """
+        The token check and the user update share one transaction: the caller's ``session`` (committed by the
+        caller), or one opened here.
+        """
+        borrowed = session is not None
+        flag = 'is_email_verified' if via == ExchangeMethods.EMAIL else 'is_phone_verified'
+        with session_scope(cls._Session, session) as session:
+            user = session.query(User).get(user_id)
+            if getattr(user, flag):
+                return True
+            if not cls._hex_token_verification(user_id, hex_token, via, session=session):
+                return False
+            setattr(user, flag, True)
+            user.state = cls._get_user_state(user).value
+            if not borrowed:
+                session.commit()
+        cls._invalidate(user_id, session if borrowed else None)
+
+    @classmethod
+    def verify_user_exchange_method_by_url_token(cls, url_token: str, session: Session = None):
+        borrowed = session is not None
+        with session_scope(cls._Session, session) as session:
+            user_id, ex_method = cls._url_token_verification(url_token, session=session)
+            user = session.query(User).get(user_id)
+            if ex_method == ExchangeMethods.PHONE.value:
+                user.is_phone_verified = True
+            elif ex_method == ExchangeMethods.EMAIL.value:
+                user.is_email_verified = True
+            user.state = cls._get_user_state(user).value
+            if not borrowed:
+                session.commit()
+        cls._invalidate(user_id, session if borrowed else None)
+
+    @classmethod
+    def log_in_by_email(cls, email: str, password: str, client: str = None) -> User:
         if cls._email_validation(email):
-            session = cls._Session()
-            user = session.query(User).filter_by(email=email).first()
-            if not user:
-                raise AuthenticationException("Wrong Email Address!")
-            if cls._password_service.password_verification(user.password, password):
-                user.password = None
-                return user
-            raise AuthenticationException("Wrong Password!")
+            # before the lookup and the hash, a throttled attempt costs next to nothing
+            cls._login_limiter.acquire(f'email:{email.lower()}', client)
+            with session_scope(cls._Session) as session:
+                user = session.query(User).filter_by(email=email).first()
+                if not user:
+                    raise AuthenticationException("Wrong Email Address!")
+                if cls._password_service.password_verification(user.password, password):
+                    cls._login_limiter.succeeded(f'email:{email.lower()}')
+                    cls._rehash_password(user.uid, user.password, password)
+                    user.password = None
+                    return user
+                raise AuthenticationException("Wrong Password!")
         raise ValueException("Invalid email address value!")
 
     @classmethod
-    def log_in_by_phone(cls, phone: str, password: str) -> User:
+    def log_in_by_phone(cls, phone: str, password: str, client: str = None) -> User:
         if cls._phone_validation(phone):
-            session = cls._Session()
-            user = session.query(User).filter_by(phone=phone).first()
-            if not user:
-                raise AuthenticationException("Wrong Phone Number!")
-            if cls._password_service.password_verification(user.password, password):
-                user.password = None
-                return user
-            raise AuthenticationException("Wrong Password!")
+            # before the lookup and the hash, a throttled attempt costs next to nothing
+            cls._login_limiter.acquire(f'phone:{phone}', client)
+            with session_scope(cls._Session) as session:
+                user = session.query(User).filter_by(phone=phone).first()
+                if not user:
+                    raise AuthenticationException("Wrong Phone Number!")
+                if cls._password_service.password_verification(user.password, password):
+                    cls._login_limiter.succeeded(f'phone:{phone}')
+                    cls._rehash_password(user.uid, user.password, password)
+                    user.password = None
+                    return user
+                raise AuthenticationException("Wrong Password!")
         raise ValueException("Invalid phone value!")
 
     @classmethod
-    def update_user_info(cls, uid: int, first_name: str = None, last_name: str = None) -> User:
-        session = cls._Session()
-        user = session.query(User).get(uid)
-        if first_name:
-            user.first_name = first_name
-        if last_name:
-            user.last_name = last_name
-        session.commit()
-        user.password = None
-        return user
+    def _rehash_password(cls, uid: int, hashed_password: str, password: str):
+        def store(new_hash):
+            with session_scope(cls._Session) as session:
+                # only replace the hash that was verified, a password changed in between wins
+                session.query(User).filter_by(uid=uid, password=hashed_password) \
+                    .update({User.password: new_hash}, synchronize_session=False)
+                session.commit()
+
+        cls._password_service.rehash_in_background(hashed_password, password, store)
+
+    @classmethod
+    def update_user_info(cls, uid: int, first_name: str = None, last_name: str = None) -> UserSnapshot:
+        with session_scope(cls._Session) as session:
+            user = session.query(User).get(uid)
+            if first_name:
+                user.first_name = first_name
+            if last_name:
+                user.last_name = last_name
+            session.commit()
+            snapshot = UserSnapshot.from_user(user)
+        cls._cache.invalidate(uid)
+        return snapshot
 
     @classmethod
     def change_password(cls, user_id, old_password, new_password):
-        session = cls._Session()
-        user = session.query(User).get(user_id)
-        if not user:
-            raise SecurityException("User doesn't exist!")
-        if not cls._password_service.password_verification(user.password, old_password):
-            raise AuthenticationException("Wrong Password!")
-        if not cls._password_service.password_validation(new_password):
-            raise ValueException("Entered password is not valid!")
-        pss = cls._password_service.hashing_password(new_password)
-        user.password = pss
-        session.commit()
+        with session_scope(cls._Session) as session:
+            user = session.query(User).get(user_id)
+            if not user:
+                raise SecurityException("User doesn't exist!")
+            if not cls._password_service.password_verification(user.password, old_password):
+                raise AuthenticationException("Wrong Password!")
+            if not cls._password_service.password_validation(new_password):
+                raise ValueException("Entered password is not valid!")
+            pss = cls._password_service.hashing_password(new_password)
+            user.password = pss
+            session.commit()
+        cls._cache.invalidate(user_id)
         return True
 
     @classmethod
@@ -149,10 +394,11 @@ class UserHandler:
         if not passwordservice.password_validation(new_password):
             raise ValueException("Password is not valid!")
         if cls._hex_token_verification(user_id, hex_token):
-            session = cls._Session()
-            user = session.query(User).get(user_id)
-            user.password = cls._password_service.hashing_password(new_password)
-            session.commit()
+            with session_scope(cls._Session) as session:
+                user = session.query(User).get(user_id)
+                user.password = cls._password_service.hashing_password(new_password)
+                session.commit()
+            cls._cache.invalidate(user_id)
             return True
         raise SecurityException("Token is not valid!")
 
@@ -161,8 +407,9 @@ class UserHandler:
         if not passwordservice.password_validation(new_password):
             raise ValueException("Password is not valid!")
         user_id, _ = cls._url_token_verification(url_token)
-        session = cls._Session()
-        user = session.query(User).get(user_id)
-        user.password = passwordservice.hashing_password(new_password)
-        session.commit()
+        with session_scope(cls._Session) as session:
+            user = session.query(User).get(user_id)
+            user.password = passwordservice.hashing_password(new_password)
+            session.commit()
+        cls._cache.invalidate(user_id)
         return True
@@ -0,0 +1,178 @@
+from datetime import datetime, timedelta
+from unittest import IsolatedAsyncioTestCase
+
+from sqlalchemy.orm import close_all_sessions
+
+from core.exceptions import AuthenticationException, ValueException, SecurityException, InnerException
+from domain.models import DBInitializer, User, Token, OutboxMessage, async_unit_of_work
+from domain.models import db_Base as Base
+from domain.models.token import ExchangeMethods
+from domain.models.user import Address, UserState
+from handlers import AsyncUserHandler, AsyncTokenHandler, AsyncAddressHandler
+from handlers.tokenhandler import TokenHandler
+from handlers.tokenstore import MemoryTokenStore
+
+
+class AsyncHandlersTest(IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        Base.metadata.create_all(bind=DBInitializer.get_engine())
+
+    async def asyncTearDown(self) -> None:
+        # pooled connections are bound to this test's event loop
+        await DBInitializer.get_async_engine().dispose()
+
+    def tearDown(self) -> None:
+        close_all_sessions()
+        Base.metadata.drop_all(bind=DBInitializer.get_new_engine())
+
+    @staticmethod
+    async def create_user(pss='Pa$$w0rd') -> User:
+        user = User(password=pss, first_name='first name', last_name='last name', phone='9121234567',
+                    email='email@domain.tld')
+        await AsyncUserHandler.create_user(user)
+        return user
+
+    @staticmethod
+    def get_token(exchange_method: ExchangeMethods) -> Token:
+        session = DBInitializer.get_session()
+        token = session.query(Token).filter_by(exchange_method=exchange_method.value).one()
+        session.close()
+        return token
+
+    async def test_create_and_get_user(self):
+        user = await self.create_user()
+        u = await AsyncUserHandler.get_user_by_id(user.uid)
+        self.assertEqual(user.email, u.email)
+        self.assertIsNone(u.password)
+        u = await AsyncUserHandler.get_user_by_email(user.email)
+        self.assertEqual(user.uid, u.uid)
+        with self.assertRaises(ValueException):
+            await AsyncUserHandler.get_user_by_id(12345)
+
+    async def test_log_in(self):
+        pss = 'Pa$$w0rd'
+        user = await self.create_user(pss)
+        with self.assertRaises(AuthenticationException) as _ex:
+            await AsyncUserHandler.log_in_by_email(user.email, 'wrong password')
+        self.assertEqual('Entered password is wrong!', str(_ex.exception))
+        with self.assertRaises(AuthenticationException) as _ex:
+            await AsyncUserHandler.log_in_by_phone('9121234561', pss)
+        self.assertEqual('Wrong Phone Number!', str(_ex.exception))
+        u = await AsyncUserHandler.log_in_by_email(user.email, pss)
+        self.assertEqual(user.uid, u.uid)
+        self.assertIsNone(u.password)
+        u = await AsyncUserHandler.log_in_by_phone(user.phone, pss)
+        self.assertEqual(user.uid, u.uid)
+
+    async def test_change_password(self):
+        pss = 'Pa$$w0rd'
+        user = await self.create_user(pss)
+        with self.assertRaises(SecurityException):
+            await AsyncUserHandler.change_password(0, pss, 'Pa$$w)rd1')
+        with self.assertRaises(ValueException):
+            await AsyncUserHandler.change_password(user.uid, pss, 'pass')
+        await AsyncUserHandler.change_password(user.uid, pss, 'NEW pa$$w0rd')
+        u = await AsyncUserHandler.log_in_by_email(user.email, 'NEW pa$$w0rd')
+        self.assertEqual(user.uid, u.uid)
+
+    async def test_tokens_and_verification(self):
+        user = await self.create_user()
+        with self.assertRaises(InnerException) as _ex:
+            await AsyncTokenHandler.generate_token(user.uid, ExchangeMethods.PHONE)
+        self.assertEqual('A valid token already issued!', str(_ex.exception))
+
+        phone_token = self.get_token(ExchangeMethods.PHONE)
+        with self.assertRaises(AuthenticationException):
+            await AsyncTokenHandler.hexadecimal_token_validation(user.uid, 'wrong', ExchangeMethods.PHONE)
+        await AsyncUserHandler.verify_user_phone_by_hex_token(user.uid, phone_token.hex_token)
+        u = await AsyncUserHandler.get_user_by_id(user.uid)
+        self.assertTrue(u.is_phone_verified)
+        self.assertEqual(UserState.PARTIALLY.value, u.state)
+
+        email_token = self.get_token(ExchangeMethods.EMAIL)
+        await AsyncUserHandler.verify_user_exchange_method_by_url_token(email_token.url_token)
+        u = await AsyncUserHandler.get_user_by_id(user.uid)
+        self.assertTrue(u.is_email_verified)
+        self.assertEqual(UserState.ACTIVE.value, u.state)
+
+    async def test_verification_in_one_unit_of_work(self):
+        user = await self.create_user()
+        phone_token = self.get_token(ExchangeMethods.PHONE)
+        email_token = self.get_token(ExchangeMethods.EMAIL)
+        with self.assertRaises(AuthenticationException):
+            async with async_unit_of_work() as uow:
+                await AsyncUserHandler.verify_user_phone_by_hex_token(user.uid, 'wrong', session=uow)
+        async with async_unit_of_work() as uow:
+            await AsyncUserHandler.verify_user_phone_by_hex_token(user.uid, phone_token.hex_token, session=uow)
+            await AsyncUserHandler.verify_user_exchange_method_by_url_token(email_token.url_token, session=uow)
+        u = await AsyncUserHandler.get_user_by_id(user.uid)
+        self.assertEqual(UserState.ACTIVE.value, u.state)
+        # the failure was counted although its unit of work rolled back; the url token use is stored
+        self.assertEqual(1, self.get_token(ExchangeMethods.PHONE).failed_attempts)
+        self.assertIsNotNone(self.get_token(ExchangeMethods.EMAIL).last_used_time)
+
+    async def test_security_events_are_logged(self):
+        user = await self.create_user()
+        with self.assertLogs('numen.security', 'WARNING') as logs:
+            for _ in range(4):
+                with self.assertRaises(InnerException):
+                    await AsyncTokenHandler.hexadecimal_token_validation(user.uid, 'wrong', ExchangeMethods.PHONE)
+            with self.assertRaises(SecurityException):
+                await AsyncTokenHandler.hexadecimal_token_validation(user.uid, 'wrong', ExchangeMethods.PHONE)
+            with self.assertRaises(AuthenticationException):
+                await AsyncTokenHandler.url_token_validation('wrong')
+        # the same events as TokenHandler's
+        self.assertEqual(['token.failed'] * 3 + ['token.deactivated', 'token.deactivated_used', 'token.url_invalid'],
+                         [r.event for r in logs.records])
+        self.assertEqual([1, 2, 3, 4], [r.failed_attempts for r in logs.records[:4]])
+
+    async def test_generate_token_in_the_callers_unit_of_work(self):
+        user = await self.create_user()
+        session = DBInitializer.get_session()
+        session.query(Token).update({Token.time_limit: datetime.utcnow() - timedelta(minutes=1)})
+        session.commit()
+        with self.assertRaises(RuntimeError):
+            async with async_unit_of_work() as uow:
+                await AsyncTokenHandler.generate_token(user.uid, ExchangeMethods.PHONE, session=uow)
+                raise RuntimeError()
+        # the token and its outbox message rolled back with the caller
+        self.assertEqual(2, session.query(Token).count())
+        self.assertEqual(2, session.query(OutboxMessage).count())
+        async with async_unit_of_work() as uow:
+            await AsyncTokenHandler.generate_token(user.uid, ExchangeMethods.PHONE, session=uow)
+        self.assertEqual(3, session.query(Token).count())
+        self.assertEqual(3, session.query(OutboxMessage).count())
+        session.close()
+
+    async def test_tokens_live_in_the_configured_store(self):
+        store = MemoryTokenStore()
+        TokenHandler._store = AsyncTokenHandler._store = store
+        try:
+            user = await self.create_user()
+            session = DBInitializer.get_session()
+            self.assertEqual(0, session.query(Token).count())
+            session.close()
+            phone_token = store.latest(user.uid, ExchangeMethods.PHONE.value)
+            with self.assertRaises(AuthenticationException):
+                await AsyncTokenHandler.hexadecimal_token_validation(user.uid, 'wrong', ExchangeMethods.PHONE)
+            self.assertEqual(1, store.latest(user.uid, ExchangeMethods.PHONE.value).failed_attempts)
+            await AsyncUserHandler.verify_user_phone_by_hex_token(user.uid, phone_token.hex_token)
+            # the sync handler sees what the async one issued
+            email_token = store.latest(user.uid, ExchangeMethods.EMAIL.value)
+            self.assertEqual((user.uid, ExchangeMethods.EMAIL.value),
+                             TokenHandler.url_token_validation(email_token.url_token))
+        finally:
+            TokenHandler._store = AsyncTokenHandler._store = None
+        self.assertTrue((await AsyncUserHandler.get_user_by_id(user.uid)).is_phone_verified)
+
+    async def test_add_address(self):
+        user = await self.create_user()
+        address = Address(province='tehran', city='tehran', zip_code='1' * 10, postal_address='somewhere in tehran')
+        self.assertTrue(await AsyncAddressHandler.add_address(user.uid, address))
+        add = await AsyncAddressHandler.get_address_by_id(address.uid)
+        self.assertEqual(user.uid, add.user_id)
+        self.assertEqual(address.postal_address, add.postal_address)
+        with self.assertRaises(ValueException) as _ex:
+            await AsyncAddressHandler.add_address(12345, Address(province='tehran', city='tehran'))
+        self.assertEqual("there is no user with this id: 12345", str(_ex.exception))
@@ -1,8 +1,12 @@
+import os
 from unittest import TestCase
+from unittest.mock import Mock, patch
+
 from sqlalchemy.engine import Engine
 from sqlalchemy.orm.session import Session
 
-from domain.models import DBInitializer
+from core.exceptions import ValueException
+from domain.models import DBInitializer, DBConfig, session_scope
 
 
 class DBInitializerTest(TestCase):
@@ -17,3 +21,38 @@ class DBInitializerTest(TestCase):
         self.assertTrue(isinstance(session, Session))
         self.assertNotEqual(session, DBInitializer.get_session())
 
+    def test_session_scope_closes_session(self):
+        factory = Mock()
+        with session_scope(factory) as session:
+            self.assertEqual(factory(), session)
+        session.close.assert_called_once()
+        session.rollback.assert_not_called()
+
+    def test_session_scope_rolls_back_on_inner_exception(self):
+        factory = Mock()
+        with self.assertRaises(ValueException):
+            with session_scope(factory):
+                raise ValueException('failed unit of work')
+        factory().rollback.assert_called_once()
+        factory().close.assert_called_once()
+
+
+class DBConfigTest(TestCase):
+
+    def test_config_from_env(self):
+        env = {'NUMEN_DB_URL': 'postgresql://user:pass@db/NumenDB', 'NUMEN_DB_POOL_SIZE': '20',
+               'NUMEN_DB_MAX_OVERFLOW': '5', 'NUMEN_DB_POOL_RECYCLE': '600', 'NUMEN_DB_POOL_PRE_PING': 'false',
+               'NUMEN_DB_STATEMENT_TIMEOUT': '2500'}
+        with patch.dict(os.environ, env):
+            config = DBConfig.from_env()
+        kwargs = config.engine_kwargs()
+        self.assertEqual(20, kwargs['pool_size'])
+        self.assertEqual(5, kwargs['max_overflow'])
+        self.assertEqual(600, kwargs['pool_recycle'])
+        self.assertFalse(kwargs['pool_pre_ping'])
+        self.assertEqual({'options': '-c statement_timeout=2500'}, kwargs['connect_args'])
+
+    def test_sqlite_config_has_no_pool_sizing(self):
+        kwargs = DBConfig(url='sqlite:///numen_test.db', pool_size=20).engine_kwargs()
+        self.assertNotIn('pool_size', kwargs)
+        self.assertNotIn('max_overflow', kwargs)
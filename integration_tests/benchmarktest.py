@@ -0,0 +1,98 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy import create_engine, inspect
+
+from benchmarks import handlers, checkout, token_lookup
+from benchmarks.compare import compare, report
+from domain import migrations
+from domain.models import DBInitializer, db_Base as Base
+from handlers import UserHandler, OrderHandler
+from handlers.tokenhandler import TokenHandler
+
+
+class CompareTest(TestCase):
+
+    @staticmethod
+    def results(**cases):
+        return {'results': {name: {'p95_ms': p95, 'ops_per_sec': 1000 / p95} for name, p95 in cases.items()}}
+
+    def test_slower_case_is_a_regression(self):
+        regressions = compare(self.results(a=1.0, b=1.0), self.results(a=1.5, b=1.1), tolerance=0.2)
+        self.assertEqual(['a'], [r.case for r in regressions])
+        self.assertAlmostEqual(0.5, regressions[0].change)
+        self.assertIn('a', report(regressions))
+
+    def test_throughput_regresses_when_it_drops(self):
+        regressions = compare(self.results(a=1.0), self.results(a=2.0), metric='ops_per_sec')
+        self.assertEqual(['a'], [r.case for r in regressions])
+        self.assertFalse(compare(self.results(a=2.0), self.results(a=1.0), metric='ops_per_sec'))
+
+    def test_noise_and_new_cases_are_ignored(self):
+        # 100% slower but only 0.01ms apart
+        self.assertFalse(compare(self.results(a=0.01), self.results(a=0.02, new=5.0)))
+
+
+class HandlerBenchmarkTest(TestCase):
+
+    def test_run_measures_every_case_and_restores_the_handlers(self):
+        config, session, store = DBInitializer.get_config(), UserHandler._Session, TokenHandler._store
+        directory = tempfile.mkdtemp()
+        try:
+            results = handlers.run(f'sqlite:///{directory}/bench.db', scale=6, iterations=3, warmup=1,
+                                   hash_rounds=1000)
+        finally:
+            os.remove(os.path.join(directory, 'bench.db'))
+            os.rmdir(directory)
+        self.assertEqual(set(handlers.CASES), set(results['results']))
+        for stats in results['results'].values():
+            self.assertEqual(3, stats['count'])
+            self.assertLessEqual(stats['p50_ms'], stats['p99_ms'])
+        self.assertFalse(compare(results, results))
+        self.assertIs(config, DBInitializer.get_config())
+        self.assertIs(session, UserHandler._Session)
+        self.assertIs(store, TokenHandler._store)
+
+
+class CheckoutBenchmarkTest(TestCase):
+
+    def test_run_sells_exactly_the_stock(self):
+        config, session = DBInitializer.get_config(), OrderHandler._Session
+        directory = tempfile.mkdtemp()
+        try:
+            results = checkout.run(f'sqlite:///{directory}/bench.db', buyers=40, workers=4, stock=20)
+        finally:
+            os.remove(os.path.join(directory, 'bench.db'))
+            os.rmdir(directory)
+        meta = results['meta']
+        self.assertEqual((20, 20, 0), (meta['sold'], meta['refused'], meta['stock_left']))
+        self.assertTrue(meta['consistent'])
+        self.assertEqual(20, results['results']['checkout']['count'])
+        self.assertIs(config, DBInitializer.get_config())
+        self.assertIs(session, OrderHandler._Session)
+
+
+class TokenLookupBenchmarkTest(TestCase):
+
+    def test_only_the_token_indexes_are_dropped(self):
+        directory = tempfile.mkdtemp()
+        engine = create_engine(f'sqlite:///{directory}/bench.db')
+        try:
+            Base.metadata.create_all(bind=engine)
+            migrations.upgrade(engine)
+            token_lookup.token_indexes(engine, 'downgrade')
+            self.assertFalse([index['name'] for index in inspect(engine).get_indexes('tokens')
+                              if index['name'].startswith('ix_tokens_')])
+            # everything else, and the history, is still there
+            self.assertTrue(inspect(engine).get_indexes('orders'))
+            self.assertIn('outbox', inspect(engine).get_table_names())
+            self.assertEqual(migrations.MIGRATIONS[-1].revision, migrations.current_revision(engine))
+            token_lookup.token_indexes(engine, 'upgrade')
+            self.assertEqual({'ix_tokens_user_exchange_requested', 'ix_tokens_url_token', 'ix_tokens_time_limit'},
+                             {index['name'] for index in inspect(engine).get_indexes('tokens')
+                              if index['name'].startswith('ix_tokens_')})
+        finally:
+            engine.dispose()
+            os.remove(os.path.join(directory, 'bench.db'))
+            os.rmdir(directory)
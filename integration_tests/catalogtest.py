@@ -0,0 +1,81 @@
+from unittest import TestCase
+
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.orm import close_all_sessions
+
+from core.exceptions import ValueException
+from domain.models import DBInitializer, Product, Category, Collection
+from domain.models import db_Base as Base
+from domain.models.querybudget import query_budget, QueryBudgetExceeded
+from handlers.cataloghandler import CatalogHandler, LoadProfile
+
+
+class CatalogTest(TestCase):
+
+    @staticmethod
+    def setUpClass():
+        CatalogHandler._ReadSession = DBInitializer.get_read_session
+
+    def setUp(self) -> None:
+        Base.metadata.create_all(bind=DBInitializer.get_engine())
+        session = DBInitializer.get_session()
+        collection = Collection(title='summer')
+        session.add(collection)
+        for c in range(5):
+            category = Category(title=f'category {c}', description='long text')
+            session.add(category)
+            session.flush()
+            for p in range(4):
+                session.add(Product(title=f'product {c}.{p}', description='long description', price=p, discount=0,
+                                    category_id=category.uid, collection_id=collection.uid))
+        session.commit()
+        self.collection_id = collection.uid
+        session.close()
+
+    def tearDown(self) -> None:
+        close_all_sessions()
+        Base.metadata.drop_all(bind=DBInitializer.get_new_engine())
+
+    def test_lazy_walk_is_caught(self):
+        session = DBInitializer.get_session()
+        try:
+            with self.assertRaises(QueryBudgetExceeded):
+                with query_budget(2):
+                    for category in session.query(Category).all():
+                        len(category.products)
+        finally:
+            session.close()
+
+    def test_category_page_loads_products_in_one_query(self):
+        with query_budget(2):
+            categories = CatalogHandler.list_categories(LoadProfile.CATEGORY_PAGE)
+        self.assertEqual(5, len(categories))
+        self.assertEqual(['product 0.0', 'product 0.1', 'product 0.2', 'product 0.3'],
+                         sorted(p.title for p in categories[0].products))
+        with query_budget(2):
+            category = CatalogHandler.get_category(categories[1].uid)
+        self.assertEqual(4, len(category.products))
+
+    def test_collection_grid(self):
+        with query_budget(2):
+            collection = CatalogHandler.get_collection(self.collection_id)
+        self.assertEqual(20, len(collection.products))
+
+    def test_navigation_leaves_products_out(self):
+        with query_budget(1):
+            categories = CatalogHandler.list_categories()
+        self.assertEqual('category 0', categories[0].title)
+        with self.assertRaises(InvalidRequestError):
+            categories[0].products
+
+    def test_product_detail_in_one_query(self):
+        with query_budget(1):
+            product = CatalogHandler.get_product(1)
+        self.assertEqual('category 0', product.categories.title)
+        self.assertEqual('summer', product.collections.title)
+
+    def test_profile_for_another_entity_raise_exception(self):
+        with self.assertRaises(ValueException):
+            CatalogHandler.list_categories(LoadProfile.COLLECTION_GRID)
+        with self.assertRaises(ValueException):
+            CatalogHandler.get_category(999)
@@ -7,6 +7,8 @@ from handlers.tokenhandler import TokenHandler
 
 def reset_user_handler_injection():
     UserHandler._Session = DBInitializer.get_session
+    UserHandler._ReadSession = DBInitializer.get_read_session
+    UserHandler._router = DBInitializer.get_router
     UserHandler._user_validation = user_validation
     UserHandler._email_validation = email_validation
     UserHandler._hashing = passwordservice.hashing_password
@@ -17,9 +19,11 @@ def reset_user_handler_injection():
 
 def reset_address_handler_injection():
     AddressHandler._Session = DBInitializer.get_session
+    AddressHandler._ReadSession = DBInitializer.get_read_session
     AddressHandler._address_validation = address_validation
 
 
 def reset_token_handler_injection():
     TokenHandler._Session = DBInitializer.get_session
     TokenHandler._get_user = UserHandler.get_user_by_id
+    TokenHandler._store = None
@@ -0,0 +1,59 @@
+import shutil
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy.orm import close_all_sessions
+
+from core.exceptions import ValueException, TypeException
+from domain.models import DBInitializer, Product, Category, User
+from domain.models import db_Base as Base
+from handlers import ImageHandler, ProductHandler
+from handlers.imagestore import ImageStore, ImagePipeline, image_url
+from handlers.tests.image_store_test import FakeResize, png
+
+
+class ImageTest(TestCase):
+
+    def setUp(self) -> None:
+        Base.metadata.create_all(bind=DBInitializer.get_engine())
+        self.root = tempfile.mkdtemp()
+        ImageHandler._Session = DBInitializer.get_session
+        ImageHandler._pipeline = ImagePipeline(ImageStore(self.root), resize=FakeResize())
+        ProductHandler._ReadSession = DBInitializer.get_read_session
+        session = DBInitializer.get_session()
+        self.product = Product(title='scarf', description='-', price=10, discount=0)
+        self.category = Category(title='hats')
+        session.add_all([self.product, self.category])
+        session.commit()
+        session.close()
+
+    def tearDown(self) -> None:
+        ImageHandler._pipeline.close()
+        ImageHandler._pipeline = None
+        shutil.rmtree(self.root)
+        close_all_sessions()
+        Base.metadata.drop_all(bind=DBInitializer.get_new_engine())
+
+    def test_manifest_and_grid_thumbnail(self):
+        manifest = ImageHandler.add_images(Product, self.product.uid, [png(b'front'), png(b'back')])
+        self.assertEqual(2, len(manifest))
+        manifest = ImageHandler.add_images(Product, self.product.uid, [png(b'side')])
+        self.assertEqual(3, len(manifest))
+        summary = ProductHandler.list_products(limit=1).items[0]
+        self.assertEqual(manifest, summary.images)
+        self.assertEqual(image_url(manifest[0]['variants']['thumb']), summary.thumbnail)
+
+        self.assertTrue(ImageHandler.remove_image(Product, self.product.uid, manifest[0]['digest']))
+        self.assertFalse(ImageHandler.remove_image(Product, self.product.uid, manifest[0]['digest']))
+        self.assertEqual(manifest[1:], ProductHandler.get_product(self.product.uid).Images)
+
+    def test_categories_share_the_store(self):
+        product = ImageHandler.add_images(Product, self.product.uid, [png(b'same')])
+        category = ImageHandler.add_images(Category, self.category.uid, [png(b'same')])
+        self.assertEqual(product, category)
+
+    def test_unknown_targets(self):
+        with self.assertRaises(ValueException):
+            ImageHandler.add_images(Product, 999, [png(b'a')])
+        with self.assertRaises(TypeException):
+            ImageHandler.add_images(User, 1, [png(b'a')])
@@ -0,0 +1,93 @@
+from decimal import Decimal
+from unittest import TestCase
+
+from sqlalchemy import inspect, text, Float
+
+from core.exceptions import ValueException
+from domain import migrations
+from domain.migrations.runner import schema_migrations
+from domain.models import DBInitializer, Category
+from domain.models import db_Base as Base
+from domain.models.pricing import to_decimal
+
+TOKEN_INDEXES = {'ix_tokens_user_exchange_requested', 'ix_tokens_url_token', 'ix_tokens_time_limit'}
+
+
+class MigrationTest(TestCase):
+
+    def setUp(self) -> None:
+        self.engine = DBInitializer.get_engine()
+        Base.metadata.create_all(bind=self.engine)
+        # start from a pre-index schema, as an existing deployment would
+        with self.engine.begin() as connection:
+            for index in TOKEN_INDEXES:
+                connection.execute(text(f'DROP INDEX IF EXISTS {index}'))
+        schema_migrations.drop(bind=self.engine, checkfirst=True)
+
+    def tearDown(self) -> None:
+        schema_migrations.drop(bind=self.engine, checkfirst=True)
+        Base.metadata.drop_all(bind=self.engine)
+
+    def token_indexes(self) -> set:
+        return {index['name'] for index in inspect(self.engine).get_indexes('tokens')}
+
+    def test_upgrade_and_downgrade(self):
+        self.assertIsNone(migrations.current_revision(self.engine))
+        self.assertEqual(set(), self.token_indexes() & TOKEN_INDEXES)
+
+        self.assertEqual(['0001'], migrations.upgrade(self.engine, '0001'))
+        self.assertEqual('0001', migrations.current_revision(self.engine))
+        self.assertEqual(['0002', '0003', '0004', '0005', '0006', '0007', '0008', '0009'],
+                         migrations.upgrade(self.engine))
+        self.assertEqual('0009', migrations.current_revision(self.engine))
+        self.assertTrue(TOKEN_INDEXES <= self.token_indexes())
+        # applying again is a no-op
+        self.assertEqual([], migrations.upgrade(self.engine))
+
+        self.assertEqual(['0009', '0008', '0007', '0006', '0005', '0004', '0003', '0002'],
+                         migrations.downgrade(self.engine, '0001'))
+        self.assertNotIn('stock', {column['name'] for column in inspect(self.engine).get_columns('products')})
+        self.assertIn('ix_tokens_url_token', self.token_indexes())
+        self.assertEqual(['0001'], migrations.downgrade(self.engine, 'base'))
+        self.assertIsNone(migrations.current_revision(self.engine))
+        self.assertEqual(set(), self.token_indexes() & TOKEN_INDEXES)
+
+    def test_effective_price_is_backfilled(self):
+        with self.engine.begin() as connection:
+            connection.execute(text("INSERT INTO products (title, description, price, discount, stock, "
+                                    "effective_price) VALUES ('a', '-', 10.1, 0.2, 0, 0), ('b', '-', 1, 5, 0, 0)"))
+        migrations.upgrade(self.engine)
+        with self.engine.connect() as connection:
+            prices = connection.execute(text('SELECT effective_price FROM products ORDER BY uid')).scalars().all()
+        self.assertEqual([Decimal('9.90'), Decimal('0.00')], [to_decimal(price) for price in prices])
+        indexes = {index['name'] for index in inspect(self.engine).get_indexes('products')}
+        self.assertIn('ix_products_category_effective_price', indexes)
+        self.assertNotIn('ix_products_category_price', indexes)
+
+    def test_free_text_images_become_manifests(self):
+        with self.engine.begin() as connection:
+            connection.execute(text("INSERT INTO categories (title, images) VALUES ('a', 'http://cdn/a.png'), "
+                                    "('b', ''), ('c', NULL)"))
+        migrations.upgrade(self.engine)
+        session = DBInitializer.get_session()
+        try:
+            self.assertEqual([[{'url': 'http://cdn/a.png'}], None, None],
+                             [c.images for c in session.query(Category).order_by(Category.uid)])
+        finally:
+            session.close()
+
+    def test_orders_are_created_as_of_their_revision(self):
+        for table in ('order_lines', 'orders', 'cart_items', 'carts'):
+            Base.metadata.tables[table].drop(bind=self.engine)
+        migrations.upgrade(self.engine, '0005')
+        types = {column['name']: column['type'] for column in inspect(self.engine).get_columns('orders')}
+        # the model has an exact price now, 0005 still makes what it made then
+        self.assertIsInstance(types['total'], Float)
+        migrations.upgrade(self.engine)
+        types = {column['name']: column['type'] for column in inspect(self.engine).get_columns('orders')}
+        self.assertEqual(self.engine.dialect.name != 'postgresql', isinstance(types['total'], Float))
+
+    def test_unknown_target_raise_exception(self):
+        with self.assertRaises(ValueException) as _ex:
+            migrations.upgrade(self.engine, '9999')
+        self.assertEqual('Unknown migration revision: 9999', str(_ex.exception))
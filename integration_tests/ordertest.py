@@ -0,0 +1,138 @@
+import threading
+from unittest import TestCase
+
+from sqlalchemy import insert, select
+from sqlalchemy.orm import close_all_sessions
+
+from core.exceptions import ValueException, OutOfStockException
+from domain.models import DBInitializer, Product, User, Order
+from domain.models import db_Base as Base
+from domain.models.order import OrderState
+from handlers import OrderHandler, ProductHandler
+
+
+class OrderTest(TestCase):
+
+    @staticmethod
+    def setUpClass():
+        OrderHandler._Session = ProductHandler._Session = DBInitializer.get_session
+        OrderHandler._ReadSession = DBInitializer.get_read_session
+
+    def setUp(self) -> None:
+        Base.metadata.create_all(bind=DBInitializer.get_engine())
+        with DBInitializer.get_engine().begin() as connection:
+            connection.execute(insert(User), [{'uid': uid, 'password': '-', 'state': 1} for uid in range(1, 11)])
+        session = DBInitializer.get_session()
+        self.hot, self.other = Product(title='hot', description='-', price=10, discount=2, stock=5), \
+            Product(title='other', description='-', price=3, discount=0, stock=100)
+        session.add_all([self.hot, self.other])
+        session.commit()
+        session.close()
+
+    def tearDown(self) -> None:
+        close_all_sessions()
+        Base.metadata.drop_all(bind=DBInitializer.get_new_engine())
+
+    def stock(self, product: Product) -> int:
+        with DBInitializer.get_engine().connect() as connection:
+            return connection.execute(select(Product.stock).where(Product.uid == product.uid)).scalar()
+
+    def test_cart(self):
+        self.assertEqual(1, OrderHandler.add_to_cart(1, self.hot.uid))
+        self.assertEqual(3, OrderHandler.add_to_cart(1, self.hot.uid, 2))
+        OrderHandler.add_to_cart(1, self.other.uid)
+        self.assertEqual([(self.hot.uid, 3), (self.other.uid, 1)], OrderHandler.get_cart(1))
+        self.assertTrue(OrderHandler.remove_from_cart(1, self.other.uid))
+        self.assertFalse(OrderHandler.remove_from_cart(2, self.hot.uid))
+        self.assertEqual([(self.hot.uid, 3)], OrderHandler.get_cart(1))
+        with self.assertRaises(ValueException):
+            OrderHandler.add_to_cart(1, 999)
+
+    def test_checkout(self):
+        OrderHandler.add_to_cart(1, self.hot.uid, 2)
+        OrderHandler.add_to_cart(1, self.other.uid, 3)
+        order = OrderHandler.checkout(1)
+        self.assertEqual(OrderState.PLACED.value, order.state)
+        self.assertEqual(2 * 8 + 3 * 3, order.total)
+        self.assertEqual([(self.hot.uid, 2, 8), (self.other.uid, 3, 3)],
+                         [(line.product_id, line.quantity, line.unit_price) for line in
+                          OrderHandler.get_order(order.uid).lines])
+        self.assertEqual((3, 97), (self.stock(self.hot), self.stock(self.other)))
+        self.assertEqual([], OrderHandler.get_cart(1))
+        with self.assertRaises(ValueException):
+            OrderHandler.checkout(1)
+
+    def test_short_stock_changes_nothing(self):
+        OrderHandler.add_to_cart(1, self.other.uid, 1)
+        OrderHandler.add_to_cart(1, self.hot.uid, 6)
+        with self.assertRaises(OutOfStockException) as context:
+            OrderHandler.checkout(1)
+        self.assertEqual([self.hot.uid], context.exception.product_ids)
+        self.assertEqual((5, 100), (self.stock(self.hot), self.stock(self.other)))
+        self.assertEqual(2, len(OrderHandler.get_cart(1)))
+        session = DBInitializer.get_session()
+        self.assertEqual(0, session.query(Order).count())
+        session.close()
+
+    def test_cancel_restocks_once(self):
+        OrderHandler.add_to_cart(1, self.hot.uid, 5)
+        order = OrderHandler.checkout(1)
+        self.assertEqual(0, self.stock(self.hot))
+        self.assertTrue(OrderHandler.cancel_order(order.uid))
+        self.assertFalse(OrderHandler.cancel_order(order.uid))
+        self.assertEqual(5, self.stock(self.hot))
+        with self.assertRaises(ValueException):
+            OrderHandler.cancel_order(999)
+
+    def test_add_stock(self):
+        self.assertEqual(8, ProductHandler.add_stock(self.hot.uid, 3))
+        with self.assertRaises(ValueException):
+            ProductHandler.add_stock(999, 1)
+
+    def test_concurrent_adds_all_count(self):
+        threads = [threading.Thread(target=OrderHandler.add_to_cart, args=(1, self.other.uid)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([(self.other.uid, 8)], OrderHandler.get_cart(1))
+
+    def test_cart_is_checked_out_once(self):
+        OrderHandler.add_to_cart(1, self.other.uid, 2)
+        outcomes = []
+
+        def checkout():
+            try:
+                OrderHandler.checkout(1)
+                outcomes.append('placed')
+            except ValueException:
+                outcomes.append('refused')
+
+        threads = [threading.Thread(target=checkout) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(['placed', 'refused', 'refused', 'refused'], sorted(outcomes))
+        self.assertEqual(98, self.stock(self.other))
+
+    def test_concurrent_checkouts_never_oversell(self):
+        for uid in range(1, 11):
+            OrderHandler.add_to_cart(uid, self.hot.uid)
+        outcomes = []
+
+        def checkout(uid):
+            try:
+                OrderHandler.checkout(uid)
+                outcomes.append('sold')
+            except OutOfStockException:
+                outcomes.append('out of stock')
+
+        threads = [threading.Thread(target=checkout, args=(uid,)) for uid in range(1, 11)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(5, outcomes.count('sold'))
+        self.assertEqual(5, outcomes.count('out of stock'))
+        self.assertEqual(0, self.stock(self.hot))
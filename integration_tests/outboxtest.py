@@ -0,0 +1,189 @@
+import time
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from sqlalchemy import insert
+from sqlalchemy.orm import close_all_sessions
+
+from domain.models import DBInitializer, User, Token, OutboxMessage, unit_of_work
+from domain.models import db_Base as Base
+from domain.models.outbox import OutboxState
+from domain.models.token import ExchangeMethods
+from handlers import UserHandler
+from handlers.outbox import OutboxDispatcher, SmtpProvider, HttpSmsProvider
+from handlers.tests.sinks import SmtpSink, SmsSink
+from handlers.tokenhandler import TokenHandler
+from integration_tests.helper import reset_user_handler_injection, reset_token_handler_injection
+
+
+class Clock:
+    def __init__(self):
+        self.now = datetime(2024, 1, 1)
+
+    def __call__(self) -> datetime:
+        return self.now
+
+
+class OutboxTest(TestCase):
+
+    @staticmethod
+    def setUpClass():
+        reset_user_handler_injection()
+        reset_token_handler_injection()
+
+    def setUp(self) -> None:
+        Base.metadata.create_all(bind=DBInitializer.get_engine())
+        self.smtp, self.sms = SmtpSink().start(), SmsSink().start()
+        self.providers = [SmtpProvider('127.0.0.1', self.smtp.port),
+                          HttpSmsProvider(f'http://127.0.0.1:{self.sms.port}/send')]
+
+    def tearDown(self) -> None:
+        self.smtp.stop()
+        self.sms.stop()
+        close_all_sessions()
+        Base.metadata.drop_all(bind=DBInitializer.get_new_engine())
+
+    @staticmethod
+    def create_user() -> int:
+        return UserHandler.create_user(User(password='Pa$$w0rd', first_name='first name', last_name='last name',
+                                            phone='9121234567', email='email@domain.tld'))
+
+    @staticmethod
+    def messages() -> list:
+        session = DBInitializer.get_session()
+        try:
+            return session.query(OutboxMessage).order_by(OutboxMessage.uid).all()
+        finally:
+            session.close()
+
+    def add_messages(self, count: int, channel: str = 'email'):
+        with DBInitializer.get_engine().begin() as connection:
+            connection.execute(insert(OutboxMessage), [
+                {'channel': channel, 'recipient': f'user{i}@domain.tld', 'subject': 'hi', 'body': f'message {i}',
+                 'next_attempt_time': datetime(2024, 1, 1)} for i in range(count)])
+
+    def test_signup_queues_its_messages_and_the_dispatcher_sends_them(self):
+        self.create_user()
+        self.assertEqual([('email', 'email@domain.tld'), ('sms', '9121234567')],
+                         [(m.channel, m.recipient) for m in self.messages()])
+        self.assertEqual([], self.smtp.received)
+
+        dispatcher = OutboxDispatcher(self.providers)
+        self.assertEqual(2, dispatcher.run_once())
+        session = DBInitializer.get_session()
+        email_token = session.query(Token).filter_by(exchange_method=ExchangeMethods.EMAIL.value).one()
+        phone_token = session.query(Token).filter_by(exchange_method=ExchangeMethods.PHONE.value).one()
+        session.close()
+        self.assertIn(email_token.hex_token, self.smtp.received[0].get_payload())
+        self.assertIn(email_token.url_token, self.smtp.received[0].get_payload())
+        self.assertEqual([{'to': '9121234567', 'text': f'Your verification code: {phone_token.hex_token}'}],
+                         self.sms.received)
+        self.assertTrue(all(m.state == OutboxState.SENT.value and m.claim is None for m in self.messages()))
+        # nothing is sent twice
+        self.assertEqual(0, dispatcher.run_once())
+
+    def test_token_and_message_share_the_transaction(self):
+        user_id = self.create_user()
+        session = DBInitializer.get_session()
+        session.query(Token).delete()
+        session.query(OutboxMessage).delete()
+        session.commit()
+        session.close()
+        with self.assertRaises(RuntimeError):
+            with unit_of_work() as session:
+                TokenHandler.generate_token(user_id, ExchangeMethods.EMAIL, session=session)
+                raise RuntimeError('rolled back')
+        self.assertEqual([], self.messages())
+        with unit_of_work() as session:
+            TokenHandler.generate_token(user_id, ExchangeMethods.EMAIL, session=session)
+        self.assertEqual(['email'], [m.channel for m in self.messages()])
+
+    def test_bulk_import_queues_a_message_per_token(self):
+        UserHandler.bulk_create_users([{'password': 'Pa$$w0rd', 'first_name': 'first', 'last_name': 'last',
+                                        'email': f'user{i}@domain.tld'} for i in range(3)])
+        self.assertEqual(['user0@domain.tld', 'user1@domain.tld', 'user2@domain.tld'],
+                         [m.recipient for m in self.messages()])
+
+    def test_failed_delivery_is_retried_with_backoff(self):
+        clock = Clock()
+        self.add_messages(1)
+        self.smtp.reject = 1
+        dispatcher = OutboxDispatcher(self.providers, base_delay=10, jitter=0, clock=clock)
+        dispatcher.run_once()
+        message, = self.messages()
+        self.assertEqual((OutboxState.PENDING.value, 1), (message.state, message.attempts))
+        self.assertEqual(clock.now + timedelta(seconds=10), message.next_attempt_time)
+        self.assertIn('451', message.last_error)
+        # not due yet
+        self.assertEqual(0, dispatcher.run_once())
+        clock.now += timedelta(seconds=10)
+        self.assertEqual(1, dispatcher.run_once())
+        self.assertEqual(OutboxState.SENT.value, self.messages()[0].state)
+        self.assertEqual(['user0@domain.tld'], [m['To'] for m in self.smtp.received])
+
+    def test_message_is_given_up_after_max_attempts(self):
+        clock = Clock()
+        self.add_messages(1, 'sms')
+        self.sms.reject = 3
+        dispatcher = OutboxDispatcher(self.providers, max_attempts=3, base_delay=1, jitter=0, clock=clock)
+        for _ in range(4):
+            dispatcher.run_once()
+            clock.now += timedelta(minutes=1)
+        message, = self.messages()
+        self.assertEqual((OutboxState.FAILED.value, 3), (message.state, message.attempts))
+        self.assertEqual((0, 2, 1), (dispatcher.stats.sent, dispatcher.stats.retried, dispatcher.stats.failed))
+        self.assertEqual([], self.sms.received)
+
+    def test_abandoned_claim_is_taken_again_after_the_lease(self):
+        clock = Clock()
+        self.add_messages(1)
+        dispatcher = OutboxDispatcher(self.providers, lease=30, clock=clock)
+        # a dispatcher that died after claiming
+        self.assertEqual(1, len(dispatcher.claim('email')))
+        self.assertEqual([], dispatcher.claim('email'))
+        clock.now += timedelta(seconds=30)
+        self.assertEqual(1, dispatcher.run_once())
+        self.assertEqual(2, self.messages()[0].attempts)
+
+    def test_outcome_of_an_expired_claim_is_not_recorded(self):
+        clock = Clock()
+        self.add_messages(1)
+        dispatcher = OutboxDispatcher(self.providers, lease=30, jitter=0, clock=clock)
+        stale, = dispatcher.claim('email')
+        clock.now += timedelta(seconds=30)
+        fresh, = dispatcher.claim('email')
+        # the first dispatcher finally reports back, the message belongs to the second claim now
+        dispatcher.record([stale], [None])
+        dispatcher.record([stale], ['451 try again later'])
+        message, = self.messages()
+        self.assertEqual((OutboxState.PENDING.value, fresh.claim, None),
+                         (message.state, message.claim, message.last_error))
+        self.assertEqual((0, 0, 0), (dispatcher.stats.sent, dispatcher.stats.retried, dispatcher.stats.failed))
+        dispatcher.record([fresh], [None])
+        self.assertEqual((OutboxState.SENT.value, None), (self.messages()[0].state, self.messages()[0].claim))
+        self.assertEqual(1, dispatcher.stats.sent)
+
+    def test_concurrency_limit_per_provider(self):
+        self.add_messages(12)
+        self.smtp.delay = 0.02
+        dispatcher = OutboxDispatcher(self.providers, batch_size=2, workers=8, concurrency=2)
+        self.assertEqual(12, dispatcher.run_once())
+        self.assertEqual(2, self.smtp.max_connections)
+        self.assertEqual(sorted(f'user{i}@domain.tld' for i in range(12)),
+                         sorted(m['To'] for m in self.smtp.received))
+
+    def test_slow_provider_does_not_slow_down_signup(self):
+        self.smtp.delay = 1.0
+        dispatcher = OutboxDispatcher(self.providers)
+        dispatcher.start(interval=0.05)
+        try:
+            start = time.perf_counter()
+            self.create_user()
+            self.assertLess(time.perf_counter() - start, 0.5)
+            deadline = time.monotonic() + 10
+            while len(self.smtp.received) < 1 and time.monotonic() < deadline:
+                time.sleep(0.05)
+        finally:
+            dispatcher.stop()
+        self.assertEqual(1, len(self.smtp.received))
+        self.assertEqual(1, len(self.sms.received))
@@ -0,0 +1,141 @@
+from decimal import Decimal
+from unittest import TestCase
+
+from sqlalchemy import update
+from sqlalchemy.orm import close_all_sessions
+
+from core.exceptions import ValueException
+
+from domain.models import DBInitializer, Product, Category, Collection
+from domain.models import db_Base as Base
+from domain.models.pricing import effective_price, to_decimal
+from handlers import ProductHandler
+from handlers.producthandler import ProductSort
+from handlers.productsearch import MemorySearchIndex
+
+
+class ProductTest(TestCase):
+
+    @staticmethod
+    def setUpClass():
+        ProductHandler._Session = DBInitializer.get_session
+        ProductHandler._ReadSession = DBInitializer.get_read_session
+
+    def setUp(self) -> None:
+        Base.metadata.create_all(bind=DBInitializer.get_engine())
+        ProductHandler._search_index = MemorySearchIndex(DBInitializer.get_session)
+        session = DBInitializer.get_session()
+        self.category, other = Category(title='shoes'), Category(title='hats')
+        self.collection = Collection(title='summer')
+        session.add_all([self.category, other, self.collection])
+        session.flush()
+        # repeated prices make the uid tie breaker matter
+        for i in range(25):
+            session.add(Product(title=f'product {i}', description='long description ' * 50, price=float(i % 7),
+                                discount=0, category_id=(self.category if i % 3 else other).uid,
+                                collection_id=self.collection.uid if i % 2 else None))
+        session.commit()
+        session.close()
+
+    def tearDown(self) -> None:
+        close_all_sessions()
+        Base.metadata.drop_all(bind=DBInitializer.get_new_engine())
+
+    def walk(self, **kwargs) -> list:
+        items, cursor = [], None
+        while True:
+            page = ProductHandler.list_products(limit=4, cursor=cursor, **kwargs)
+            self.assertLessEqual(len(page.items), 4)
+            items.extend(page.items)
+            cursor = page.next_cursor
+            if cursor is None:
+                return items
+
+    def all_products(self) -> list:
+        session = DBInitializer.get_session()
+        try:
+            return session.query(Product).all()
+        finally:
+            session.close()
+
+    def test_pages_cover_the_listing_in_order(self):
+        products = self.all_products()
+        newest = self.walk()
+        self.assertEqual(sorted((p.uid for p in products), reverse=True), [p.uid for p in newest])
+
+        cheapest = self.walk(sort=ProductSort.PRICE_ASC)
+        self.assertEqual(sorted((p.price, p.uid) for p in products), [(p.price, p.uid) for p in cheapest])
+
+        dearest = self.walk(sort=ProductSort.PRICE_DESC)
+        self.assertEqual(sorted(((p.price, p.uid) for p in products), reverse=True),
+                         [(p.price, p.uid) for p in dearest])
+
+    def test_filters(self):
+        products = self.all_products()
+        listed = self.walk(category_id=self.category.uid, min_price=2, max_price=5, sort=ProductSort.PRICE_ASC)
+        expected = sorted((p.price, p.uid) for p in products
+                          if p.category_id == self.category.uid and 2 <= p.price <= 5)
+        self.assertEqual(expected, [(p.price, p.uid) for p in listed])
+
+        listed = self.walk(collection_id=self.collection.uid)
+        self.assertEqual(sorted((p.uid for p in products if p.collection_id), reverse=True),
+                         [p.uid for p in listed])
+
+    def test_description_only_when_asked(self):
+        page = ProductHandler.list_products(limit=1)
+        self.assertIsNone(page.items[0].description)
+        page = ProductHandler.list_products(limit=1, with_description=True)
+        self.assertTrue(page.items[0].description.startswith('long description'))
+        self.assertEqual(page.items[0].title, ProductHandler.get_product(page.items[0].uid).title)
+
+    def test_search_follows_product_writes(self):
+        self.assertEqual(['product 13'], [p.title for p in ProductHandler.search('product 13')])
+        uid = ProductHandler.create_product(Product(title='Wool scarf', description='warm', price=9, discount=0))
+        self.assertEqual([uid], [p.uid for p in ProductHandler.search('woo')])
+        ProductHandler.update_product(uid, title='Silk scarf')
+        self.assertEqual([], ProductHandler.search('wool'))
+        self.assertEqual([uid], [p.uid for p in ProductHandler.search('scarf silk', with_description=True)])
+        self.assertTrue(ProductHandler.delete_product(uid))
+        self.assertEqual([], ProductHandler.search('scarf'))
+        # title hits rank above description hits
+        ProductHandler.create_product(Product(title='Gift card', description='for a scarf', price=1, discount=0))
+        ProductHandler.create_product(Product(title='Long scarf', description='soft', price=1, discount=0))
+        self.assertEqual(['Long scarf', 'Gift card'], [p.title for p in ProductHandler.search('scarf')])
+
+    def test_effective_price_follows_writes(self):
+        uid = ProductHandler.create_product(Product(title='scarf', description='-', price=10.1, discount=0.2))
+        self.assertEqual(Decimal('9.90'), ProductHandler.get_product(uid).effective_price)
+        ProductHandler.update_product(uid, discount=0.3)
+        self.assertEqual(Decimal('9.80'), ProductHandler.get_product(uid).effective_price)
+
+    def test_listing_sorts_by_effective_price(self):
+        # the dearest list price, discounted below every other product that isn't free
+        uid = ProductHandler.create_product(Product(title='sale', description='-', price=100, discount=99.5))
+        cheapest = ProductHandler.list_products(sort=ProductSort.PRICE_ASC, min_price=0.01, limit=1).items[0]
+        self.assertEqual((uid, Decimal('0.50')), (cheapest.uid, cheapest.effective_price))
+        self.assertEqual([uid], [p.uid for p in self.walk(min_price=0.5, max_price=0.5)])
+
+    def test_discount_campaign(self):
+        self.assertEqual(8, ProductHandler.apply_discount(25, category_id=self.category.uid,
+                                                          collection_id=self.collection.uid))
+        for p in self.all_products():
+            campaign = p.category_id == self.category.uid and p.collection_id == self.collection.uid
+            self.assertEqual(to_decimal(p.price * 0.75 if campaign else p.price), p.effective_price)
+            self.assertEqual(to_decimal(p.price * 0.25 if campaign else 0), to_decimal(p.discount))
+        # pages cut across the new prices stay in order
+        cheapest = self.walk(sort=ProductSort.PRICE_ASC)
+        self.assertEqual(sorted((p.effective_price, p.uid) for p in self.all_products()),
+                         [(p.effective_price, p.uid) for p in cheapest])
+        ProductHandler.apply_discount(0)
+        self.assertTrue(all(p.effective_price == to_decimal(p.price) for p in self.all_products()))
+        with self.assertRaises(ValueException):
+            ProductHandler.apply_discount(101)
+
+    def test_recompute_effective_prices(self):
+        with DBInitializer.get_engine().begin() as connection:
+            # around the handlers, the stored effective prices stay as they were; uid 1 is free already
+            connection.execute(update(Product).where(Product.uid <= 4).values(discount=1))
+        self.assertEqual(3, ProductHandler.recompute_effective_prices())
+        self.assertEqual(0, ProductHandler.recompute_effective_prices())
+        for p in self.all_products():
+            self.assertEqual(effective_price(p.price, p.discount), p.effective_price)
@@ -0,0 +1,79 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy.orm import Session, close_all_sessions
+
+from domain.models import User, DBConfig, DBInitializer, db_Base as Base, read_your_writes_scope
+from domain.models.querybudget import count_queries
+from handlers import UserHandler
+from handlers.usercache import UserCache, UserSnapshot, user_cache
+from integration_tests.helper import reset_user_handler_injection, reset_token_handler_injection
+
+
+class ReplicaTest(TestCase):
+    """Two sqlite files, the replica is never written to: a row only it has proves a read went there."""
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.previous = DBInitializer.get_config()
+        DBInitializer.configure(DBConfig(url=f'sqlite:///{self.directory}/primary.db',
+                                         replica_urls=[f'sqlite:///{self.directory}/replica.db']))
+        self.replica = DBInitializer.get_router().replicas[0]
+        Base.metadata.create_all(bind=DBInitializer.get_engine())
+        Base.metadata.create_all(bind=self.replica)
+        reset_user_handler_injection()
+        reset_token_handler_injection()
+        UserHandler._cache = UserCache()
+
+    def tearDown(self) -> None:
+        close_all_sessions()
+        DBInitializer.configure(self.previous)
+        UserHandler._cache = user_cache
+        for name in ('primary.db', 'replica.db'):
+            os.remove(os.path.join(self.directory, name))
+        os.rmdir(self.directory)
+
+    def replica_user(self) -> int:
+        with Session(bind=self.replica) as session:
+            user = User(first_name='replica', password='hash', email='replica@domain.tld', state=1)
+            session.add(user)
+            session.commit()
+            return user.uid
+
+    def test_reads_go_to_the_replica(self):
+        uid = self.replica_user()
+        with read_your_writes_scope():
+            self.assertEqual('replica', UserHandler.get_user_by_id(uid).first_name)
+
+    def test_replica_reads_are_not_cached(self):
+        uid = self.replica_user()
+        UserHandler.get_user_by_id(uid)
+        self.assertIsNone(UserHandler._cache.get(uid=uid))
+
+    def test_pinned_reads_skip_the_cache(self):
+        with read_your_writes_scope():
+            uid = UserHandler.create_user(User(first_name='first name', last_name='last name',
+                                               email='email@domain.tld', password='Password123'))
+            # what a lagging replica showed another request after the invalidation
+            stale = User(uid=uid, first_name='stale', email='email@domain.tld', password='hash', state=1)
+            UserHandler._cache.put(UserSnapshot.from_user(stale), UserHandler._cache.generation)
+            self.assertEqual('first name', UserHandler.get_user_by_id(uid).first_name)
+            self.assertEqual('first name', UserHandler.get_user_by_email('email@domain.tld').first_name)
+
+    def test_reads_after_a_write_go_to_the_primary(self):
+        with read_your_writes_scope():
+            uid = UserHandler.create_user(User(first_name='first name', last_name='last name',
+                                               email='email@domain.tld', password='Password123'))
+            self.assertEqual('first name', UserHandler.get_user_by_id(uid).first_name)
+            self.assertTrue(UserHandler.is_email_registered('email@domain.tld'))
+        # a later request reads the replica again, the row has not reached it
+        with read_your_writes_scope():
+            self.assertFalse(UserHandler.is_email_registered('email@domain.tld'))
+
+    def test_queries_on_the_replica_are_counted(self):
+        uid = self.replica_user()
+        with count_queries() as counter:
+            with read_your_writes_scope():
+                UserHandler.get_user_by_id(uid)
+        self.assertEqual(1, counter.count)
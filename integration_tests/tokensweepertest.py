@@ -0,0 +1,93 @@
+import time
+from datetime import datetime, timedelta
+from unittest import TestCase
+from unittest.mock import Mock
+
+from sqlalchemy import select, func
+from sqlalchemy.orm import close_all_sessions
+
+from domain.models import DBInitializer, User, Token
+from domain.models import db_Base as Base
+from domain.models.token import ExchangeMethods
+from handlers.tokenhandler import token_values
+from handlers.tokensweeper import TokenSweeper, archive_table, archive_tables, drop_archives_before
+
+
+class TokenSweeperTest(TestCase):
+
+    def setUp(self) -> None:
+        self.engine = DBInitializer.get_engine()
+        Base.metadata.create_all(bind=self.engine)
+        session = DBInitializer.get_session()
+        user = User(first_name='first name', last_name='last name', password='-', phone='9121234567')
+        session.add(user)
+        session.flush()
+        now = datetime.utcnow()
+        # 25 tokens expired in two different months, 5 still valid
+        for days in range(25):
+            when = datetime(2024, 1 if days < 15 else 2, 1 + days % 15)
+            session.add(Token(**token_values(user.uid, ExchangeMethods.PHONE, when)))
+        for _ in range(5):
+            session.add(Token(**token_values(user.uid, ExchangeMethods.PHONE, now)))
+        session.commit()
+        session.close()
+
+    def tearDown(self) -> None:
+        close_all_sessions()
+        drop_archives_before(datetime.max, self.engine)
+        Base.metadata.drop_all(bind=self.engine)
+
+    def count_tokens(self) -> int:
+        with self.engine.connect() as connection:
+            return connection.execute(select(func.count()).select_from(Token)).scalar()
+
+    def test_sweep_in_batches(self):
+        sweeper = TokenSweeper(batch_size=10, max_rows_per_second=0)
+        self.assertEqual(0, sweeper.sweep_batch(datetime(2000, 1, 1)))
+        self.assertEqual(25, sweeper.run_once())
+        self.assertEqual(5, self.count_tokens())
+        self.assertEqual(25, sweeper.stats.rows)
+        self.assertEqual(3, sweeper.stats.batches)
+        self.assertTrue(sweeper.stats.rows_per_second > 0)
+        self.assertEqual(0, sweeper.run_once())
+
+    def test_max_batches(self):
+        sweeper = TokenSweeper(batch_size=10, max_rows_per_second=0)
+        self.assertEqual(10, sweeper.run_once(max_batches=1))
+        self.assertEqual(20, self.count_tokens())
+
+    def test_throttle(self):
+        sweeper = TokenSweeper(batch_size=10, max_rows_per_second=100)
+        started = datetime.utcnow()
+        sweeper.run_once()
+        # 25 rows at 100 rows/s can't finish in less than 0.2s (the last batch isn't waited for)
+        self.assertTrue(datetime.utcnow() - started >= timedelta(seconds=0.2))
+
+    def test_archive_by_month_and_drop(self):
+        sweeper = TokenSweeper(batch_size=7, max_rows_per_second=0, archive=True)
+        self.assertEqual(25, sweeper.run_once())
+        self.assertEqual(['tokens_archive_202401', 'tokens_archive_202402'], archive_tables(self.engine))
+        with self.engine.connect() as connection:
+            january = connection.execute(select(func.count()).select_from(archive_table('202401'))).scalar()
+            february = connection.execute(select(func.count()).select_from(archive_table('202402'))).scalar()
+        self.assertEqual((15, 10), (january, february))
+        self.assertEqual(['tokens_archive_202401'], drop_archives_before(datetime(2024, 2, 1), self.engine))
+        self.assertEqual(['tokens_archive_202402'], archive_tables(self.engine))
+
+    def test_dropped_month_is_created_again(self):
+        sweeper = TokenSweeper(batch_size=10, max_rows_per_second=0, archive=True)
+        self.assertEqual(10, sweeper.run_once(max_batches=1))
+        drop_archives_before(datetime.max, self.engine)
+        self.assertEqual(15, sweeper.run_once())
+        self.assertEqual(['tokens_archive_202401', 'tokens_archive_202402'], archive_tables(self.engine))
+
+    def test_background_failure_is_logged(self):
+        sweeper = TokenSweeper()
+        sweeper.sweep_batch = Mock(side_effect=RuntimeError('database down'))
+        with self.assertLogs('numen.tokensweeper', 'ERROR') as logs:
+            sweeper.start(interval=0.01)
+            deadline = time.monotonic() + 5
+            while not sweeper.stats.errors and time.monotonic() < deadline:
+                time.sleep(0.01)
+            sweeper.stop()
+        self.assertIn('database down', logs.output[0])
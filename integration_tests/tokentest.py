@@ -10,6 +10,7 @@ from domain.models.token import TIME_SPAN, ExchangeMethods
 from domain.services import user_validation, email_validation, passwordservice
 from handlers import UserHandler
 from handlers.tokenhandler import TokenHandler
+from handlers.tokenstore import SqlTokenStore
 
 
 class TokenTest(TestCase):
@@ -17,6 +18,7 @@ class TokenTest(TestCase):
     def setUpClass() -> None:
         # reset all UserHandler dependencies
         UserHandler._Session = DBInitializer.get_session
+        UserHandler._ReadSession = DBInitializer.get_read_session
         UserHandler._user_validation = user_validation
         UserHandler._email_validation = email_validation
         UserHandler._hashing = passwordservice.hashing_password
@@ -25,6 +27,7 @@ class TokenTest(TestCase):
         # reset all token dependencies
         TokenHandler._Session = DBInitializer.get_session
         TokenHandler._get_user = UserHandler.get_user_by_id
+        TokenHandler._store = None
 
     def setUp(self) -> None:
         Base.metadata.create_all(bind=DBInitializer.get_engine())
@@ -169,3 +172,17 @@ class TokenTest(TestCase):
 
         result = self.generate_toke(user_id=user_id)
         self.assertTrue(result)
+
+    def test_failure_count_is_not_written_back_by_the_callers_session(self):
+        self.create_user(just_phone=True)
+        store = SqlTokenStore(DBInitializer.get_session)
+        session = DBInitializer.get_session()
+        token = session.query(Token).one()
+        store.register_failure(token)
+        self.assertEqual(1, token.failed_attempts)
+        self.assertFalse(session.is_modified(token))
+        # another request counts a failure before the caller commits
+        store.register_failure(store.latest(token.user_id))
+        session.commit()
+        session.close()
+        self.assertEqual(2, store.latest(token.user_id).failed_attempts)
@@ -1,15 +1,24 @@
+import time
 from dataclasses import dataclass
 from datetime import datetime
 from unittest import TestCase
+from unittest.mock import Mock
 
+from passlib.hash import pbkdf2_sha256
+from sqlalchemy import event
 from sqlalchemy.orm import close_all_sessions
 
-from core.exceptions import AuthenticationException, ValueException, SecurityException
+from core.exceptions import AuthenticationException, ValueException, SecurityException, OverloadException
 from domain.models import User, Token
-from domain.models import db_Base as Base, DBInitializer
+from domain.models import db_Base as Base, DBInitializer, unit_of_work
 from domain.models.token import ExchangeMethods
 from domain.models.user import UserState
+from domain.services import passwordservice
+from domain.services.hashingpolicy import HashingPolicy
 from handlers import UserHandler
+from handlers.tokenhandler import TokenHandler
+from handlers.tokenstore import MemoryTokenStore
+from handlers.urltokens import UrlTokenSigner, MemoryRevocationSet
 from integration_tests.helper import reset_user_handler_injection, reset_token_handler_injection
 
 
@@ -56,7 +65,9 @@ class UserTest(TestCase):
                     email='email@domain.tld', birth=datetime(1988, 1, 1).date())
         uid = UserHandler.create_user(user)
         u = UserHandler.get_user_by_id(uid)
-        u.first_name = 'New_Name'
+        # handlers return read only snapshots
+        with self.assertRaises(AttributeError):
+            u.first_name = 'New_Name'
         session.commit()
         n_u = UserHandler.get_user_by_id(uid)
         self.assertNotEqual(n_u.first_name, 'New_Name')
@@ -132,6 +143,115 @@ class UserTest(TestCase):
         self.assertIsNone(u.password)
         # endregion
 
+    def test_log_in_rehash_password_with_new_policy(self):
+        pss = 'Pa$$w0rd'
+        user = User(password=pss, first_name='first name', last_name='last name', phone='9121234567',
+                    email='email@domain.tld')
+        UserHandler.create_user(user)
+        passwordservice.set_hashing_policy(HashingPolicy(rounds=1000))
+        try:
+            UserHandler.log_in_by_email(user.email, pss)
+            # the new hash is written in the background, give it a moment
+            stored = None
+            for _ in range(100):
+                session = DBInitializer.get_session()
+                stored = session.query(User).get(user.uid).password
+                session.close()
+                if pbkdf2_sha256.from_string(stored).rounds == 1000:
+                    break
+                time.sleep(0.05)
+        finally:
+            passwordservice.set_hashing_policy(None)
+        self.assertEqual(1000, pbkdf2_sha256.from_string(stored).rounds)
+        u = UserHandler.log_in_by_phone(user.phone, pss)
+        self.assertEqual(user.uid, u.uid)
+
+    def test_bulk_create_users(self):
+        UserHandler.create_user(User(password='Pa$$w0rd', first_name='first name', last_name='last name',
+                                     phone='9120000000', email='taken@domain.tld'))
+        records = [{'first_name': 'first', 'last_name': f'last {i}', 'password': 'Pa$$w0rd',
+                    'email': f'user{i}@domain.tld', 'phone': f'91{i:08d}'} for i in range(1, 24)]
+        records[3]['password'] = 'weak'
+        records[5]['email'] = 'taken@domain.tld'
+        records[12]['phone'] = records[11]['phone']
+        records[20]['phone'] = None
+        report = UserHandler.bulk_create_users(iter(records), chunk_size=10)
+
+        self.assertEqual(list(range(23)), [row.index for row in report])
+        self.assertEqual(['Entered password is not valid!'], report[3].errors)
+        self.assertEqual(['Email is already registered!'], report[5].errors)
+        self.assertEqual(['Phone is already registered!'], report[12].errors)
+        failed = {3, 5, 12}
+        for row in report:
+            if row.index in failed:
+                self.assertIsNone(row.uid)
+            else:
+                self.assertEqual([], row.errors)
+                self.assertIsNotNone(row.uid)
+
+        session = DBInitializer.get_session()
+        self.assertEqual(1 + 20, session.query(User).count())
+        # two tokens per user, except the one without phone
+        self.assertEqual(2 + 20 * 2 - 1, session.query(Token).count())
+        session.close()
+        u = UserHandler.log_in_by_email('user1@domain.tld', 'Pa$$w0rd')
+        self.assertEqual(report[0].uid, u.uid)
+        self.assertEqual(UserState.OBSCURE.value, u.state)
+
+    def test_bulk_import_issues_tokens_through_the_store(self):
+        records = [{'first_name': 'first', 'last_name': 'last', 'password': 'Pa$$w0rd', 'email': f'user{i}@domain.tld',
+                    'phone': f'91{i:08d}'} for i in range(3)]
+        TokenHandler._store = MemoryTokenStore()
+        try:
+            report = UserHandler.bulk_create_users(records)
+            self.assertTrue(all(row.uid for row in report))
+            self.assertEqual(3 * 2, len(TokenHandler._store))
+            token = TokenHandler._store.latest(report[1].uid, ExchangeMethods.EMAIL.value)
+            UserHandler.verify_user_email_by_hex_token(report[1].uid, token.hex_token)
+            self.assertTrue(UserHandler.get_user_by_id(report[1].uid).is_email_verified)
+        finally:
+            TokenHandler._store = None
+        session = DBInitializer.get_session()
+        self.assertEqual(0, session.query(Token).count())
+        session.close()
+
+    def test_bulk_import_reports_unknown_keys(self):
+        records = [{'first_name': 'first', 'last_name': 'last', 'password': 'Pa$$w0rd', 'email': f'user{i}@domain.tld'}
+                   for i in range(3)]
+        records[1]['nick_name'] = 'nick'
+        report = UserHandler.bulk_create_users(records)
+        self.assertIsNone(report[1].uid)
+        self.assertEqual(1, len(report[1].errors))
+        self.assertIn('nick_name', report[1].errors[0])
+        self.assertTrue(report[0].uid and report[2].uid)
+
+    def test_bulk_import_reports_non_string_password(self):
+        records = [{'first_name': 'first', 'last_name': 'last', 'password': 'Pa$$w0rd', 'email': f'user{i}@domain.tld'}
+                   for i in range(2)]
+        records[0]['password'] = 123456
+        report = UserHandler.bulk_create_users(records)
+        self.assertIsNone(report[0].uid)
+        self.assertEqual(["Password Type must be string! Type is: <class 'int'>"], report[0].errors)
+        self.assertIsNotNone(report[1].uid)
+
+    def test_bulk_import_stops_when_hashing_is_saturated(self):
+        hashes = passwordservice.hashing_passwords
+        UserHandler._password_service = Mock(wraps=passwordservice)
+        UserHandler._password_service.hashing_passwords.side_effect = \
+            [hashes(['Pa$$w0rd'] * 2), OverloadException('Hashing executor is saturated!')]
+        records = [{'first_name': 'first', 'last_name': 'last', 'password': 'Pa$$w0rd', 'email': f'user{i}@domain.tld'}
+                   for i in range(5)]
+        try:
+            report = UserHandler.bulk_create_users(iter(records), chunk_size=2)
+            self.assertEqual(2, UserHandler._password_service.hashing_passwords.call_count)
+        finally:
+            UserHandler._password_service = passwordservice
+        self.assertEqual(list(range(5)), [row.index for row in report])
+        self.assertTrue(all(row.uid for row in report[:2]))
+        for row in report[2:]:
+            self.assertIsNone(row.uid)
+            self.assertEqual(["User couldn't be stored! Hashing executor is saturated!"], row.errors)
+
     def test_user_change_info(self):
         user = User(password='Pa$$w0rd', first_name='first name', last_name='last name', phone='9121234567',
                     email='email@domain.tld')
@@ -139,6 +259,8 @@ class UserTest(TestCase):
         u = UserHandler.update_user_info(user.uid, 'new name', 'new last name')
         self.assertEqual('new name', u.first_name)
         self.assertEqual('new last name', u.last_name)
+        # the snapshot cached while issuing the tokens is gone
+        self.assertEqual('new name', UserHandler.get_user_by_id(user.uid).first_name)
 
     def test_change_password(self):
         pss = 'Pa$$w0rd'
@@ -258,6 +380,62 @@ class UserTest(TestCase):
         self.assertEqual(user.is_phone_verified, True)
         self.assertEqual(UserState.ACTIVE.value, user.state)
 
+    def test_verifications_share_one_unit_of_work(self):
+        user_id = self.create_user().uid
+        session = DBInitializer.get_session()
+        phone_token = session.query(Token).filter_by(exchange_method=ExchangeMethods.PHONE.value).one()
+        email_token = session.query(Token).filter_by(exchange_method=ExchangeMethods.EMAIL.value).one()
+        session.close()
+        commits = []
+        engine = DBInitializer.get_engine()
+        listener = lambda connection: commits.append(connection)
+        event.listen(engine, 'commit', listener)
+        try:
+            with unit_of_work() as uow:
+                UserHandler.verify_user_phone_by_hex_token(user_id, phone_token.hex_token, session=uow)
+                UserHandler.verify_user_exchange_method_by_url_token(email_token.url_token, session=uow)
+        finally:
+            event.remove(engine, 'commit', listener)
+        self.assertEqual(1, len(commits))
+        self.assertEqual(UserState.ACTIVE.value, UserHandler.get_user_by_id(user_id).state)
+        session = DBInitializer.get_session()
+        self.assertTrue(all(token.last_used_time for token in session.query(Token).all()))
+        session.close()
+
+    def test_rolled_back_unit_of_work_keeps_failed_attempts(self):
+        user_id = self.create_user().uid
+        session = DBInitializer.get_session()
+        phone_token = session.query(Token).filter_by(exchange_method=ExchangeMethods.PHONE.value).one()
+        session.close()
+        with self.assertRaises(AuthenticationException):
+            with unit_of_work() as uow:
+                UserHandler.verify_user_phone_by_hex_token(user_id, 'wrong', session=uow)
+        with self.assertRaises(RuntimeError):
+            with unit_of_work() as uow:
+                UserHandler.verify_user_phone_by_hex_token(user_id, phone_token.hex_token, session=uow)
+                raise RuntimeError('the rest of the request failed')
+        self.assertFalse(UserHandler.get_user_by_id(user_id).is_phone_verified)
+        session = DBInitializer.get_session()
+        token = session.query(Token).filter_by(uid=phone_token.uid).one()
+        self.assertEqual(1, token.failed_attempts)
+        self.assertIsNone(token.last_used_time)
+        session.close()
+
+    def test_verify_by_signed_url_token(self):
+        TokenHandler._signer = UrlTokenSigner([b'secret'])
+        TokenHandler._revocations = MemoryRevocationSet()
+        try:
+            user_id = self.create_user().uid
+            session = DBInitializer.get_session()
+            email_token = session.query(Token).filter_by(exchange_method=ExchangeMethods.EMAIL.value).one()
+            session.close()
+            UserHandler.verify_user_exchange_method_by_url_token(email_token.url_token)
+            self.assertTrue(UserHandler.get_user_by_id(user_id).is_email_verified)
+            with self.assertRaises(SecurityException):
+                UserHandler.verify_user_exchange_method_by_url_token(email_token.url_token)
+        finally:
+            TokenHandler._signer = None
+
     def generate_user_and_verify_its_exchanges_fail_scenario(self):
         # I don't see any failed scenario
         raise NotImplementedError()